@@ -33,11 +33,17 @@ class Content:
         :param tags_database: The database with tags, so we can add the new tag.
         :return: The new tag, if the rule has created one.
         """
-        if hash(self) not in rule.applicable_content_ids_correct and hash(self) not in rule.applicable_content_ids_incorrect:
+        if not rule.applies_to(hash(self)):
             return None
 
-        tag = self.add_tag(rule.output_tag, rule=rule)
-        tags_database.add_tag(tag)
+        tag = self.get_tag_with_name(rule.output_tag)
+        if not tag:
+            tag = Tag(rule.output_tag, hash(self))
+            tag.rules.append(rule.rule_id)
+            tag = tags_database.add_tag(tag)
+            self.add_tag(tag)
+        elif rule.rule_id not in tag.rules:
+            tags_database.add_rule_to_tag(tag, rule.rule_id)
         return tag
 
     def __hash__(self):
@@ -0,0 +1,49 @@
+from typing import Sequence
+
+import numpy as np
+
+
+class AliasTable:
+    """
+    Walker's alias table for drawing indices with probabilities proportional to given weights in O(1) per draw.
+
+    Every index i has a column with probability prob[i] of drawing i itself, and otherwise draws alias[i]. A draw picks
+    a column uniformly at random and then flips a biased coin. The table is built in O(n) with Vose's method.
+    """
+
+    def __init__(self, weights: Sequence[float]):
+        weights = np.asarray(weights, dtype=np.float64)
+        total = weights.sum()
+        if len(weights) == 0 or total <= 0:
+            raise ValueError("An alias table requires at least one positive weight")
+
+        num_items = len(weights)
+        scaled = weights * (num_items / total)  # We normalize the weights, so they do not have to sum to 1
+        self.prob = np.ones(num_items)
+        self.alias = np.arange(num_items)
+
+        small = [ind for ind in range(num_items) if scaled[ind] < 1]
+        large = [ind for ind in range(num_items) if scaled[ind] >= 1]
+        while small and large:
+            small_ind = small.pop()
+            large_ind = large[-1]
+            self.prob[small_ind] = scaled[small_ind]
+            self.alias[small_ind] = large_ind
+            scaled[large_ind] -= 1 - scaled[small_ind]
+            if scaled[large_ind] < 1:
+                small.append(large.pop())
+        # The remaining columns are full (up to rounding errors), so they keep probability 1.
+
+    def __len__(self):
+        return len(self.prob)
+
+    def draw(self) -> int:
+        ind = np.random.randint(len(self.prob))
+        return ind if np.random.random() < self.prob[ind] else int(self.alias[ind])
+
+    def draw_batch(self, size: int) -> np.ndarray:
+        """
+        Draw many indices at once, with replacement.
+        """
+        inds = np.random.randint(len(self.prob), size=size)
+        return np.where(np.random.random(size) < self.prob[inds], inds, self.alias[inds])
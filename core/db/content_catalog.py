@@ -0,0 +1,293 @@
+from array import array
+from typing import Dict, FrozenSet, Iterable, List, Optional
+
+from core.content import Content
+from core.db.alias_table import AliasTable
+from core.db.content_database import ContentDatabase
+from core.db.rules_database import RulesDatabase
+from core.db.tags_database import TagsDatabase
+from core.tag import Tag
+
+
+class ContentCatalog:
+    """
+    The content items and tags known by any user in a simulation, shared by the databases of all users.
+    Content items, tags and sets of tag authors are interned, and identified by their index in the catalog.
+    The popularity of a content item is the one it had when it was first added to the catalog.
+    """
+
+    def __init__(self):
+        self.content_indices: Dict[int, int] = {}  # Content ID -> index
+        self.content_names: List[str] = []
+        self.content_popularities: List[float] = []
+        self.tags_for_content: List[List[int]] = []  # Content index -> indices of the tags on that content
+
+        self.tag_indices: Dict[int, int] = {}  # Tag hash -> index
+        self.tag_names: List[str] = []
+        self.tag_cids = array("q")
+        self.tag_hashes = array("q")
+
+        self.author_sets: List[FrozenSet[int]] = [frozenset()]
+        self.author_set_indices: Dict[FrozenSet[int], int] = {frozenset(): 0}
+
+    def intern_content(self, name: str, popularity: float) -> int:
+        cid = int(name)
+        content_index = self.content_indices.get(cid, None)
+        if content_index is None:
+            content_index = len(self.content_names)
+            self.content_indices[cid] = content_index
+            self.content_names.append(name)
+            self.content_popularities.append(popularity)
+            self.tags_for_content.append([])
+        return content_index
+
+    def intern_tag(self, name: str, cid: int) -> int:
+        tag_hash = hash((cid, name))
+        tag_index = self.tag_indices.get(tag_hash, None)
+        if tag_index is None:
+            tag_index = len(self.tag_names)
+            self.tag_indices[tag_hash] = tag_index
+            self.tag_names.append(name)
+            self.tag_cids.append(cid)
+            self.tag_hashes.append(tag_hash)
+            self.tags_for_content[self.intern_content(str(cid), 1)].append(tag_index)
+        return tag_index
+
+    def intern_authors(self, authors: Iterable[int]) -> int:
+        authors = frozenset(authors)
+        author_set_index = self.author_set_indices.get(authors, None)
+        if author_set_index is None:
+            author_set_index = len(self.author_sets)
+            self.author_set_indices[authors] = author_set_index
+            self.author_sets.append(authors)
+        return author_set_index
+
+
+class SharedTagAuthors:
+    """
+    The (mutable) set of authors of a shared tag, as seen by one user.
+    Like the authors set of a regular tag, votes refer to it and see later changes.
+    """
+
+    def __init__(self, tags_db: "SharedTagsDatabase", tag_index: int):
+        self.tags_db = tags_db
+        self.catalog = tags_db.catalog  # Also when the catalog is detached from the database, see parallel_reputations
+        self.tag_index = tag_index
+
+    def get(self) -> FrozenSet[int]:
+        return self.catalog.author_sets[self.tags_db.author_sets[self.tag_index]]
+
+    def add(self, author: int) -> None:
+        authors = self.get()
+        if author not in authors:
+            self.tags_db.author_sets[self.tag_index] = self.catalog.intern_authors(authors | {author})
+
+    def update(self, authors: Iterable[int]) -> None:
+        self.tags_db.author_sets[self.tag_index] = self.catalog.intern_authors(self.get().union(authors))
+
+    def __contains__(self, author) -> bool:
+        return author in self.get()
+
+    def __iter__(self):
+        return iter(self.get())
+
+    def __len__(self):
+        return len(self.get())
+
+    def __repr__(self):
+        return repr(set(self.get()))
+
+    def __reduce__(self):
+        # Copies of votes (e.g., sent to other processes) carry a plain set
+        return set, (list(self.get()),)
+
+
+class SharedTag(Tag):
+    """
+    A tag in the shared catalog, with the reputation, weight and authors assigned by one user.
+    """
+
+    def __init__(self, tags_db: "SharedTagsDatabase", tag_index: int):
+        self.tags_db = tags_db
+        self.tag_index = tag_index
+
+    @property
+    def name(self) -> str:
+        return self.tags_db.catalog.tag_names[self.tag_index]
+
+    @property
+    def cid(self) -> int:
+        return self.tags_db.catalog.tag_cids[self.tag_index]
+
+    @property
+    def rules(self):
+        return self.tags_db.rules.get(self.tag_index, ())
+
+    @property
+    def authors(self) -> SharedTagAuthors:
+        return SharedTagAuthors(self.tags_db, self.tag_index)
+
+    @property
+    def reputation_score(self) -> float:
+        return self.tags_db.reputations[self.tag_index]
+
+    @reputation_score.setter
+    def reputation_score(self, reputation_score: float) -> None:
+        self.tags_db.reputations[self.tag_index] = reputation_score
+
+    @property
+    def weight(self) -> float:
+        return self.tags_db.weights[self.tag_index]
+
+    @weight.setter
+    def weight(self, weight: float) -> None:
+        self.tags_db.weights[self.tag_index] = weight
+
+    def __eq__(self, other):
+        return isinstance(other, SharedTag) and other.tags_db is self.tags_db and other.tag_index == self.tag_index
+
+    def __hash__(self):
+        return self.tags_db.catalog.tag_hashes[self.tag_index]
+
+
+class SharedTagsDatabase(TagsDatabase):
+    """
+    The tags of a user, as an overlay over a shared content catalog.
+    Per-user state is kept in arrays indexed by the catalog index of a tag, and the rules that generated a tag are only
+    stored for the (few) tags that have been generated by a rule.
+    """
+
+    def __init__(self, rules_db: RulesDatabase, catalog: ContentCatalog):
+        self.rules_db = rules_db
+        self.catalog = catalog
+        self.order = array("i")  # The indices of the known tags, in the order they were added
+        self.positions = array("i")  # Tag index -> position in order, or -1 if we do not know the tag
+        self.reputations = array("d")
+        self.weights = array("d")
+        self.author_sets = array("i")  # Tag index -> index of the authors set in the catalog
+        self.rules: Dict[int, List[int]] = {}
+
+    def ensure_capacity(self, tag_index: int) -> None:
+        missing = tag_index + 1 - len(self.positions)
+        if missing > 0:
+            missing = max(missing, len(self.positions))  # Grow geometrically
+            self.positions.extend(array("i", [-1]) * missing)
+            self.reputations.extend(array("d", [0]) * missing)
+            self.weights.extend(array("d", [0]) * missing)
+            self.author_sets.extend(array("i", [0]) * missing)
+
+    def is_known(self, tag_index: int) -> bool:
+        return tag_index < len(self.positions) and self.positions[tag_index] >= 0
+
+    def add_tag(self, tag: Tag) -> SharedTag:
+        """
+        Add a tag, together with its authors, rules, reputation and weight.
+        :return: The tag in this database, which should be used to update the tag afterwards.
+        """
+        if isinstance(tag, SharedTag) and tag.tags_db is self:
+            return tag
+
+        tag_index = self.catalog.intern_tag(tag.name, tag.cid)
+        self.ensure_capacity(tag_index)
+        if self.positions[tag_index] < 0:
+            self.positions[tag_index] = len(self.order)
+            self.order.append(tag_index)
+        self.reputations[tag_index] = tag.reputation_score
+        self.weights[tag_index] = tag.weight
+        self.author_sets[tag_index] = self.catalog.intern_authors(tag.authors)
+        if tag.rules:
+            self.rules[tag_index] = list(tag.rules)
+        return SharedTag(self, tag_index)
+
+    def add_tags(self, tags: List[Tag]) -> List[SharedTag]:
+        return [self.add_tag(tag) for tag in tags]
+
+    def add_rule_to_tag(self, tag: SharedTag, rule_id: int) -> None:
+        if tag.tag_index not in self.rules:
+            self.rules[tag.tag_index] = []
+        self.rules[tag.tag_index].append(rule_id)
+
+    def get_tag(self, tag_id) -> Optional[SharedTag]:
+        tag_index = self.catalog.tag_indices.get(tag_id, None)
+        if tag_index is None or not self.is_known(tag_index):
+            return None
+        return SharedTag(self, tag_index)
+
+    def get_tags_for_content(self, content_index: int) -> List[SharedTag]:
+        tag_indices = [tag_index for tag_index in self.catalog.tags_for_content[content_index]
+                       if self.is_known(tag_index)]
+        tag_indices.sort(key=lambda tag_index: self.positions[tag_index])
+        return [SharedTag(self, tag_index) for tag_index in tag_indices]
+
+    def get_tags_created_by_user(self, user_id: int) -> List[SharedTag]:
+        author_sets = self.catalog.author_sets
+        return [SharedTag(self, tag_index) for tag_index in self.order
+                if user_id in author_sets[self.author_sets[tag_index]]]
+
+    def get_all_tags(self) -> List[SharedTag]:
+        return [SharedTag(self, tag_index) for tag_index in self.order]
+
+
+class SharedContent(Content):
+    """
+    A content item in the shared catalog, with the tags known by one user.
+    """
+
+    def __init__(self, content_db: "SharedContentDatabase", content_index: int):
+        self.content_db = content_db
+        self.content_index = content_index
+
+    @property
+    def name(self) -> str:
+        return self.content_db.catalog.content_names[self.content_index]
+
+    @property
+    def popularity(self) -> float:
+        return self.content_db.catalog.content_popularities[self.content_index]
+
+    @property
+    def tags(self) -> List[SharedTag]:
+        return self.content_db.tags_db.get_tags_for_content(self.content_index)
+
+    def get_tag_with_name(self, tag_str) -> Optional[SharedTag]:
+        return self.content_db.tags_db.get_tag(hash((int(self.name), tag_str)))
+
+    def add_tag(self, tag: Tag) -> None:
+        self.content_db.tags_db.add_tag(tag)
+
+
+class SharedContentDatabase(ContentDatabase):
+    """
+    The content of a user, as an overlay over a shared content catalog.
+    """
+
+    def __init__(self, tags_db: SharedTagsDatabase, catalog: ContentCatalog):
+        self.tags_db = tags_db
+        self.catalog = catalog
+        self.order = array("i")  # The indices of the known content items, in the order they were added
+        self.known = bytearray()
+        self.popularity_table: Optional[AliasTable] = None
+        self.popularity_table_content: List[SharedContent] = []
+
+    def is_known(self, content_index: int) -> bool:
+        return content_index < len(self.known) and bool(self.known[content_index])
+
+    def add_content(self, content: Content) -> SharedContent:
+        content_index = self.catalog.intern_content(content.name, content.popularity)
+        if not self.is_known(content_index):
+            if content_index >= len(self.known):
+                self.known.extend(bytes(max(content_index + 1 - len(self.known), len(self.known))))
+            self.known[content_index] = 1
+            self.order.append(content_index)
+            self.popularity_table = None
+        return SharedContent(self, content_index)
+
+    def get_content(self, cid: int) -> Optional[SharedContent]:
+        content_index = self.catalog.content_indices.get(cid, None)
+        if content_index is None or not self.is_known(content_index):
+            return None
+        return SharedContent(self, content_index)
+
+    def get_all_content(self) -> List[SharedContent]:
+        return [SharedContent(self, content_index) for content_index in self.order]
+
@@ -1,8 +1,8 @@
-from typing import List, Dict
-
-from numpy.random import choice
+from typing import List, Dict, Optional
 
 from core.content import Content
+from core.db.alias_table import AliasTable
+from core.rule_engine import get_rule_engine
 from core.tag import Tag
 
 
@@ -11,9 +11,13 @@ class ContentDatabase:
     def __init__(self, tags_db):
         self.content: Dict[int, Content] = {}
         self.tags_db = tags_db
+        self.popularity_table: Optional[AliasTable] = None  # Rebuilt lazily when the content changes
+        self.popularity_table_content: List[Content] = []
 
-    def add_content(self, content: Content):
+    def add_content(self, content: Content) -> Content:
         self.content[hash(content)] = content
+        self.popularity_table = None
+        return content
 
     def get_content(self, cid: int):
         return self.content[cid] if cid in self.content else None
@@ -21,14 +25,29 @@ class ContentDatabase:
     def get_all_content(self) -> List[Content]:
         return list(self.content.values())
 
+    def get_popularity_table(self) -> AliasTable:
+        if self.popularity_table is None:
+            self.popularity_table_content = self.get_all_content()
+            self.popularity_table = AliasTable([content.popularity for content in self.popularity_table_content])
+        return self.popularity_table
+
     def get_random_content_item_by_popularity(self):
-        popularities = [content.popularity for content in self.content.values()]
-        return choice(list(self.content.values()), p=popularities)
+        ind = self.get_popularity_table().draw()  # Rebuilds the list of content items if the content changed
+        return self.popularity_table_content[ind]
+
+    def get_random_content_items_by_popularity(self, num_items: int) -> List[Content]:
+        """
+        Draw content items (with replacement) with probabilities proportional to their popularity.
+        """
+        inds = self.get_popularity_table().draw_batch(num_items)
+        return [self.popularity_table_content[ind] for ind in inds.tolist()]
 
     def apply_rule(self, rule) -> List[Tag]:
-        new_tags = []
-        for content_item in self.get_all_content():
-            new_tag = content_item.apply_rule(rule, self.tags_db)
-            if new_tag:
-                new_tags.append(new_tag)
-        return new_tags
+        return self.apply_rules([rule])[rule.rule_id]
+
+    def apply_rules(self, rules) -> Dict[int, List[Tag]]:
+        """
+        Apply rules to all content in this database.
+        :return: The tags generated by every rule, by rule ID.
+        """
+        return get_rule_engine(rules).apply(self)
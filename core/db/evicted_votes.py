@@ -0,0 +1,117 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from core.vote import Vote
+
+
+class EvictedVotes:
+    """
+    The votes that were evicted from a votes database, in a compact form. Per voter, we store the hashes of the tags it
+    voted on (sorted) with the sign of every vote, and the number of up- and downvotes per rule. We also store the
+    hashes of the evicted votes, so votes that link to them can be linked to the checkpoint instead. This takes 17 bytes
+    per evicted vote, plus a counter per voter and rule, instead of a vote object and its entries in all indexes.
+
+    The tag reputations need the evicted votes per tag, so we build an index of all evicted votes sorted by tag hash
+    when they are first requested after an eviction.
+    """
+
+    def __init__(self):
+        self.tag_hashes: Dict[int, np.ndarray] = {}  # Voter ID -> sorted hashes of the tags the voter voted on
+        self.signs: Dict[int, np.ndarray] = {}  # Voter ID -> the signs of these votes (1 or -1)
+        self.rule_signs: Dict[int, Dict[int, List[int]]] = {}  # Voter ID -> rule ID -> [upvotes, downvotes]
+        self.vote_hashes: np.ndarray = np.zeros(0, dtype=np.int64)  # The hashes of the evicted votes, sorted
+
+        # All evicted votes, sorted by tag hash: the tag hashes, voter IDs and signs (None if not built yet)
+        self.tag_index: Optional[Tuple[np.ndarray, np.ndarray, np.ndarray]] = None
+
+    def add(self, votes: List[Vote]) -> None:
+        votes_per_user: Dict[int, List[Vote]] = {}
+        for vote in votes:
+            if vote.user_id not in votes_per_user:
+                votes_per_user[vote.user_id] = []
+            votes_per_user[vote.user_id].append(vote)
+
+            if vote.user_id not in self.rule_signs:
+                self.rule_signs[vote.user_id] = {}
+            user_rule_signs = self.rule_signs[vote.user_id]
+            for rule_id in vote.rules_ids or ():
+                if rule_id not in user_rule_signs:
+                    user_rule_signs[rule_id] = [0, 0]
+                user_rule_signs[rule_id][0 if vote.is_accurate else 1] += 1
+
+        for user_id, user_votes in votes_per_user.items():
+            tag_hashes = np.array([hash((vote.cid, vote.tag)) for vote in user_votes], dtype=np.int64)
+            signs = np.array([1 if vote.is_accurate else -1 for vote in user_votes], dtype=np.int8)
+            if user_id in self.tag_hashes:
+                tag_hashes = np.concatenate((self.tag_hashes[user_id], tag_hashes))
+                signs = np.concatenate((self.signs[user_id], signs))
+            order = np.argsort(tag_hashes, kind="stable")  # Keeps the votes of a voter on a tag in eviction order
+            self.tag_hashes[user_id] = tag_hashes[order]
+            self.signs[user_id] = signs[order]
+        self.vote_hashes = np.sort(np.concatenate((self.vote_hashes,
+                                                   np.array([hash(vote) for vote in votes], dtype=np.int64))))
+        self.tag_index = None
+
+    def contains_vote(self, vote_hash: int) -> bool:
+        ind = np.searchsorted(self.vote_hashes, vote_hash)
+        return ind < len(self.vote_hashes) and self.vote_hashes[ind] == vote_hash
+
+    def contains(self, user_id: int, tag_hash: int) -> bool:
+        """
+        Return whether we evicted a vote of the given user on the given tag.
+        """
+        tag_hashes = self.tag_hashes.get(user_id, None)
+        if tag_hashes is None:
+            return False
+        ind = np.searchsorted(tag_hashes, tag_hash)
+        return ind < len(tag_hashes) and tag_hashes[ind] == tag_hash
+
+    def get_tag_signs(self, user_id: int) -> Iterable[Tuple[int, int]]:
+        """
+        Return the (tag hash, sign) of every evicted vote of a user.
+        """
+        if user_id not in self.tag_hashes:
+            return []
+        return zip(self.tag_hashes[user_id].tolist(), self.signs[user_id].tolist())
+
+    def get_rule_signs(self, user_id: int) -> Dict[int, List[int]]:
+        """
+        Return the number of up- and downvotes of a user per rule, in its evicted votes.
+        """
+        return self.rule_signs.get(user_id, {})
+
+    def build_tag_index(self) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        if self.tag_index is None:
+            user_ids = list(self.tag_hashes.keys())
+            tag_hashes = np.concatenate([self.tag_hashes[user_id] for user_id in user_ids]) if user_ids \
+                else np.zeros(0, dtype=np.int64)
+            voter_ids = np.repeat(np.array(user_ids, dtype=np.int64), [len(self.tag_hashes[user_id])
+                                                                      for user_id in user_ids])
+            signs = np.concatenate([self.signs[user_id] for user_id in user_ids]) if user_ids \
+                else np.zeros(0, dtype=np.int8)
+            order = np.argsort(tag_hashes, kind="stable")
+            self.tag_index = tag_hashes[order], voter_ids[order], signs[order]
+        return self.tag_index
+
+    def get_votes_for_tag(self, tag_hash: int) -> List[Tuple[int, int]]:
+        """
+        Return the (voter ID, sign) of the first evicted vote of every voter on a tag.
+        """
+        if not self.tag_hashes:
+            return []
+        tag_hashes, voter_ids, signs = self.build_tag_index()
+        start, end = np.searchsorted(tag_hashes, [tag_hash, tag_hash + 1])
+        votes = {}
+        for voter_id, sign in zip(voter_ids[start:end].tolist(), signs[start:end].tolist()):
+            if voter_id not in votes:
+                votes[voter_id] = sign
+        return list(votes.items())
+
+    def get_all_votes(self) -> Iterable[Tuple[int, int, int]]:
+        """
+        Return the (tag hash, voter ID, sign) of every evicted vote, sorted by tag hash.
+        """
+        if not self.tag_hashes:
+            return []
+        return zip(*(column.tolist() for column in self.build_tag_index()))
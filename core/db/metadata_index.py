@@ -0,0 +1,175 @@
+import re
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+EMPTY_IDS = np.zeros(0, dtype=np.int64)
+
+
+class Condition:
+    """
+    A single comparison of a metadata attribute with a value, e.g., year>2010.
+    """
+
+    OPERATORS = ("<=", ">=", "!=", "=", "<", ">")
+
+    def __init__(self, attribute: str, operator: str, value):
+        self.attribute = attribute
+        self.operator = operator
+        self.value = value
+
+    @staticmethod
+    def parse(text: str) -> "Condition":
+        for operator in Condition.OPERATORS:
+            attribute, found, value = text.partition(operator)
+            if found:
+                attribute, value = attribute.strip().lower(), value.strip()
+                if not re.fullmatch(r"\w+", attribute) or not value:
+                    break
+                return Condition(attribute, operator, normalize_value(value))
+        raise ValueError("Invalid condition: %s" % text)
+
+    def key(self) -> Tuple:
+        return self.attribute, self.operator, self.value
+
+    def __str__(self):
+        return "%s%s%s" % self.key()
+
+
+def normalize_value(value):
+    """
+    Metadata values are compared as numbers if they are numeric, and as lowercase strings otherwise.
+    """
+    if isinstance(value, (int, float)) and not isinstance(value, bool):
+        return value
+    value = str(value).strip().lower()
+    try:
+        return int(value)
+    except ValueError:
+        try:
+            return float(value)
+        except ValueError:
+            return value
+
+
+def parse_predicate(predicate: str) -> List[Condition]:
+    """
+    Parse a conjunction of conditions, e.g., "quality=1080p AND year>2010".
+    """
+    parts = re.split(r"\s+AND\s+", predicate.strip(), flags=re.IGNORECASE)
+    if not predicate.strip() or any(not part.strip() for part in parts):
+        raise ValueError("Invalid predicate: %s" % predicate)
+    return [Condition.parse(part) for part in parts]
+
+
+def intersect_sorted(small: np.ndarray, large: np.ndarray) -> np.ndarray:
+    """
+    Intersect two sorted arrays of unique IDs, in time proportional to the size of the smaller one.
+    """
+    if not len(small) or not len(large):
+        return EMPTY_IDS
+    inds = np.minimum(np.searchsorted(large, small), len(large) - 1)
+    return small[large[inds] == small]
+
+
+class MetadataIndex:
+    """
+    An inverted index over the metadata of content items (e.g., the title, year, quality and codec inferred by PTN).
+
+    For every attribute, we store the (sorted) IDs of the content items with each value, and numeric attributes are
+    also sorted by value so range conditions are answered with a binary search. Evaluating a predicate therefore costs
+    time proportional to the number of index entries it touches, rather than to the number of content items.
+    """
+
+    def __init__(self):
+        self.postings: Dict[str, Dict[object, List[int]]] = {}  # Attribute -> value -> content IDs
+        self.frozen_postings: Dict[str, Dict[object, np.ndarray]] = {}
+        self.numeric_values: Dict[str, Tuple[np.ndarray, np.ndarray]] = {}  # Attribute -> (sorted values, content IDs)
+        self.condition_cache: Dict[Tuple, np.ndarray] = {}
+
+    def add_content(self, content_id: int, metadata: Dict) -> None:
+        for attribute, value in metadata.items():
+            values = value if isinstance(value, list) else [value]
+            attribute_postings = self.postings.setdefault(attribute.lower(), {})
+            for single_value in values:
+                attribute_postings.setdefault(normalize_value(single_value), []).append(content_id)
+
+        # The lookup structures are rebuilt the next time they are needed
+        self.frozen_postings = {}
+        self.numeric_values = {}
+        self.condition_cache = {}
+
+    def get_postings(self, attribute: str) -> Dict[object, np.ndarray]:
+        if attribute not in self.frozen_postings:
+            self.frozen_postings[attribute] = {value: np.unique(np.array(content_ids, dtype=np.int64))
+                                               for value, content_ids in self.postings.get(attribute, {}).items()}
+        return self.frozen_postings[attribute]
+
+    def get_numeric_values(self, attribute: str) -> Tuple[np.ndarray, np.ndarray]:
+        if attribute not in self.numeric_values:
+            values, content_ids = [], []
+            for value, value_content_ids in self.get_postings(attribute).items():
+                if isinstance(value, (int, float)):
+                    values += [value] * len(value_content_ids)
+                    content_ids.append(value_content_ids)
+            values = np.array(values, dtype=np.float64)
+            content_ids = np.concatenate(content_ids) if content_ids else EMPTY_IDS
+            order = np.argsort(values, kind="stable")
+            self.numeric_values[attribute] = values[order], content_ids[order]
+        return self.numeric_values[attribute]
+
+    def lookup(self, condition: Condition) -> np.ndarray:
+        """
+        Return the sorted IDs of the content items that satisfy a condition.
+        """
+        content_ids = self.condition_cache.get(condition.key(), None)
+        if content_ids is not None:
+            return content_ids
+
+        postings = self.get_postings(condition.attribute)
+        if condition.operator == "=":
+            content_ids = postings.get(condition.value, EMPTY_IDS)
+        elif condition.operator == "!=":
+            other_content_ids = [ids for value, ids in postings.items() if value != condition.value]
+            content_ids = np.unique(np.concatenate(other_content_ids)) if other_content_ids else EMPTY_IDS
+        else:
+            if not isinstance(condition.value, (int, float)):
+                raise ValueError("Condition %s compares with a non-numeric value" % condition)
+            values, value_content_ids = self.get_numeric_values(condition.attribute)
+            if condition.operator in ("<", "<="):
+                end = np.searchsorted(values, condition.value, side="left" if condition.operator == "<" else "right")
+                content_ids = value_content_ids[:end]
+            else:
+                start = np.searchsorted(values, condition.value, side="right" if condition.operator == ">" else "left")
+                content_ids = value_content_ids[start:]
+            content_ids = np.unique(content_ids)
+
+        self.condition_cache[condition.key()] = content_ids
+        return content_ids
+
+    def evaluate(self, conditions: Iterable[Condition]) -> np.ndarray:
+        """
+        Return the sorted IDs of the content items that satisfy all conditions.
+        We intersect the matches of the conditions starting with the most selective one.
+        """
+        matches: Optional[np.ndarray] = None
+        for content_ids in sorted((self.lookup(condition) for condition in conditions), key=len):
+            matches = content_ids if matches is None else intersect_sorted(matches, content_ids)
+            if not len(matches):
+                break
+        return EMPTY_IDS if matches is None else matches
+
+
+def load_ptn_metadata(filenames: Iterable[str]) -> MetadataIndex:
+    """
+    Build a metadata index from torrent filenames, with the metadata inferred by PTN (see generate_knowledge_graph).
+    The content ID of a torrent is its position in the list.
+    """
+    import PTN
+
+    index = MetadataIndex()
+    for content_id, filename in enumerate(filenames):
+        metadata = PTN.parse(filename)
+        metadata.pop("excess", None)
+        index.add_content(content_id, metadata)
+    return index
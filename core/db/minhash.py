@@ -0,0 +1,145 @@
+from collections import OrderedDict
+from itertools import islice
+from typing import Dict, List, Optional, Set, Tuple
+
+import numpy as np
+
+
+class MinHashSignatures:
+    """
+    MinHash signatures of the (content, tag) pairs and rules that users voted on, shared by the trust databases of all
+    users, with LSH banding to find the pairs of users that are likely to have voted on the same tags or rules.
+
+    Two users only have a non-zero similarity if they voted on a common tag or rule, which is the case for few pairs of
+    users. The signature of a user is split into bands of rows, and two users become a candidate pair if all rows of any
+    band are equal. The probability that this happens for two users with Jaccard similarity J is 1 - (1 - J^rows)^bands.
+
+    The signature of a user only depends on the votes of that user, so we key the signatures by the user and the digest
+    of these votes (see VotesDatabase.get_vote_digest), like the SimilarityMemo. Users that know the same votes of
+    another user therefore share its signature, and the least recently used signatures are evicted first.
+    """
+
+    def __init__(self, bands: int, rows: int, capacity: int, seed: int = 42):
+        self.bands = bands
+        self.rows = rows
+        self.capacity = capacity
+        rand = np.random.RandomState(seed)  # We do not use (and advance) the global random number generator
+        self.multipliers = rand.randint(0, 2 ** 63, size=bands * rows, dtype=np.int64).astype(np.uint64) * 2 + 1
+        self.offsets = rand.randint(0, 2 ** 63, size=bands * rows, dtype=np.int64).astype(np.uint64)
+        self.entries: OrderedDict = OrderedDict()  # (User ID, vote digest) -> signature
+
+    @staticmethod
+    def get_elements(votes) -> List[int]:
+        elements = []
+        for vote in votes:
+            elements.append(hash((vote.cid, vote.tag)))
+            elements += [hash(("rule", rule_id)) for rule_id in vote.rules_ids or ()]
+        return elements
+
+    @staticmethod
+    def get_evicted_elements(evicted_votes, user_id: int) -> List[int]:
+        elements = [tag_hash for tag_hash, _ in evicted_votes.get_tag_signs(user_id)]
+        elements += [hash(("rule", rule_id)) for rule_id in evicted_votes.get_rule_signs(user_id).keys()]
+        return elements
+
+    def hash_elements(self, elements: List[int]) -> np.ndarray:
+        """
+        Return the minimum of every hash function over the given elements.
+        """
+        values = np.array(elements, dtype=np.int64).view(np.uint64)[:, np.newaxis]
+        hashes = values * self.multipliers + self.offsets  # Wraps around modulo 2^64
+        hashes ^= hashes >> np.uint64(31)
+        return hashes.min(axis=0)
+
+    def get(self, key: Tuple[int, int]) -> Optional[np.ndarray]:
+        signature = self.entries.get(key, None)
+        if signature is not None:
+            self.entries.move_to_end(key)
+        return signature
+
+    def put(self, key: Tuple[int, int], signature: np.ndarray) -> None:
+        self.entries[key] = signature
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    def __len__(self):
+        return len(self.entries)
+
+
+class MinHashCandidates:
+    """
+    Selects the candidate pairs of users from the perspective of one user, with the signatures in the shared
+    MinHashSignatures. We only remember which votes of every user we included in its signature (their number and
+    digest), so a signature can be extended with the votes that arrived since.
+    """
+
+    def __init__(self, signatures: MinHashSignatures):
+        self.signatures = signatures
+        self.indexed_votes: Dict[int, Tuple[int, int]] = {}  # User ID -> number and digest of the included votes
+
+    def __getstate__(self):
+        # The shared signatures are not part of the state of this user, see parallel_reputations and checkpoint
+        state = self.__dict__.copy()
+        state["signatures"] = None
+        return state
+
+    def get_signature(self, votes_db, user_id: int) -> Optional[np.ndarray]:
+        """
+        Return the signature of the votes of a user that we know.
+
+        The votes of a user (in votes_db.votes_per_user) are kept in the order they arrived and are only removed when
+        they are evicted (see VotesDatabase.apply_retention), which counts them in num_evicted_votes. The votes we did
+        not include yet are therefore the ones after the first (number of included - number of evicted) votes. If we
+        did not include votes that have been evicted since, we include the tags and rules of the evicted votes instead.
+        """
+        votes = votes_db.votes_per_user[user_id]
+        num_evicted = votes_db.num_evicted_votes.get(user_id, 0)
+        digest = votes_db.get_vote_digest(user_id)
+        signature = self.signatures.get((user_id, digest))
+        if signature is None:
+            num_indexed, indexed_digest = self.indexed_votes.get(user_id, (0, None))
+            assert len(votes) + num_evicted >= num_indexed, "Votes were removed without being counted as evicted"
+            signature = self.signatures.get((user_id, indexed_digest))
+            if signature is None or num_indexed < num_evicted:
+                # We cannot extend the signature we included votes in (anymore), so we hash all votes of the user
+                signature, num_indexed = None, num_evicted
+            elements = self.signatures.get_elements(islice(votes, num_indexed - num_evicted, None))
+            if num_evicted and signature is None:
+                elements += self.signatures.get_evicted_elements(votes_db.evicted_votes, user_id)
+            if elements:
+                new_signature = self.signatures.hash_elements(elements)
+                signature = new_signature if signature is None else np.minimum(signature, new_signature)
+            if signature is None:
+                return None  # We know no votes of this user
+            self.signatures.put((user_id, digest), signature)
+
+        self.indexed_votes[user_id] = (len(votes) + num_evicted, digest)
+        return signature
+
+    def get_candidate_pairs(self, votes_db) -> Set[Tuple[int, int]]:
+        """
+        Return the pairs of users (in both orders) that share a bucket in at least one band.
+        """
+        user_ids, signatures = [], []
+        for user_id in votes_db.votes_per_user.keys():
+            signature = self.get_signature(votes_db, user_id)
+            if signature is not None:
+                user_ids.append(user_id)
+                signatures.append(signature)
+        if not user_ids:
+            return set()
+
+        signatures = np.stack(signatures)
+        rows = self.signatures.rows
+        candidates = set()
+        for band in range(self.signatures.bands):
+            buckets: Dict[bytes, List[int]] = {}
+            band_rows = signatures[:, band * rows:(band + 1) * rows]
+            for user_id, band_row in zip(user_ids, band_rows):
+                buckets.setdefault(band_row.tobytes(), []).append(user_id)
+            for bucket in buckets.values():
+                for user_a in bucket:
+                    for user_b in bucket:
+                        candidates.add((user_a, user_b))
+        return candidates
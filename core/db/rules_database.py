@@ -1,6 +1,7 @@
 from typing import List
 
 from core.rule import Rule
+from core.rule_engine import get_rule_engine
 
 
 class RulesDatabase:
@@ -22,6 +23,14 @@ class RulesDatabase:
     def get_rule(self, rule_id):
         return self.rules[rule_id] if rule_id in self.rules else None
 
+    def get_rules_for_content(self, content_id: int) -> List[Rule]:
+        """
+        Return the rules that apply to a content item. The content index is kept by the rule engine of our rules, which
+        is shared with the users that have copies of the same rules, and rebuilt when the coverage of a rule changes.
+        """
+        engine = get_rule_engine(self.rules.values())
+        return [self.rules[rule_id] for rule_id in engine.get_rule_ids_for_content(content_id)]
+
     def get_rule_ids_created_by_user(self, user_id: int) -> List[int]:
         return self.rules_by_author[user_id] if user_id in self.rules_by_author else []
 
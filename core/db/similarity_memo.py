@@ -0,0 +1,42 @@
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+
+class SimilarityMemo:
+    """
+    A cache with the similarity coefficients of pairs of users, shared by the trust databases of all users.
+
+    The similarity of two users only depends on their votes, so we key the cache by the digests of the votes of both
+    users (see VotesDatabase.get_vote_digest) rather than by their IDs. Users that know the same votes of a pair of
+    users therefore compute their similarity only once. The least recently used entries are evicted first.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.entries: OrderedDict = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+
+    def get(self, key: Tuple[int, int]) -> Optional[float]:
+        similarity = self.entries.get(key, None)
+        if similarity is None:
+            self.misses += 1
+            return None
+        self.entries.move_to_end(key)
+        self.hits += 1
+        return similarity
+
+    def put(self, key: Tuple[int, int], similarity: float) -> None:
+        self.entries[key] = similarity
+        self.entries.move_to_end(key)
+        if len(self.entries) > self.capacity:
+            self.entries.popitem(last=False)
+
+    @property
+    def hit_rate(self) -> float:
+        lookups = self.hits + self.misses
+        return self.hits / lookups if lookups else 0
+
+    def __str__(self):
+        return "SimilarityMemo(%d entries, %d hits, %d misses, hit rate %.3f)" % (
+            len(self.entries), self.hits, self.misses, self.hit_rate)
@@ -15,11 +15,23 @@ class TagsDatabase:
         self.tags = {}
         self.tags_for_content = {}  # Content ID -> List[Tag]
 
-    def add_tag(self, tag: Tag):
+    def add_tag(self, tag: Tag) -> Tag:
         if tag.cid not in self.tags_for_content:
             self.tags_for_content[tag.cid] = []
         self.tags_for_content[tag.cid].append(tag)
         self.tags[hash(tag)] = tag
+        return tag
+
+    def add_tags(self, tags: List[Tag]) -> List[Tag]:
+        for tag in tags:
+            if tag.cid not in self.tags_for_content:
+                self.tags_for_content[tag.cid] = []
+            self.tags_for_content[tag.cid].append(tag)
+        self.tags.update((hash(tag), tag) for tag in tags)
+        return tags
+
+    def add_rule_to_tag(self, tag: Tag, rule_id: int) -> None:
+        tag.rules.append(rule_id)
 
     def get_tag(self, tag_id):
         return self.tags.get(tag_id, None)
@@ -1,11 +1,18 @@
 import random
-from typing import Set
+import time
+from operator import attrgetter
+from typing import Dict, List, Optional, Set, Tuple
 
 import networkx as nx
 import numpy as np
 from numpy import average
 
 from core import GENESIS_HASH
+from core.db.minhash import MinHashCandidates, MinHashSignatures
+from core.db.similarity_memo import SimilarityMemo
+from core.profiler import profiled, profiler
+from core.tracer import TraceLevel, tracer
+from core.vote import Vote
 
 
 class TrustDatabase:
@@ -20,6 +27,66 @@ class TrustDatabase:
 
         self.pagerank_scores = {}
 
+        # The depth beyond which confirmed vote DAG nodes are replaced by a checkpoint (None to keep the full DAG), and
+        # the PageRank mass of the replaced nodes, per voter.
+        self.checkpoint_depth: Optional[int] = None
+        self.checkpoint_mass: Dict[int, float] = {}
+
+        # Selects the pairs of users whose similarity we compute with MinHash signatures (None to compute all pairs)
+        self.minhash: Optional[MinHashCandidates] = None
+
+        # The sparsification of the flow graph (None to use the dense flow graph)
+        self.sparsify_top_k: Optional[int] = None
+        self.sparsify_threshold: Optional[float] = None
+
+        # The cache with similarities that is shared with the trust databases of other users (if any)
+        self.similarity_memo: Optional[SimilarityMemo] = None
+
+    def __getstate__(self):
+        # The shared cache is not part of the state of this user, see parallel_reputations and checkpoint
+        state = self.__dict__.copy()
+        state["similarity_memo"] = None
+        return state
+
+    def enable_candidate_filtering(self, signatures: MinHashSignatures) -> None:
+        self.minhash = MinHashCandidates(signatures)
+
+    def get_candidate_pairs(self) -> Optional[Set[Tuple[int, int]]]:
+        """
+        Return the pairs of users that are likely to have a non-zero similarity, or None to compute all pairs.
+        """
+        if not self.minhash:
+            return None
+        return self.minhash.get_candidate_pairs(self.votes_db)
+
+    def enable_vote_dag_checkpoints(self, depth: int) -> None:
+        self.checkpoint_depth = depth
+
+    @profiled("checkpoint_vote_dag", attrgetter("my_id"))
+    def checkpoint_vote_dag(self, evicted_votes: List[Vote] = ()) -> int:
+        """
+        Replace the nodes of the vote DAG that are confirmed beyond the checkpoint depth (if enabled) and the nodes of
+        the given evicted votes by a checkpoint (the genesis node, from which tip selection starts its walks). The
+        PageRank mass these nodes had in our last tip selection is added to the mass of their voters in the checkpoint,
+        so the graph influences still include it (see compute_graph_influences). This bounds the cost of tip selection
+        by the recent activity rather than by the full history.
+        :param evicted_votes: The votes that were just evicted from the votes database, whose authors we cannot look up
+        anymore.
+        :return: The number of replaced nodes.
+        """
+        voters = {hash(vote): vote.user_id for vote in evicted_votes}
+        nodes = [node for node in voters.keys() if node in self.votes_db.vote_dag]
+        if self.checkpoint_depth is not None:
+            nodes += [node for node in self.votes_db.get_confirmed_nodes(self.checkpoint_depth) if node not in voters]
+        for node in nodes:
+            voter_id = voters[node] if node in voters else self.votes_db.get_vote_author(node)
+            mass = self.pagerank_scores.pop(node, 0)
+            if voter_id is not None and mass > 0:
+                self.checkpoint_mass[voter_id] = self.checkpoint_mass.get(voter_id, 0) + mass
+        self.votes_db.checkpoint_vote_dag(nodes)
+        return len(nodes)
+
+    @profiled("select_vote_dag_tips", attrgetter("my_id"))
     def select_vote_dag_tips(self) -> Set[int]:
         """
         Determine the tips on which we build our next vote.
@@ -27,12 +94,14 @@ class TrustDatabase:
         # Copy the DAG and reverse the edges
         walk_dag = nx.DiGraph()
         walk_dag.add_node(GENESIS_HASH)
-        for from_edge, to_edge in self.votes_db.vote_dag.edges():
-            from_vote = self.votes_db.votes[from_edge]
-            user_rep = self.user_reputations[from_vote.user_id] if from_vote.user_id in self.user_reputations else 0
+        for from_edge, to_edge in self.votes_db.get_vote_dag_edges():
+            voter_id = self.votes_db.get_vote_author(from_edge)
+            user_rep = self.user_reputations[voter_id] if voter_id in self.user_reputations else 0
             if user_rep > 0:
                 walk_dag.add_edge(to_edge, from_edge, weight=user_rep)
 
+        if profiler.enabled:
+            profiler.count("tip_selection_edges", self.my_id, walk_dag.number_of_edges())
         self.pagerank_scores = nx.pagerank_numpy(walk_dag, personalization={GENESIS_HASH: 1}, alpha=1)
 
         ssum = 0
@@ -52,16 +121,21 @@ class TrustDatabase:
 
         return np.random.choice(node_ids, min(len(exit_probs), 2), p=exit_probs)
 
+    @profiled("compute_similarities", attrgetter("my_id"))
     def compute_similarities(self):
         """
         Compute the similarity scores to all neighbours, based on the acquired local knowledge.
         """
         self.similarity_scores = {}
+        candidate_pairs = self.get_candidate_pairs()
         for uid1 in self.votes_db.votes_per_user.keys():
             for uid2 in self.votes_db.votes_per_user.keys():
                 if uid1 == uid2 and uid1 != self.my_id:
                     continue
-                similarity = self.compute_similarity_coefficient(uid1, uid2)
+                if candidate_pairs is None or (uid1, uid2) in candidate_pairs:
+                    similarity = self.get_memoized_similarity(uid1, uid2)
+                else:
+                    similarity = 0  # These users did not vote on the same tags or rules (with high probability)
 
                 if uid1 not in self.similarity_scores:
                     self.similarity_scores[uid1] = {}
@@ -70,6 +144,40 @@ class TrustDatabase:
 
                 self.similarity_scores[uid1][uid2] = similarity
 
+    def get_memoized_similarity(self, uid1, uid2):
+        """
+        Return the similarity coefficient of two users, from the shared cache if another user (or we) computed the
+        similarity of the same votes before.
+        """
+        if not self.similarity_memo:
+            return self.compute_similarity_coefficient(uid1, uid2)
+
+        key = (self.votes_db.get_vote_digest(uid1), self.votes_db.get_vote_digest(uid2))
+        similarity = self.similarity_memo.get(key)
+        if similarity is None:
+            similarity = self.compute_similarity_coefficient(uid1, uid2)
+            self.similarity_memo.put(key, similarity)
+        return similarity
+
+    def evaluate_candidate_recall(self) -> Dict:
+        """
+        Compare the candidate pairs with the exhaustive all-pairs computation.
+        :return: The number of pairs, the number of candidate pairs, the number of pairs with a non-zero similarity,
+                 and the fraction of these pairs that are candidates (the recall).
+        """
+        candidate_pairs = self.get_candidate_pairs()
+        user_ids = list(self.votes_db.votes_per_user.keys())
+        pairs = [(uid1, uid2) for uid1 in user_ids for uid2 in user_ids if uid1 != uid2]
+        nonzero_pairs = [pair for pair in pairs if self.compute_similarity_coefficient(*pair) != 0]
+        found_pairs = [pair for pair in nonzero_pairs if candidate_pairs is None or pair in candidate_pairs]
+        return {
+            "pairs": len(pairs),
+            "candidate_pairs": len(pairs) if candidate_pairs is None else len([pair for pair in pairs
+                                                                                if pair in candidate_pairs]),
+            "nonzero_pairs": len(nonzero_pairs),
+            "recall": len(found_pairs) / len(nonzero_pairs) if nonzero_pairs else 1,
+        }
+
     def get_similarity_coefficient(self, uid1, uid2):
         return self.similarity_scores[uid1][uid2] if uid1 in self.similarity_scores and uid2 in self.similarity_scores[uid1] else 0
 
@@ -92,9 +200,10 @@ class TrustDatabase:
                     votes_on_rules[rule_id] = ([], [])
                 votes_on_rules[rule_id][0].append(1 if vote.is_accurate else -1)
 
-            if (vote.cid, vote.tag) not in votes_on_tags:
-                votes_on_tags[(vote.cid, vote.tag)] = ([], [])
-            votes_on_tags[(vote.cid, vote.tag)][0].append(1 if vote.is_accurate else -1)
+            tag_hash = hash((vote.cid, vote.tag))
+            if tag_hash not in votes_on_tags:
+                votes_on_tags[tag_hash] = ([], [])
+            votes_on_tags[tag_hash][0].append(1 if vote.is_accurate else -1)
 
         for vote in self.votes_db.get_votes_for_user(user_b):
             for rule_id in vote.rules_ids:
@@ -102,9 +211,23 @@ class TrustDatabase:
                     votes_on_rules[rule_id] = ([], [])
                 votes_on_rules[rule_id][1].append(1 if vote.is_accurate else -1)
 
-            if (vote.cid, vote.tag) not in votes_on_tags:
-                votes_on_tags[(vote.cid, vote.tag)] = ([], [])
-            votes_on_tags[(vote.cid, vote.tag)][1].append(1 if vote.is_accurate else -1)
+            tag_hash = hash((vote.cid, vote.tag))
+            if tag_hash not in votes_on_tags:
+                votes_on_tags[tag_hash] = ([], [])
+            votes_on_tags[tag_hash][1].append(1 if vote.is_accurate else -1)
+
+        # The votes we evicted are represented by their sign per tag and their number of up- and downvotes per rule
+        evicted_votes = self.votes_db.evicted_votes
+        for ind, user_id in enumerate((user_a, user_b)):
+            for rule_id, (num_up, num_down) in evicted_votes.get_rule_signs(user_id).items():
+                if rule_id not in votes_on_rules:
+                    votes_on_rules[rule_id] = ([], [])
+                votes_on_rules[rule_id][ind].extend([1] * num_up + [-1] * num_down)
+
+            for tag_hash, sign in evicted_votes.get_tag_signs(user_id):
+                if tag_hash not in votes_on_tags:
+                    votes_on_tags[tag_hash] = ([], [])
+                votes_on_tags[tag_hash][ind].append(sign)
 
         #print("Votes between %s and %s: %s (rules) %s (tags)" % (user_a, user_b, votes_on_rules, votes_on_tags))
 
@@ -131,10 +254,21 @@ class TrustDatabase:
 
         return 1 - average(diffs)
 
-    def compute_flows(self):
-        self.max_flows = {}
+    def enable_flow_graph_sparsification(self, top_k: Optional[int] = None, threshold: Optional[float] = None) -> None:
+        """
+        Only keep the most important edges of the flow graph, so the max-flow computations are faster.
+        :param top_k: Keep the edges that are among the top-k edges (by absolute similarity) of one of their nodes.
+        :param threshold: Keep the edges with an absolute similarity of at least this threshold.
+        """
+        self.sparsify_top_k = top_k
+        self.sparsify_threshold = threshold
 
-        # Construct the flow graph
+    def build_flow_graph(self, sparsify: bool = True) -> Tuple[nx.Graph, Set[int]]:
+        """
+        Construct the flow graph from the similarity scores.
+        :param sparsify: Whether to sparsify the graph (if enabled). The edges incident to us are always kept.
+        :return: The flow graph, and the users we compute the flow to.
+        """
         other_user_ids = set()
         flow_graph = nx.Graph()
         flow_graph.add_node(self.my_id)
@@ -148,28 +282,81 @@ class TrustDatabase:
                 if score != 0:
                     flow_graph.add_edge(from_user_id, to_user_id, capacity=score)
 
+        top_k, threshold = self.sparsify_top_k, self.sparsify_threshold
+        if not sparsify or (top_k is None and threshold is None):
+            return flow_graph, other_user_ids
+
+        kept_edges = set()
+        for node in flow_graph.nodes():
+            edges = [(abs(data["capacity"]), neighbour) for neighbour, data in flow_graph[node].items()]
+            if threshold is not None:
+                edges = [(capacity, neighbour) for capacity, neighbour in edges if capacity >= threshold]
+            if top_k is not None:
+                edges = sorted(edges, key=lambda edge: edge[0], reverse=True)[:top_k]
+            kept_edges.update((node, neighbour) for _, neighbour in edges)
+
+        removed_edges = [(node_a, node_b) for node_a, node_b in flow_graph.edges()
+                         if self.my_id not in (node_a, node_b) and (node_a, node_b) not in kept_edges
+                         and (node_b, node_a) not in kept_edges]
+        flow_graph.remove_edges_from(removed_edges)
+        return flow_graph, other_user_ids
+
+    def compute_max_flows(self, flow_graph: nx.Graph, other_user_ids: Set[int]) -> Dict[int, float]:
+        max_flows = {}
         for other_user_id in other_user_ids:
             flow_value = self.compute_sign_aware_flow(flow_graph, self.my_id, other_user_id)
             #flow_value, _ = nx.maximum_flow(flow_graph, self.my_id, other_user_id)
-            self.max_flows[other_user_id] = flow_value
+            max_flows[other_user_id] = flow_value
 
         # Your own flow is the maximum of flows to the other nodes.
         # This ensures that your opinion is weighted in as equal as the peer you trust most.
-        self.max_flows[self.my_id] = max(self.max_flows.values()) if self.max_flows else 1
+        max_flows[self.my_id] = max(max_flows.values()) if max_flows else 1
 
         # Scale the values to the interval [-1, 1]
-        min_flow = min(self.max_flows.values())
-        max_flow = max(self.max_flows.values())
-        for user_id in self.max_flows:
-            f = self.max_flows[user_id]
+        min_flow = min(max_flows.values())
+        max_flow = max(max_flows.values())
+        for user_id in max_flows:
+            f = max_flows[user_id]
             if max_flow == min_flow:
-                self.max_flows[user_id] = 0
+                max_flows[user_id] = 0
             else:
-                self.max_flows[user_id] = 2 * ((f - min_flow) / (max_flow - min_flow)) - 1
+                max_flows[user_id] = 2 * ((f - min_flow) / (max_flow - min_flow)) - 1
+
+        return max_flows
+
+    @profiled("compute_flows", attrgetter("my_id"))
+    def compute_flows(self):
+        self.max_flows = self.compute_max_flows(*self.build_flow_graph())
 
         #print(self.similarity_scores[self.my_id])
         #print(self.max_flows)
 
+    def evaluate_flow_sparsification(self) -> Dict:
+        """
+        Compare the max flows on the sparsified flow graph with the ones on the dense flow graph.
+        :return: The number of edges and the computation time of both graphs, and the mean and maximum absolute
+                 deviation of the sparsified max flows.
+        """
+        start_time = time.time()
+        dense_graph, other_user_ids = self.build_flow_graph(sparsify=False)
+        dense_flows = self.compute_max_flows(dense_graph, other_user_ids)
+        dense_time = time.time() - start_time
+
+        start_time = time.time()
+        sparse_graph, other_user_ids = self.build_flow_graph()
+        sparse_flows = self.compute_max_flows(sparse_graph, other_user_ids)
+        sparse_time = time.time() - start_time
+
+        deviations = [abs(sparse_flows[user_id] - dense_flows[user_id]) for user_id in dense_flows]
+        return {
+            "dense_edges": dense_graph.number_of_edges(),
+            "sparse_edges": sparse_graph.number_of_edges(),
+            "dense_time": dense_time,
+            "sparse_time": sparse_time,
+            "mean_deviation": average(deviations),
+            "max_deviation": max(deviations),
+        }
+
     def compute_sign_aware_flow(self, orig_graph, s, t):
         flow = 0
         #print("S: %d, t: %d" % (s, t))
@@ -212,23 +399,33 @@ class TrustDatabase:
 
         return flow
 
+    @profiled("compute_graph_influences", attrgetter("my_id"))
     def compute_graph_influences(self):
+        # The checkpoint stands for the votes it replaced, so its live PageRank is divided over their voters, in
+        # proportion to the mass their votes had when they were replaced. The accumulated mass keeps growing with every
+        # checkpoint, so it only determines the shares of the voters.
         sums_per_user = {}
+        checkpoint_score = self.pagerank_scores.get(GENESIS_HASH, 0)
+        checkpoint_mass = sum(self.checkpoint_mass.values())
+        if checkpoint_score > 0 and checkpoint_mass > 0:
+            sums_per_user = {voter_id: mass / checkpoint_mass * checkpoint_score
+                             for voter_id, mass in self.checkpoint_mass.items()}
         for vote_id in self.pagerank_scores.keys():
             if vote_id == GENESIS_HASH:
                 continue
 
-            if vote_id not in self.votes_db.votes:
+            voter_id = self.votes_db.get_vote_author(vote_id)
+            if voter_id is None:
                 continue
 
-            vote = self.votes_db.votes[vote_id]
-            if vote.user_id not in sums_per_user:
-                sums_per_user[vote.user_id] = 0
-            sums_per_user[vote.user_id] += self.pagerank_scores[vote_id]
+            if voter_id not in sums_per_user:
+                sums_per_user[voter_id] = 0
+            sums_per_user[voter_id] += self.pagerank_scores[vote_id]
 
         # Normalize scores
         ssum = sum(sums_per_user.values())
         for user_id in sums_per_user.keys():
             sums_per_user[user_id] /= ssum
 
-        print(sums_per_user)
+        if tracer.is_enabled("graph", TraceLevel.INFO):
+            tracer.emit("graph", TraceLevel.INFO, "graph_influences", user_id=self.my_id, influences=sums_per_user)
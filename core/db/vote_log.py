@@ -0,0 +1,339 @@
+import random
+from array import array
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import networkx as nx
+import numpy as np
+
+from core import GENESIS_HASH
+from core.db.evicted_votes import EvictedVotes
+from core.db.votes_database import VotesDatabase, update_vote_digest
+from core.vote import Vote
+
+
+class VoteLog:
+    """
+    An append-only log with all the votes in a simulation, shared by the vote databases of all users.
+    Every vote is stored once and identified by its sequence number in the log. The indexes of the votes per voter,
+    content item and tag are stored once as well, and so is the vote DAG (as the links of the votes in the log). A view
+    filters them by the votes it knows.
+    """
+
+    def __init__(self):
+        self.votes: List[Vote] = []
+        self.authors = array("q")
+        self.hashes = array("q")
+        self.seqs_by_id: Dict[int, int] = {}
+        self.seqs_by_hash: Dict[int, List[int]] = {}
+
+        # Voter ID/content ID/tag hash -> sequence numbers of the votes in the log
+        self.seqs_per_user: Dict[int, array] = {}
+        self.seqs_for_content: Dict[int, array] = {}
+        self.seqs_for_tag: Dict[int, array] = {}
+
+    def append(self, vote: Vote) -> int:
+        """
+        Add a vote to the log, if it is not in the log yet.
+        :return: The sequence number of the vote.
+        """
+        seq = self.seqs_by_id.get(id(vote), None)
+        if seq is None:
+            seq = len(self.votes)
+            self.votes.append(vote)
+            self.authors.append(vote.user_id)
+            self.hashes.append(hash(vote))
+            self.seqs_by_id[id(vote)] = seq
+            if hash(vote) not in self.seqs_by_hash:
+                self.seqs_by_hash[hash(vote)] = []
+            self.seqs_by_hash[hash(vote)].append(seq)
+            self.index_seq(self.seqs_per_user, vote.user_id, seq)
+            self.index_seq(self.seqs_for_content, vote.cid, seq)
+            self.index_seq(self.seqs_for_tag, hash((vote.cid, vote.tag)), seq)
+        return seq
+
+    @staticmethod
+    def index_seq(index: Dict[int, array], key: int, seq: int) -> None:
+        if key not in index:
+            index[key] = array("i")
+        index[key].append(seq)
+
+
+class LogVotes:
+    """
+    A read-only sequence of votes in the log, given by their sequence numbers.
+    """
+
+    def __init__(self, log: VoteLog, seqs: List[int]):
+        self.log = log
+        self.seqs = seqs
+
+    def __len__(self):
+        return len(self.seqs)
+
+    def __iter__(self):
+        return (self.log.votes[seq] for seq in self.seqs)
+
+    def __getitem__(self, ind) -> Vote:
+        return self.log.votes[self.seqs[ind]]
+
+
+class LogIndex:
+    """
+    A read-only mapping from a key (e.g., a user ID) to the votes with that key that are known by a view, given by an
+    index of the log with the sequence numbers of the votes per key.
+    """
+
+    def __init__(self, view: "VoteLogView", seqs_per_key: Dict[int, array], keys: Optional[Dict] = None):
+        self.view = view
+        self.seqs_per_key = seqs_per_key
+        self.known_keys = keys  # The keys with known votes, in order, if the view keeps track of them
+
+    def get_known_seqs(self, key) -> List[int]:
+        return self.view.get_known_seqs(self.seqs_per_key.get(key, ()))
+
+    def __contains__(self, key) -> bool:
+        if self.known_keys is not None:
+            return key in self.known_keys
+        return any(self.view.is_known(seq) for seq in self.seqs_per_key.get(key, ()))
+
+    def __getitem__(self, key) -> LogVotes:
+        if key not in self:
+            raise KeyError(key)
+        return LogVotes(self.view.log, self.get_known_seqs(key))
+
+    def __len__(self):
+        return len(self.keys())
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def keys(self):
+        if self.known_keys is not None:
+            return self.known_keys.keys()
+        return [key for key in self.seqs_per_key if key in self]
+
+    def values(self):
+        return [self[key] for key in self.keys()]
+
+    def items(self):
+        return [(key, self[key]) for key in self.keys()]
+
+
+class KnownVotes:
+    """
+    A read-only mapping from vote hash to vote, with the votes in the log that are known by a view.
+    """
+
+    def __init__(self, view: "VoteLogView"):
+        self.view = view
+
+    def __contains__(self, vote_hash) -> bool:
+        return self.view.get_seq(vote_hash) is not None
+
+    def __getitem__(self, vote_hash) -> Vote:
+        seq = self.view.get_seq(vote_hash)
+        if seq is None:
+            raise KeyError(vote_hash)
+        return self.view.log.votes[seq]
+
+    def get(self, vote_hash, default=None):
+        seq = self.view.get_seq(vote_hash)
+        return default if seq is None else self.view.log.votes[seq]
+
+    def __len__(self):
+        return len(self.view.get_unique_seqs())
+
+    def __iter__(self):
+        return (self.view.log.hashes[seq] for seq in self.view.get_unique_seqs())
+
+    def values(self):
+        return [self.view.log.votes[seq] for seq in self.view.get_unique_seqs()]
+
+
+class VoteLogView(VotesDatabase):
+    """
+    The votes database of a user, as a filtered view over a shared vote log.
+
+    A user only stores which votes in the log it knows and in which order it received them: the position at which we
+    received every vote in the log (or -1), and the received sequence numbers in that order. The indexes and the vote
+    DAG are those of the log, filtered by the votes we know and sorted by position, so their iteration order (and
+    therefore all computed reputations) is identical to that of a regular votes database.
+    """
+
+    def __init__(self, my_id, log: VoteLog):
+        self.my_id = my_id
+        self.log = log
+        self.positions = array("i")  # Sequence number -> the position at which we received the vote, or -1
+        self.received = array("i")  # The sequence numbers of the known votes, in the order we received them
+        self.replaced: Dict[int, int] = {}  # Vote hash -> sequence number, for votes received again as another object
+        self.vote_digests: Dict[int, int] = {}  # User ID -> rolling hash of the votes of the user we know
+
+        # Vote retention is not supported with a shared log
+        self.retention_window = None
+        self.max_votes_per_user = None
+        self.evicted_votes = EvictedVotes()
+        self.num_evicted_votes = {}
+
+    def is_known(self, seq: int) -> bool:
+        return seq < len(self.positions) and self.positions[seq] >= 0
+
+    def get_known_seqs(self, seqs: Iterable[int]) -> List[int]:
+        """
+        Return the given sequence numbers of votes that we know, in the order we received these votes.
+        """
+        known_seqs = [seq for seq in seqs if self.is_known(seq)]
+        known_seqs.sort(key=self.positions.__getitem__)
+        return known_seqs
+
+    def get_seq(self, vote_hash) -> Optional[int]:
+        """
+        Return the sequence number of the known vote with the given hash, or None if we do not know such a vote.
+        """
+        if vote_hash in self.replaced:
+            return self.replaced[vote_hash]
+        for seq in self.log.seqs_by_hash.get(vote_hash, []):
+            if self.is_known(seq):
+                return seq
+        return None
+
+    def get_unique_seqs(self) -> np.ndarray:
+        """
+        Return the sequence numbers of the known votes, in the order of the votes dictionary of a regular database.
+        """
+        received = np.frombuffer(self.received, dtype=np.int32) if self.received else np.empty(0, dtype=np.int32)
+        if not self.replaced:
+            return received.copy()
+
+        # A vote that has been replaced keeps its position, but takes the value of the latest received copy.
+        seqs = []
+        seen_hashes = set()
+        for seq in received.tolist():
+            vote_hash = self.log.hashes[seq]
+            if vote_hash in seen_hashes:
+                continue
+            seen_hashes.add(vote_hash)
+            seqs.append(self.replaced.get(vote_hash, seq))
+        return np.array(seqs, dtype=np.int32)
+
+    def add_vote(self, vote):
+        seq = self.log.append(vote)
+        vote_hash = self.log.hashes[seq]
+
+        # Like in the votes dictionary of a regular database, the copy of a vote that was added last is the value.
+        current_seq = self.get_seq(vote_hash)
+        if current_seq is not None and current_seq != seq:
+            self.replaced[vote_hash] = seq
+
+        if self.is_known(seq):
+            return
+
+        if seq >= len(self.positions):
+            self.positions.extend([-1] * (seq + 1 - len(self.positions)))
+        self.positions[seq] = len(self.received)
+        self.received.append(seq)
+        self.vote_digests[vote.user_id] = update_vote_digest(self.vote_digests.get(vote.user_id, 0), vote)
+
+    def load_votes(self, votes: Iterable[Vote], vote_dag: nx.DiGraph = None) -> None:
+        """
+        Bulk-load votes. The vote DAG is implied by the votes, so the given DAG is not used.
+        """
+        for vote in votes:
+            self.add_vote(vote)
+
+    def get_vote_dag_edges(self) -> List[Tuple[int, int]]:
+        """
+        Return the edges of the vote DAG of the known votes, in the order of the edges of a regular vote DAG: grouped by
+        vote, in the order in which the votes were first added as a node (i.e., as a vote or as a linked vote).
+        """
+        linked_per_node: Dict[int, List[int]] = {GENESIS_HASH: []}
+        for seq in self.received:
+            vote = self.log.votes[seq]
+            vote_hash = self.log.hashes[seq]
+            for linked_vote_id in vote.linked_votes:
+                if vote_hash not in linked_per_node:
+                    linked_per_node[vote_hash] = []
+                if linked_vote_id not in linked_per_node:
+                    linked_per_node[linked_vote_id] = []
+                if linked_vote_id not in linked_per_node[vote_hash]:
+                    linked_per_node[vote_hash].append(linked_vote_id)
+        return [(node, linked_node) for node, linked_nodes in linked_per_node.items() for linked_node in linked_nodes]
+
+    @property
+    def vote_dag(self) -> nx.DiGraph:
+        """
+        Build the vote DAG of the known votes (e.g., to export it). This is not cached.
+        """
+        vote_dag = nx.DiGraph()
+        vote_dag.add_node(GENESIS_HASH)
+        vote_dag.add_edges_from(self.get_vote_dag_edges())
+        return vote_dag
+
+    @property
+    def votes(self):
+        return KnownVotes(self)
+
+    @property
+    def votes_per_user(self):
+        # We know votes of exactly the users with a vote digest, which are ordered by their first known vote.
+        return LogIndex(self, self.log.seqs_per_user, self.vote_digests)
+
+    @property
+    def votes_for_content(self):
+        return LogIndex(self, self.log.seqs_for_content)
+
+    @property
+    def votes_for_tag(self) -> Dict[int, Dict[int, Vote]]:
+        # Like in a regular database, the tags are ordered by the first vote on them that we received.
+        seqs_for_tag = []
+        for tag_hash in self.log.seqs_for_tag.keys():
+            seqs = self.get_votes_for_tag_seqs(tag_hash)
+            if seqs:
+                seqs_for_tag.append((self.positions[seqs[0]], tag_hash, seqs))
+        seqs_for_tag.sort()
+        return {tag_hash: {self.log.authors[seq]: self.log.votes[seq] for seq in seqs}
+                for _, tag_hash, seqs in seqs_for_tag}
+
+    def has_vote(self, vote):
+        return self.get_seq(hash(vote)) is not None
+
+    def is_evicted(self, vote) -> bool:
+        return False
+
+    def apply_retention(self, now: float) -> List[Vote]:
+        raise NotImplementedError("Vote retention requires per-user vote storage")
+
+    def get_random_votes(self, limit: int = 10, exclude: Optional[int] = None) -> List[Vote]:
+        seqs = self.get_unique_seqs()
+        if exclude:
+            authors = np.frombuffer(self.log.authors, dtype=np.int64)
+            seqs = seqs[authors[seqs] != exclude]
+        # Sampling indices consumes the same randomness as sampling from the list of eligible votes.
+        sampled_inds = random.sample(range(len(seqs)), min(len(seqs), limit))
+        return [self.log.votes[seqs[ind]] for ind in sampled_inds]
+
+    def get_votes_for_user(self, user_id):
+        if user_id in self.vote_digests:
+            return LogVotes(self.log, self.get_known_seqs(self.log.seqs_per_user[user_id]))
+        return []
+
+    def get_votes_for_tag_seqs(self, tag_id) -> List[int]:
+        """
+        Return the sequence numbers of the first known vote of every voter on a tag, in the order we received them.
+        """
+        seqs = []
+        voters = set()
+        for seq in self.get_known_seqs(self.log.seqs_for_tag.get(tag_id, ())):
+            if self.log.authors[seq] not in voters:
+                voters.add(self.log.authors[seq])
+                seqs.append(seq)
+        return seqs
+
+    def get_votes_for_tag(self, tag_id) -> List[Vote]:
+        return [self.log.votes[seq] for seq in self.get_votes_for_tag_seqs(tag_id)]
+
+    def get_vote_author(self, vote_id: int) -> Optional[int]:
+        seq = self.get_seq(vote_id)
+        return None if seq is None else self.log.authors[seq]
+
+    def user_did_vote_for_tag(self, user_id, cid, tag) -> bool:
+        return self.get_seq(hash((user_id, cid, tag))) is not None
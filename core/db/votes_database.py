@@ -1,10 +1,26 @@
 import random
-from typing import List, Dict, Set, Optional
+from collections import deque
+from itertools import islice
+from typing import Deque, List, Dict, Optional, Tuple
 
 import networkx as nx
 
 from core import GENESIS_HASH
-from core.vote import Vote
+from core.db.evicted_votes import EvictedVotes
+from core.vote import EvictedVote, Vote
+
+
+DIGEST_BASE = 0x100000001b3
+DIGEST_MASK = 2 ** 64 - 1
+
+
+def update_vote_digest(digest: int, vote: Vote) -> int:
+    """
+    Extend a rolling hash over a sequence of votes with one vote. Only the parts of the vote that determine the
+    similarity with other users are included.
+    """
+    return (digest * DIGEST_BASE + hash((vote.cid, vote.tag, vote.is_accurate, tuple(vote.rules_ids or ())))) & \
+        DIGEST_MASK
 
 
 class VotesDatabase:
@@ -12,23 +28,63 @@ class VotesDatabase:
     def __init__(self, my_id):
         self.my_id = my_id
         self.votes: Dict[int, Vote] = {}
-        self.votes_per_user: Dict[int, Set[Vote]] = {}
+        self.votes_per_user: Dict[int, Dict[Vote, None]] = {}  # Insertion-ordered, so the order survives pickling
         self.votes_for_content = {}
         self.votes_for_tag: Dict[int, Dict[int, Vote]] = {}
+        self.vote_digests: Dict[int, int] = {}  # User ID -> rolling hash of the votes of the user, in votes_per_user
 
         self.vote_dag = nx.DiGraph()
         self.vote_dag.add_node(GENESIS_HASH)
 
+        # The retention policy (see enable_retention). Evicted votes are folded into a compact store per voter.
+        self.retention_window: Optional[float] = None
+        self.max_votes_per_user: Optional[int] = None
+        self.arrivals: Deque[Tuple[float, Vote]] = deque()  # The votes in the order they arrived, with the arrival time
+        self.unstamped_arrivals: List[Vote] = []  # The votes that arrived since the last retention pass
+        self.evicted_votes = EvictedVotes()
+        self.num_evicted_votes: Dict[int, int] = {}
+        self.num_checkpoints = 0  # The number of times we replaced confirmed DAG nodes by a checkpoint
+
+    def enable_retention(self, window: Optional[float] = None, max_votes_per_user: Optional[int] = None) -> None:
+        """
+        Bound the number of votes we keep (None disables a part of the policy).
+        :param window: The time (in seconds) we keep a vote after it arrived.
+        :param max_votes_per_user: The number of most recent votes we keep per user.
+        """
+        self.retention_window = window
+        self.max_votes_per_user = max_votes_per_user
+
     def add_vote(self, vote):
-        self.votes[hash(vote)] = vote
+        if self.num_evicted_votes and self.is_evicted(vote):
+            return  # We already evicted this vote
 
-        # Extend the vote DAG
+        # Extend the vote DAG. The nodes of evicted votes were replaced by the checkpoint, so we link to it instead.
         for linked_vote_id in vote.linked_votes:
+            if self.num_evicted_votes and self.evicted_votes.contains_vote(linked_vote_id):
+                linked_vote_id = GENESIS_HASH
             self.vote_dag.add_edge(hash(vote), linked_vote_id)
 
+        self.index_vote(vote)
+
+    def load_votes(self, votes: List[Vote], vote_dag: nx.DiGraph) -> None:
+        """
+        Bulk-load votes together with a vote DAG that already contains them.
+        The DAG is not copied, so it can be shared between the databases of many users.
+        """
+        self.vote_dag = vote_dag
+        for vote in votes:
+            self.index_vote(vote)
+
+    def index_vote(self, vote):
+        self.votes[hash(vote)] = vote
+        if self.retention_window is not None:
+            self.unstamped_arrivals.append(vote)
+
         if vote.user_id not in self.votes_per_user:
-            self.votes_per_user[vote.user_id] = set()
-        self.votes_per_user[vote.user_id].add(vote)
+            self.votes_per_user[vote.user_id] = {}
+        if vote not in self.votes_per_user[vote.user_id]:
+            self.vote_digests[vote.user_id] = update_vote_digest(self.vote_digests.get(vote.user_id, 0), vote)
+        self.votes_per_user[vote.user_id][vote] = None
 
         if vote.cid not in self.votes_for_content:
             self.votes_for_content[vote.cid] = []
@@ -41,7 +97,113 @@ class VotesDatabase:
             self.votes_for_tag[tag_hash][vote.user_id] = vote
 
     def has_vote(self, vote):
-        return hash(vote) in self.votes
+        return hash(vote) in self.votes or self.is_evicted(vote)
+
+    def is_evicted(self, vote) -> bool:
+        return self.evicted_votes.contains(vote.user_id, hash((vote.cid, vote.tag)))
+
+    def apply_retention(self, now: float) -> List[Vote]:
+        """
+        Evict the votes that arrived before the retention window or that exceed the maximum number of votes per user.
+        :param now: The current time. We consider the votes that arrived since the previous pass to arrive now.
+        :return: The evicted votes.
+        """
+        evicted_votes = []
+        if self.retention_window is not None:
+            self.arrivals.extend((now, vote) for vote in self.unstamped_arrivals)
+            self.unstamped_arrivals = []
+            while self.arrivals and self.arrivals[0][0] < now - self.retention_window:
+                evicted_votes.append(self.arrivals.popleft()[1])
+        if self.max_votes_per_user is not None:
+            for user_votes in self.votes_per_user.values():
+                evicted_votes += islice(user_votes, max(len(user_votes) - self.max_votes_per_user, 0))
+
+        evicted_votes = [vote for vote in evicted_votes if self.evict_vote(vote)]
+        if evicted_votes:
+            evicted_ids = {id(vote) for vote in evicted_votes}
+            for cid in {vote.cid for vote in evicted_votes}:
+                self.votes_for_content[cid] = [vote for vote in self.votes_for_content[cid]
+                                               if id(vote) not in evicted_ids]
+                if not self.votes_for_content[cid]:
+                    del self.votes_for_content[cid]
+            self.evicted_votes.add(evicted_votes)
+        return evicted_votes
+
+    def evict_vote(self, vote: Vote) -> bool:
+        """
+        Remove a vote from the indexes (except votes_for_content, see apply_retention, which also adds it to the evicted
+        votes). The node of the vote stays in the vote DAG until it is replaced by a checkpoint (see
+        TrustDatabase.checkpoint_vote_dag).
+        :return: Whether the vote was indexed.
+        """
+        user_votes = self.votes_per_user[vote.user_id]
+        if vote not in user_votes:
+            return False  # We evicted this vote already
+        del user_votes[vote]  # We keep the (possibly empty) votes of the user, since we still know this user
+        if self.votes.get(hash(vote)) is vote:
+            del self.votes[hash(vote)]
+
+        tag_hash = hash((vote.cid, vote.tag))
+        votes_for_tag = self.votes_for_tag[tag_hash]
+        if votes_for_tag.get(vote.user_id) is vote:
+            del votes_for_tag[vote.user_id]
+            if not votes_for_tag:
+                del self.votes_for_tag[tag_hash]
+        self.num_evicted_votes[vote.user_id] = self.num_evicted_votes.get(vote.user_id, 0) + 1
+        return True
+
+    def get_confirmed_nodes(self, depth: int) -> List[int]:
+        """
+        Return the nodes of the vote DAG that are confirmed by more than the given number of layers of votes, i.e., that
+        are further than this depth from all tips (the votes that no other vote links to), in breadth-first order.
+        Nodes that cannot be reached from a tip (which can happen since the graph may contain cycles) are not confirmed.
+        """
+        depths = {node: 0 for node, in_degree in self.vote_dag.in_degree if in_degree == 0}
+        to_visit = deque(depths.keys())
+        while to_visit:
+            node = to_visit.popleft()
+            for linked_node in self.vote_dag.successors(node):
+                if linked_node not in depths:
+                    depths[linked_node] = depths[node] + 1
+                    to_visit.append(linked_node)
+        return [node for node, node_depth in depths.items() if node_depth > depth and node != GENESIS_HASH]
+
+    def checkpoint_vote_dag(self, nodes: List[int]) -> None:
+        """
+        Replace the given nodes of the vote DAG by the genesis node, which serves as the latest checkpoint of the
+        history. Edges to these nodes are redirected to the genesis node.
+
+        We build a new graph rather than removing nodes, since the DAG can be shared with other users (see load_votes).
+        These users replace the same nodes, so the new graph is stored in the attributes of the old one, and the other
+        users switch to it instead of building their own copy.
+        """
+        if not nodes:
+            return
+
+        nodes = frozenset(nodes)
+        checkpointed_nodes, checkpointed_dag = self.vote_dag.graph.get("checkpoint", (None, None))
+        if checkpointed_nodes != nodes:
+            checkpointed_dag = nx.DiGraph()
+            for node, attributes in self.vote_dag.nodes(data=True):
+                if node not in nodes:
+                    checkpointed_dag.add_node(node, **attributes)
+            for from_node, to_node in self.vote_dag.edges():
+                if from_node not in nodes:
+                    checkpointed_dag.add_edge(from_node, GENESIS_HASH if to_node in nodes else to_node)
+            self.vote_dag.graph["checkpoint"] = (nodes, checkpointed_dag)
+        self.vote_dag = checkpointed_dag
+        self.num_checkpoints += 1
+
+    def get_vote_dag_edges(self):
+        return self.vote_dag.edges()
+
+    def get_vote_author(self, vote_id: int) -> Optional[int]:
+        """
+        Return the user that cast the vote with the given ID, or None if we do not know (or evicted) this vote.
+        """
+        if vote_id in self.votes:
+            return self.votes[vote_id].user_id
+        return None
 
     def add_votes(self, votes):
         for vote in votes:
@@ -65,17 +227,34 @@ class VotesDatabase:
 
     def get_votes_for_user(self, user_id):
         if user_id in self.votes_per_user:
-            return self.votes_per_user[user_id]
+            return self.votes_per_user[user_id].keys()
         return []
 
+    def get_vote_digest(self, user_id) -> int:
+        """
+        Return a digest of the votes of a user. The digest depends on the order of the votes, since the order in which
+        the similarity computation visits them determines the (floating point) result.
+        """
+        return self.vote_digests.get(user_id, 0)
+
     def get_votes_for_tag(self, tag_id) -> List[Vote]:
+        """
+        Return the first vote of every voter on a tag. The votes we evicted come first, with only their voter and sign.
+        """
+        votes = [EvictedVote(user_id, sign > 0) for user_id, sign in self.evicted_votes.get_votes_for_tag(tag_id)]
         if tag_id in self.votes_for_tag:
-            return list(self.votes_for_tag[tag_id].values())
-        return []
+            if votes:
+                evicted_voters = {vote.user_id for vote in votes}
+                votes += [vote for user_id, vote in self.votes_for_tag[tag_id].items() if user_id not in evicted_voters]
+            else:
+                votes = list(self.votes_for_tag[tag_id].values())
+        return votes
 
     def user_did_vote_for_tag(self, user_id, cid, tag) -> bool:
         if user_id not in self.votes_per_user:
             return False
+        if self.evicted_votes.contains(user_id, hash((cid, tag))):
+            return True
         for vote in self.votes_per_user[user_id]:
             if vote.cid == cid and vote.tag == tag:
                 return True
@@ -0,0 +1,124 @@
+"""
+Built-in instrumentation of the reputation pipeline and the vote exchanges.
+
+Methods decorated with profiled add their (inclusive) running time to a named timer, and counters can be incremented
+with profiler.count. Timers and counters are aggregated per user and per round, where a round is a fixed period of
+simulated time (by default the exchange interval). When profiling is disabled, a decorated method only checks a flag
+before calling the original method.
+"""
+from contextlib import contextmanager
+from functools import wraps
+from time import perf_counter
+from typing import Callable, Dict, List, Optional, Tuple
+
+Key = Tuple[str, Optional[int], int]  # The name of a timer or counter, the user ID (or None), and the round
+
+
+class Profiler:
+
+    def __init__(self):
+        self.enabled = False
+        self.clock: Optional[Callable[[], float]] = None
+        self.round_length = 1
+        self.timers: Dict[Key, List[float]] = {}  # Key -> [number of calls, total time in seconds]
+        self.counters: Dict[Key, int] = {}
+
+    def enable(self, clock: Callable[[], float], round_length: float) -> None:
+        """
+        Start profiling, discarding the timers and counters of a previous run.
+        :param clock: A function that returns the current (simulated) time, used to determine the round.
+        :param round_length: The length of a round, in the unit of the clock.
+        """
+        self.enabled = True
+        self.clock = clock
+        self.round_length = round_length
+        self.timers = {}
+        self.counters = {}
+
+    def disable(self) -> None:
+        self.enabled = False
+
+    def get_round(self) -> int:
+        return int(self.clock() // self.round_length) if self.clock else 0
+
+    def add_time(self, phase: str, user_id: Optional[int], elapsed: float) -> None:
+        key = (phase, user_id, self.get_round())
+        if key not in self.timers:
+            self.timers[key] = [0, 0.0]
+        timer = self.timers[key]
+        timer[0] += 1
+        timer[1] += elapsed
+
+    def count(self, name: str, user_id: Optional[int] = None, amount: int = 1) -> None:
+        if not self.enabled:
+            return
+        key = (name, user_id, self.get_round())
+        self.counters[key] = self.counters.get(key, 0) + amount
+
+    @contextmanager
+    def timer(self, phase: str, user_id: Optional[int] = None):
+        """
+        Time the enclosed block, for phases that are not a single method.
+        """
+        if not self.enabled:
+            yield
+            return
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.add_time(phase, user_id, perf_counter() - started)
+
+    def merge(self, timers: Dict[Key, List[float]], counters: Dict[Key, int]) -> None:
+        """
+        Add the timers and counters of another profiler, e.g., of a shard that ran in another process.
+        """
+        for key, (calls, total_time) in timers.items():
+            if key not in self.timers:
+                self.timers[key] = [0, 0.0]
+            self.timers[key][0] += calls
+            self.timers[key][1] += total_time
+        for key, amount in counters.items():
+            self.counters[key] = self.counters.get(key, 0) + amount
+
+    def write_csv(self, timers_path: str, counters_path: str) -> None:
+        with open(timers_path, "w") as timers_file:
+            timers_file.write("round,user_id,phase,calls,total_time\n")
+            for (phase, user_id, round), (calls, total_time) in sorted(self.timers.items(), key=sort_key):
+                timers_file.write("%d,%s,%s,%d,%f\n" % (round, "" if user_id is None else user_id, phase, calls,
+                                                        total_time))
+
+        with open(counters_path, "w") as counters_file:
+            counters_file.write("round,user_id,counter,count\n")
+            for (name, user_id, round), amount in sorted(self.counters.items(), key=sort_key):
+                counters_file.write("%d,%s,%s,%d\n" % (round, "" if user_id is None else user_id, name, amount))
+
+
+def sort_key(item) -> Tuple[int, int, str]:
+    (name, user_id, round), _ = item
+    return round, -1 if user_id is None else user_id, name
+
+
+# The profiler of this process. Worker processes have their own copy, which is merged into this one where needed.
+profiler = Profiler()
+
+
+def profiled(phase: str, get_user_id: Optional[Callable] = None):
+    """
+    Decorate a function or method so its running time is added to the timer of the given phase.
+    :param phase: The name of the timer.
+    :param get_user_id: A function that returns the ID of the user from the first argument (e.g., self), or None to
+                        aggregate over all users.
+    """
+    def decorator(function):
+        @wraps(function)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return function(*args, **kwargs)
+            started = perf_counter()
+            try:
+                return function(*args, **kwargs)
+            finally:
+                profiler.add_time(phase, get_user_id(args[0]) if get_user_id else None, perf_counter() - started)
+        return wrapper
+    return decorator
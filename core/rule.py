@@ -1,7 +1,17 @@
 from enum import Enum
+from itertools import count
 from random import Random
 from typing import List
 
+import numpy as np
+
+from core.db.metadata_index import MetadataIndex, parse_predicate
+from core.tracer import TraceLevel, tracer
+
+# Every change of the content a rule applies to gets a new version, so rule engines and indexes can tell whether the
+# coverage of a rule changed since they were built.
+coverage_versions = count(1)
+
 
 class RuleType(Enum):
     ACCURATE = 0  # An "accurate" rule is a rule created by a user with honest intentions (but can have some errors).
@@ -17,8 +27,11 @@ class Rule:
         self.reputation_score = 0
         self.coverage = coverage
         self.error_rate = error_rate
-        self.applicable_content_ids_correct: List[int] = []
-        self.applicable_content_ids_incorrect: List[int] = []
+        # The content the rule applies to, as bitmaps over content indices (packed, 8 items per byte)
+        self.correct_bitmap = np.zeros(0, dtype=np.uint8)
+        self.incorrect_bitmap = np.zeros(0, dtype=np.uint8)
+        self.num_items = 0
+        self.coverage_version = 0
         self.type = rule_type
 
     def determine_applicable_content(self, total_num_items):
@@ -31,21 +44,109 @@ class Rule:
         incorrect_items_to_sample = int(self.error_rate * len(applicable_content_ids))
         incorrect_content_ids = rand.sample(applicable_content_ids, incorrect_items_to_sample)
 
-        for content_id in applicable_content_ids:
-            if content_id in incorrect_content_ids:
-                self.applicable_content_ids_incorrect.append(content_id)
-            else:
-                self.applicable_content_ids_correct.append(content_id)
+        correct = np.zeros(total_num_items, dtype=bool)
+        correct[applicable_content_ids] = True
+        incorrect = np.zeros(total_num_items, dtype=bool)
+        incorrect[incorrect_content_ids] = True
+        correct &= ~incorrect
+        self.set_applicable_content(correct, incorrect)
+
+        if tracer.is_enabled("rules", TraceLevel.INFO):
+            tracer.emit("rules", TraceLevel.INFO, "rule_coverage", rule_id=hash(self),
+                        correct=int(np.count_nonzero(correct)), incorrect=int(np.count_nonzero(incorrect)))
+
+    def set_applicable_content(self, correct: np.ndarray, incorrect: np.ndarray) -> None:
+        """
+        Set the content this rule applies to.
+        :param correct: Boolean array over content indices, with the content the rule tags correctly.
+        :param incorrect: Boolean array over content indices, with the content the rule tags incorrectly.
+        """
+        self.num_items = len(correct)
+        self.correct_bitmap = np.packbits(correct)
+        self.incorrect_bitmap = np.packbits(incorrect)
+        self.coverage_version = next(coverage_versions)
+
+    def get_applicability(self) -> np.ndarray:
+        """
+        Return a boolean array over content indices, with the content this rule applies to.
+        """
+        return np.unpackbits(self.correct_bitmap | self.incorrect_bitmap, count=self.num_items).astype(bool)
 
-        print("Rule %s applies to: %d correct, %d incorrect" % (
-            hash(self), len(self.applicable_content_ids_correct), len(self.applicable_content_ids_incorrect)))
+    def is_in_bitmap(self, bitmap: np.ndarray, content_id: int) -> bool:
+        return 0 <= content_id < self.num_items and bool(bitmap[content_id >> 3] & (0x80 >> (content_id & 7)))
+
+    def is_correct_for(self, content_id: int) -> bool:
+        return self.is_in_bitmap(self.correct_bitmap, content_id)
+
+    def is_incorrect_for(self, content_id: int) -> bool:
+        return self.is_in_bitmap(self.incorrect_bitmap, content_id)
+
+    def applies_to(self, content_id: int) -> bool:
+        return self.is_correct_for(content_id) or self.is_incorrect_for(content_id)
+
+    @property
+    def applicable_content_ids_correct(self) -> List[int]:
+        return np.flatnonzero(np.unpackbits(self.correct_bitmap, count=self.num_items)).tolist()
+
+    @property
+    def applicable_content_ids_incorrect(self) -> List[int]:
+        return np.flatnonzero(np.unpackbits(self.incorrect_bitmap, count=self.num_items)).tolist()
 
     def get_copy(self):
         r = Rule(self.author, self.rule_id, self.output_tag, self.coverage)
-        r.applicable_content_ids_correct = self.applicable_content_ids_correct
-        r.applicable_content_ids_incorrect = self.applicable_content_ids_incorrect
+        r.correct_bitmap = self.correct_bitmap
+        r.incorrect_bitmap = self.incorrect_bitmap
+        r.num_items = self.num_items
+        r.coverage_version = self.coverage_version
         r.type = self.type
         return r
 
     def __hash__(self):
         return self.rule_id
+
+
+class PredicateRule(Rule):
+    """
+    A rule that tags all content whose metadata satisfies a predicate, e.g., "quality=1080p AND year>2010".
+    The rule is compiled against a metadata index, after which it stores the (sorted) IDs of the matching content.
+    """
+
+    def __init__(self, author, rule_id, output_tag, predicate: str, rule_type=RuleType.ACCURATE):
+        super().__init__(author, rule_id, output_tag, rule_type=rule_type)
+        self.predicate = predicate
+        self.conditions = parse_predicate(predicate)
+        self.matches = np.zeros(0, dtype=np.int64)
+
+    def compile(self, index: MetadataIndex) -> None:
+        self.matches = index.evaluate(self.conditions)
+        self.coverage_version = next(coverage_versions)
+
+        if tracer.is_enabled("rules", TraceLevel.INFO):
+            tracer.emit("rules", TraceLevel.INFO, "rule_coverage", rule_id=hash(self), correct=len(self.matches),
+                        incorrect=0)
+
+    def is_correct_for(self, content_id: int) -> bool:
+        ind = np.searchsorted(self.matches, content_id)
+        return ind < len(self.matches) and self.matches[ind] == content_id
+
+    def is_incorrect_for(self, content_id: int) -> bool:
+        return False
+
+    def get_applicability(self) -> np.ndarray:
+        applicable = np.zeros(int(self.matches[-1]) + 1 if len(self.matches) else 0, dtype=bool)
+        applicable[self.matches] = True
+        return applicable
+
+    @property
+    def applicable_content_ids_correct(self) -> List[int]:
+        return self.matches.tolist()
+
+    @property
+    def applicable_content_ids_incorrect(self) -> List[int]:
+        return []
+
+    def get_copy(self):
+        r = PredicateRule(self.author, self.rule_id, self.output_tag, self.predicate, rule_type=self.type)
+        r.matches = self.matches
+        r.coverage_version = self.coverage_version
+        return r
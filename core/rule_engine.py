@@ -0,0 +1,137 @@
+from typing import Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+
+from core.rule import PredicateRule, Rule
+from core.tag import Tag
+
+# The rule engines of the rule sets that were applied most recently. Users receive copies of the same rules, which have
+# the same coverage, so they can share an engine.
+MAX_CACHED_ENGINES = 8
+cached_engines: Dict[Tuple, "RuleEngine"] = {}
+
+
+def get_rule_engine(rules: Iterable[Rule]) -> "RuleEngine":
+    """
+    Return a rule engine for a set of rules, which is only built again if the set or the coverage of a rule changed.
+    """
+    rules = list(rules)
+    key = tuple((rule.rule_id, rule.output_tag, rule.coverage_version) for rule in rules)
+    engine = cached_engines.pop(key, None)
+    if engine is None:
+        engine = RuleEngine(rules)
+        if len(cached_engines) >= MAX_CACHED_ENGINES:
+            del cached_engines[next(iter(cached_engines))]
+    cached_engines[key] = engine  # Move it to the end, as the most recently used engine
+    return engine
+
+
+class RuleEngine:
+    """
+    Applies a set of rules to the content of a user in one pass.
+    The positions of the content every rule applies to are looked up in the packed applicability bitmap of the rule at
+    once. Predicate rules are compiled to the IDs of the content they match, which are looked up directly. The tags of
+    every output tag name are then created (or found) once per content item, and the tags that do not exist yet are
+    added to the tags database in bulk.
+    """
+
+    def __init__(self, rules: Iterable[Rule]):
+        self.rules: List[Rule] = list(rules)
+        self.bitmaps: List[np.ndarray] = [rule.correct_bitmap | rule.incorrect_bitmap for rule in self.rules]
+        self.rules_per_output_tag: Dict[str, List[int]] = {}  # Output tag -> indices of the rules with that output
+        for rule_ind, rule in enumerate(self.rules):
+            if rule.output_tag not in self.rules_per_output_tag:
+                self.rules_per_output_tag[rule.output_tag] = []
+            self.rules_per_output_tag[rule.output_tag].append(rule_ind)
+
+        # The IDs of the content every rule applies to, sorted, with the indices of the rules. Built when needed.
+        self.indexed_content_ids: Optional[np.ndarray] = None
+        self.indexed_rule_inds: Optional[np.ndarray] = None
+
+    def build_content_index(self) -> None:
+        content_ids = []
+        for rule, bitmap in zip(self.rules, self.bitmaps):
+            if isinstance(rule, PredicateRule):
+                content_ids.append(rule.matches)
+            else:
+                content_ids.append(np.flatnonzero(np.unpackbits(bitmap, count=rule.num_items)))
+        rule_inds = np.repeat(np.arange(len(self.rules)), [len(ids) for ids in content_ids])
+        content_ids = np.concatenate(content_ids) if content_ids else np.zeros(0, dtype=np.int64)
+        order = np.argsort(content_ids, kind="stable")  # Keeps the rules of a content item in order
+        self.indexed_content_ids = content_ids[order]
+        self.indexed_rule_inds = rule_inds[order]
+
+    def get_rule_ids_for_content(self, content_id: int) -> List[int]:
+        """
+        Return the IDs of the rules that apply to a content item, in the order of the rules.
+        """
+        if self.indexed_content_ids is None:
+            self.build_content_index()
+        start, end = np.searchsorted(self.indexed_content_ids, [content_id, content_id + 1])
+        return [self.rules[rule_ind].rule_id for rule_ind in self.indexed_rule_inds[start:end].tolist()]
+
+    def get_applicable_positions(self, content_ids: np.ndarray) -> List[np.ndarray]:
+        """
+        Determine which rules apply to which content.
+        :param content_ids: The IDs of the content to apply the rules to.
+        :return: For every rule, the (sorted) positions in content_ids of the content it applies to.
+        """
+        positions = []
+        for rule, bitmap in zip(self.rules, self.bitmaps):
+            if isinstance(rule, PredicateRule):
+                positions.append(np.flatnonzero(np.isin(content_ids, rule.matches)))
+                continue
+            in_range = np.flatnonzero((content_ids >= 0) & (content_ids < rule.num_items))
+            ids = content_ids[in_range]
+            positions.append(in_range[np.flatnonzero(bitmap[ids >> 3] & (0x80 >> (ids & 7)))])
+        return positions
+
+    def apply(self, content_db) -> Dict[int, List[Tag]]:
+        """
+        Apply all rules to the content in a content database.
+        :param content_db: The content database, whose tags database receives the new tags.
+        :return: The tags generated by every rule, by rule ID.
+        """
+        content_items = content_db.get_all_content()
+        content_ids = np.array([hash(content_item) for content_item in content_items], dtype=np.int64)
+        positions = self.get_applicable_positions(content_ids)
+
+        tags_db = content_db.tags_db
+        tags_per_output_tag: Dict[str, np.ndarray] = {}  # Output tag -> the tag on every content position (or None)
+        new_tags: List[Tuple[int, int, Tag]] = []  # (first rule index, content position, tag) for tags that are new
+        for output_tag, rule_inds in self.rules_per_output_tag.items():
+            # The (rule index, content position) pairs of these rules, grouped by content position in rule order
+            rule_positions = np.concatenate([positions[rule_ind] for rule_ind in rule_inds])
+            pair_rule_inds = np.repeat(rule_inds, [len(positions[rule_ind]) for rule_ind in rule_inds])
+            order = np.argsort(rule_positions, kind="stable")
+            rule_positions, pair_rule_inds = rule_positions[order], pair_rule_inds[order]
+            content_positions, starts = np.unique(rule_positions, return_index=True)
+            bounds = starts.tolist() + [len(rule_positions)]
+            pair_rule_inds = pair_rule_inds.tolist()
+            pair_rule_ids = [self.rules[rule_ind].rule_id for rule_ind in pair_rule_inds]
+
+            tags = np.full(len(content_items), None, dtype=object)
+            tags_per_output_tag[output_tag] = tags
+            for tag_ind, content_ind in enumerate(content_positions.tolist()):
+                rule_ids = pair_rule_ids[bounds[tag_ind]:bounds[tag_ind + 1]]
+                tag = content_items[content_ind].get_tag_with_name(output_tag)
+                if tag is None:
+                    tag = Tag(output_tag, int(content_ids[content_ind]))
+                    tag.rules.extend(rule_ids)
+                    new_tags.append((pair_rule_inds[bounds[tag_ind]], content_ind, tag))
+                else:
+                    for rule_id in rule_ids:
+                        if rule_id not in tag.rules:
+                            tags_db.add_rule_to_tag(tag, rule_id)
+                tags[content_ind] = tag
+
+        # We add the new tags in the order in which the rules generate them. The tags database might store its own
+        # version of the new tags, which we return instead.
+        new_tags.sort(key=lambda new_tag: new_tag[:2])
+        stored_tags = tags_db.add_tags([tag for _, _, tag in new_tags])
+        for (rule_ind, content_ind, _), stored_tag in zip(new_tags, stored_tags):
+            tags_per_output_tag[self.rules[rule_ind].output_tag][content_ind] = stored_tag
+            content_items[content_ind].add_tag(stored_tag)
+
+        return {rule.rule_id: tags_per_output_tag[rule.output_tag][rule_positions].tolist()
+                for rule, rule_positions in zip(self.rules, positions)}
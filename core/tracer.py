@@ -0,0 +1,127 @@
+"""
+Structured tracing of simulation events, e.g., votes and the opinions that make up the reputation of a rule.
+
+Events have a category and a level, and are only recorded for the categories that are enabled at that level or lower.
+Callers guard their events with tracer.is_enabled, so the fields of a disabled event are never computed. Enabled events
+are written as JSON lines to a buffered file, or printed as readable lines when no file is given. Traces can be turned
+back into readable logs with scripts/replay_trace.py.
+"""
+import json
+from enum import IntEnum
+from typing import Callable, Dict, IO, List, Optional
+
+
+class TraceLevel(IntEnum):
+    DEBUG = 10
+    INFO = 20
+
+
+# The readable message of every event, formatted with the fields of the event
+EVENT_FORMATS = {
+    "vote": "User {user_id} ({user_type}) voted {vote} for {tag}",
+    "honest_vote": "User {user_id} ({user_type}) votes {vote:+d} on {tag} (cid: {cid}, rules: {rules}, authors: "
+                   "{authors})",
+    "misvote": "User {user_id} ({user_type}) misvotes on tag {tag} (vote: {vote:+d})!",
+    "rule_reputation": "Computing reputation for rule {rule_id}",
+    "rule_opinion": "Opinion of user {voter_id} on rule {rule_id}: {opinion:f} (votes: {num_votes}, weight: "
+                    "{weight:f}, similarity: {similarity:f})",
+    "rule_coverage": "Rule {rule_id} applies to: {correct} correct, {incorrect} incorrect",
+    "graph_influences": "Graph influences of user {user_id}: {influences}",
+    "reputations": "Recomputing all reputations for User {user_id} ({user_type})",
+    "rule_score": "Reputation rule {rule_id}: {reputation:f}",
+    "user_score": "Reputation of user {other_user_id}: {reputation:f}",
+}
+
+
+def format_event(event: Dict) -> str:
+    """
+    Return the readable message of a traced event.
+    """
+    if event["event"] not in EVENT_FORMATS:
+        return "%s %s" % (event["event"], {key: value for key, value in event.items()
+                                           if key not in ("time", "category", "level", "event")})
+    return EVENT_FORMATS[event["event"]].format(**event)
+
+
+class Tracer:
+
+    def __init__(self):
+        self.levels: Dict[str, int] = {}  # Category -> the minimum level of the events we record
+        self.clock: Optional[Callable[[], float]] = None
+        self.sink: Optional[IO] = None
+        self.collected: Optional[List[Dict]] = None  # The events we keep in memory instead (see collect_events)
+
+    def enable(self, levels: Dict[str, int], path: Optional[str] = None, clock: Optional[Callable[[], float]] = None,
+               buffer_size: int = 1 << 20) -> None:
+        """
+        Start tracing the given categories.
+        :param levels: The minimum level per category, e.g., {"votes": TraceLevel.INFO}.
+        :param path: The JSONL file to write the events to, or None to print them as readable lines.
+        :param clock: A function that returns the current (simulated) time, which is included in every event.
+        :param buffer_size: The size of the write buffer of the file, in bytes.
+        """
+        self.close()
+        self.levels = {category: int(level) for category, level in levels.items()}
+        self.clock = clock
+        if path:
+            self.sink = open(path, "w", buffering=buffer_size)
+
+    def is_enabled(self, category: str, level: int) -> bool:
+        return category in self.levels and self.levels[category] <= level
+
+    def emit(self, category: str, level: int, event: str, **fields) -> None:
+        """
+        Record an event. Callers should check is_enabled first, so the fields are only computed when needed.
+        """
+        record = {"time": self.clock() if self.clock else 0, "category": category, "level": int(level),
+                  "event": event}
+        record.update(fields)
+        self.write_event(record)
+
+    def write_event(self, record: Dict) -> None:
+        """
+        Write a recorded event, e.g., one that was collected in a worker process.
+        """
+        if self.collected is not None:
+            self.collected.append(record)
+        elif self.sink:
+            self.sink.write(json.dumps(record))
+            self.sink.write("\n")
+        else:
+            print(format_event(record))
+
+    def flush(self) -> None:
+        """
+        Write the buffered events to the trace file, e.g., before forking worker processes that inherit the buffer.
+        """
+        if self.sink:
+            self.sink.flush()
+
+    def collect_events(self) -> None:
+        """
+        Keep the events we record in memory, until they are taken with pop_collected_events. Forked worker processes do
+        this, since they exit without flushing the trace file they inherited, and would write to the same file offset
+        as the main process. The main process writes the collected events instead.
+        """
+        if self.collected is None:
+            self.collected = []
+
+    def pop_collected_events(self) -> List[Dict]:
+        events = self.collected or []
+        if self.collected is not None:
+            self.collected = []
+        return events
+
+    def close(self) -> None:
+        """
+        Flush and close the trace file, and stop tracing.
+        """
+        if self.sink:
+            self.sink.close()
+            self.sink = None
+        self.collected = None
+        self.levels = {}
+
+
+# The tracer of this process
+tracer = Tracer()
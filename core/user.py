@@ -1,11 +1,12 @@
 import random
 from asyncio import sleep
 from enum import Enum
-from typing import List
+from typing import List, Optional
 
 from numpy import average
 
 from core.content import Content
+from core.db.content_catalog import ContentCatalog, SharedContentDatabase, SharedTagsDatabase
 from core.db.content_database import ContentDatabase
 from core.db.peers_database import PeersDatabase
 from core.db.rules_database import RulesDatabase
@@ -13,7 +14,10 @@ from core.db.tags_database import TagsDatabase
 from core.db.trust_database import TrustDatabase
 from core.db.votes_database import VotesDatabase
 from core.exchange import RandomExchangePolicy
+from core.profiler import profiled, profiler
+from core.rule import Rule
 from core.tag import Tag
+from core.tracer import TraceLevel, tracer
 from core.vote import Vote
 
 
@@ -31,44 +35,58 @@ class UserType(Enum):
 
 class User:
 
-    def __init__(self, identifier, user_type=UserType.HONEST):
+    def __init__(self, identifier, user_type=UserType.HONEST, votes_db: Optional[VotesDatabase] = None,
+                 content_catalog: Optional[ContentCatalog] = None):
         self.identifier = identifier
         self.peers_db = PeersDatabase()
         self.rules_db = RulesDatabase()
-        self.tags_db: TagsDatabase = TagsDatabase(self.rules_db)
-        self.content_db = ContentDatabase(self.tags_db)
-        self.votes_db: VotesDatabase = VotesDatabase(hash(self))
+        if content_catalog:
+            self.tags_db: TagsDatabase = SharedTagsDatabase(self.rules_db, content_catalog)
+            self.content_db = SharedContentDatabase(self.tags_db, content_catalog)
+        else:
+            self.tags_db: TagsDatabase = TagsDatabase(self.rules_db)
+            self.content_db = ContentDatabase(self.tags_db)
+        self.votes_db: VotesDatabase = votes_db if votes_db is not None else VotesDatabase(hash(self))
         self.trust_db = TrustDatabase(hash(self), self.votes_db, self.tags_db)
         self.neighbours: List[User] = []
         self.type = user_type
         self.vote_exchange_policy = RandomExchangePolicy(self.votes_db)
+        self.revision = 0  # Incremented whenever our databases change, so a checkpoint can skip unchanged users
 
     def connect(self, other_user):
         self.neighbours.append(other_user)
+        self.revision += 1
         self.peers_db.add_peer(hash(other_user))
 
     async def start_vote_exchange(self, exchange_interval, gossip_batch_size):
         while True:
-            # Exchange random votes with one neighbour
-            neighbour = random.choice(self.neighbours)
-            votes = self.vote_exchange_policy.get_votes(hash(neighbour))
-            #print("%s exchanging %d vote(s) with %s" % (self, len(votes), neighbour))
-            for vote in votes:
-                neighbour.process_incoming_vote(vote)
+            self.exchange_votes()
             await sleep(exchange_interval)
 
+    @profiled("exchange_votes", hash)
+    def exchange_votes(self):
+        """
+        Exchange random votes with one neighbour.
+        """
+        neighbour = random.choice(self.neighbours)
+        votes = self.vote_exchange_policy.get_votes(hash(neighbour))
+        #print("%s exchanging %d vote(s) with %s" % (self, len(votes), neighbour))
+        profiler.count("exchanged_votes", hash(self), len(votes))
+        for vote in votes:
+            neighbour.process_incoming_vote(vote)
+
     def process_incoming_vote(self, vote: Vote):
+        self.revision += 1
         content_item = self.content_db.get_content(vote.cid)
         if not content_item:
             # It looks like this content doesn't exist in the user database - create it
-            content_item = Content(str(vote.cid), 1)
-            self.content_db.add_content(content_item)
+            content_item = self.content_db.add_content(Content(str(vote.cid), 1))
+            self.apply_rules_to_new_content(content_item)
 
         tag = content_item.get_tag_with_name(vote.tag)
         if not tag:
             # It looks like this tag does not exist yet - create it
-            tag = Tag(vote.tag, vote.cid)
-            self.tags_db.add_tag(tag)
+            tag = self.tags_db.add_tag(Tag(vote.tag, vote.cid))
             content_item.add_tag(tag)
 
         for author in vote.authors:
@@ -91,47 +109,79 @@ class User:
         """
         Have this user create a particular tag.
         """
+        self.revision += 1
         content_item = self.content_db.get_content(content_id)
         if not content_item:
             # It looks like this content doesn't exist in the user database - create it
-            content_item = Content(str(content_id), 1)
-            self.content_db.add_content(content_item)
+            content_item = self.content_db.add_content(Content(str(content_id), 1))
+            self.apply_rules_to_new_content(content_item)
 
         tag = Tag(tag_name, content_id)
         tag.authors.add(hash(self))
-        self.tags_db.add_tag(tag)
+        tag = self.tags_db.add_tag(tag)
         content_item.add_tag(tag)
 
         return tag
 
-    def vote(self, tag: Tag, is_accurate: bool) -> None:
+    def vote(self, tag: Tag, is_accurate: bool, by_user: Optional[int] = None, virtual: bool = False) -> None:
         """
         Vote for a particular tag.
         :param tag: The tag being voted on.
         :param is_accurate: Whether the vote is positive or negative.
+        :param by_user: The user on whose behalf the vote is cast, by default this user.
+        :param virtual: Whether this is a virtual vote of the author of a rule, which does not require us to recompute
+                        our reputations first.
         """
-        by_user = hash(self)
+        if by_user is None:
+            by_user = hash(self)
+        self.revision += 1
 
         # Recompute reputations
-        self.recompute_reputations()
+        if not virtual:
+            self.recompute_reputations()
 
         linked_votes = self.trust_db.select_vote_dag_tips()
-        vote = Vote(by_user, tag.cid, tag.name, is_accurate, tag.authors, tag.rules, linked_votes)
+        vote = Vote(by_user, tag.cid, tag.name, is_accurate, tag.authors, list(tag.rules), linked_votes)
         self.votes_db.add_vote(vote)
-        print("%s voted %d for %s" % (self, 1 if is_accurate else -1, tag.name))
-
-    def apply_rules_to_content(self):
-        for rule in self.rules_db.get_all_rules():
-            created_tags = self.content_db.apply_rule(rule)
+        if not virtual and tracer.is_enabled("votes", TraceLevel.INFO):
+            tracer.emit("votes", TraceLevel.INFO, "vote", user_id=hash(self), user_type=self.type.value,
+                        vote=1 if is_accurate else -1, tag=tag.name)
 
-            # The author of the rule always upvotes the generated tags (used to compute similarity).
-            for tag in created_tags:
+    def vote_for_rule_tags(self, rule: Rule, tags: List[Tag]) -> None:
+        """
+        The author of a rule always upvotes the generated tags (used to compute similarity).
+        """
+        for tag in tags:
+            if not self.votes_db.user_did_vote_for_tag(rule.author, tag.cid, tag.name):
                 self.vote(tag, True, by_user=rule.author, virtual=True)
 
+    def apply_rules_to_content(self):
+        self.revision += 1
+        rules = list(self.rules_db.get_all_rules())
+        created_tags = self.content_db.apply_rules(rules)
+        for rule in rules:
+            self.vote_for_rule_tags(rule, created_tags[rule.rule_id])
+
+    def apply_rules_to_new_content(self, content_item: Content) -> List[Tag]:
+        """
+        Apply the rules that are relevant to a content item we just discovered, using the rule index in the rules
+        database, so we do not have to apply all rules to all content again.
+        :return: The tags generated by the rules.
+        """
+        created_tags = []
+        for rule in self.rules_db.get_rules_for_content(hash(content_item)):
+            tag = content_item.apply_rule(rule, self.tags_db)
+            if tag:
+                self.vote_for_rule_tags(rule, [tag])
+                created_tags.append(tag)
+        return created_tags
+
+    @profiled("recompute_reputations", hash)
     def recompute_reputations(self):
         """
         (re)compute the reputation of users, tags, and rules.
         """
+        self.revision += 1
         #print("Recomputing all reputations for %s" % self)
 
         # Compute similarities
@@ -153,6 +203,7 @@ class User:
         # that generated/created it
         self.compute_tag_weights()
 
+    @profiled("compute_tags_reputation", hash)
     def compute_tags_reputation(self):
         """
         Compute the reputation of all tags, which depends on the votes cast on that tag.
@@ -162,6 +213,7 @@ class User:
             for tag in content.tags:
                 self.compute_tag_reputation(tag)
 
+    @profiled("compute_user_reputation", hash)
     def compute_user_reputation(self):
         """
         Compute the subjective reputation of other users.
@@ -198,11 +250,13 @@ class User:
 
         tag.reputation_score = average(scores) if scores else 0
 
+    @profiled("compute_rules_reputation", hash)
     def compute_rules_reputation(self):
         # Compute rule reputations
         for rule in self.rules_db.get_all_rules():
             votes = {}
-            print("Computing reputation for rule %d" % rule.rule_id)
+            if tracer.is_enabled("rules", TraceLevel.DEBUG):
+                tracer.emit("rules", TraceLevel.DEBUG, "rule_reputation", user_id=hash(self), rule_id=rule.rule_id)
 
             tags_for_rule = self.tags_db.get_tags_generated_by_rule(rule)
             votes_for_rule = []
@@ -226,7 +280,10 @@ class User:
                 similarity = self.trust_db.get_similarity_coefficient(hash(self), user_id)
                 if -0.2 < similarity < 0.2:
                     continue
-                print("Opinion of user %s on rule %s: %f (votes: %d, weight: %f, similarity: %f)" % (user_id, rule.rule_id, average(user_votes), len(user_votes), self.trust_db.max_flows[user_id], similarity))
+                if tracer.is_enabled("rules", TraceLevel.DEBUG):
+                    tracer.emit("rules", TraceLevel.DEBUG, "rule_opinion", user_id=hash(self), voter_id=user_id,
+                                rule_id=rule.rule_id, opinion=float(average(user_votes)), num_votes=len(user_votes),
+                                weight=self.trust_db.max_flows[user_id], similarity=similarity)
                 rep_fractions[user_id] = similarity * average(user_votes)
 
             # Compute the weighted average of these personal scores (the weight is the fraction in the max flow computation)
@@ -239,6 +296,7 @@ class User:
 
             rule.reputation_score = 0 if fsum == 0 else reputation_score / fsum
 
+    @profiled("compute_tag_weights", hash)
     def compute_tag_weights(self):
         """
         Compute the weight of the tags associated with content.
@@ -1,4 +1,4 @@
-from typing import Set, Optional
+from typing import Optional, Set
 
 
 class Vote:
@@ -18,3 +18,18 @@ class Vote:
 
     def __hash__(self):
         return hash((self.user_id, self.cid, self.tag))
+
+
+class EvictedVote:
+    """
+    A vote that was evicted from the votes database (see VotesDatabase.apply_retention), with only the attributes that
+    tag reputations depend on. It is created when the votes on a tag are requested, and not stored.
+    """
+    __slots__ = ("user_id", "is_accurate")
+
+    def __init__(self, user_id: int, is_accurate: bool):
+        self.user_id: int = user_id
+        self.is_accurate: bool = is_accurate
+
+    def __str__(self):
+        return "EvictedVote(user %s, %s)" % (self.user_id, "up" if self.is_accurate else "down")
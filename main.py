@@ -1,18 +1,15 @@
 """
 Testing out a bare-bones scoring mechanism around voting and decentralized content rules.
 """
-from asyncio import set_event_loop, ensure_future
+import sys
 
-from simulation.experiment import Experiment
+from simulation.sharded_simulation import run_experiment
 from simulation.settings import ExperimentSettings
-from simulation.discrete_loop import DiscreteLoop
 
 if __name__ == "__main__":
-    loop = DiscreteLoop()
-    set_event_loop(loop)
-
     experiment_settings = ExperimentSettings()
     experiment_settings.scenario_dir = "scripts/create_movielens_experiment/data/scenarios/scenario_9_1_1_naive_randvote"
-    exp = Experiment(experiment_settings)
-    ensure_future(exp.run())
-    loop.run_forever()
+
+    # With more than one shard, each shard runs its own discrete loop in a worker process. With --resume, we continue
+    # from the latest checkpoint (requires experiment_settings.checkpoint_dir).
+    run_experiment(experiment_settings, resume="--resume" in sys.argv)
@@ -0,0 +1,69 @@
+"""
+Compare the memory used by the content and tags databases of all users, with per-user storage and with a shared
+content catalog. Every user learns all tags (in a random order), like at the end of a simulation with full
+dissemination.
+"""
+import random
+import tracemalloc
+
+from core.content import Content
+from core.db.content_catalog import ContentCatalog, SharedContentDatabase, SharedTagsDatabase
+from core.db.content_database import ContentDatabase
+from core.db.rules_database import RulesDatabase
+from core.db.tags_database import TagsDatabase
+from core.tag import Tag
+
+NUM_USERS = 50
+NUM_CONTENT = 1000
+NUM_TAGS = 4000
+
+
+def create_tags():
+    rand = random.Random(42)
+    tags = {}
+    while len(tags) < NUM_TAGS:
+        tag_name, cid = "tag%d" % rand.randrange(100), rand.randrange(NUM_CONTENT)
+        tags[(tag_name, cid)] = rand.randrange(NUM_USERS)
+    return [(tag_name, cid, author) for (tag_name, cid), author in tags.items()]
+
+
+def fill_databases(content_dbs, tags):
+    rand = random.Random(42)
+    for content_db in content_dbs:
+        shuffled_tags = list(tags)
+        rand.shuffle(shuffled_tags)
+        for tag_name, cid, author in shuffled_tags:
+            content_item = content_db.get_content(cid)
+            if not content_item:
+                content_item = content_db.add_content(Content(str(cid), 1))
+            tag = Tag(tag_name, cid)
+            tag.authors.add(author)
+            tag = content_db.tags_db.add_tag(tag)
+            content_item.add_tag(tag)
+
+
+if __name__ == "__main__":
+    tags = create_tags()
+
+    tracemalloc.start()
+    content_dbs = []
+    for _ in range(NUM_USERS):
+        content_dbs.append(ContentDatabase(TagsDatabase(RulesDatabase())))
+    fill_databases(content_dbs, tags)
+    per_user_memory, _ = tracemalloc.get_traced_memory()
+    del content_dbs
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    catalog = ContentCatalog()
+    content_dbs = []
+    for _ in range(NUM_USERS):
+        content_dbs.append(SharedContentDatabase(SharedTagsDatabase(RulesDatabase(), catalog), catalog))
+    fill_databases(content_dbs, tags)
+    shared_catalog_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("Users: %d, content items: %d, tags: %d" % (NUM_USERS, NUM_CONTENT, NUM_TAGS))
+    print("Per-user storage: %.1f MB" % (per_user_memory / 1024 / 1024))
+    print("Shared content catalog: %.1f MB (%.1fx less)" % (shared_catalog_memory / 1024 / 1024,
+                                                            per_user_memory / shared_catalog_memory))
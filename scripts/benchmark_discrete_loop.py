@@ -0,0 +1,37 @@
+"""
+Measure the throughput (events per second) of the DiscreteLoop on a synthetic workload with one million events.
+Half of the events are scheduled upfront at integer timestamps, the other half are chained from within callbacks,
+similar to the scenario replay and the periodic vote exchanges in our experiments.
+"""
+import random
+import time
+
+from simulation.discrete_loop import DiscreteLoop, CalendarQueue
+
+NUM_EVENTS = 1000000
+DURATION = 3600
+
+
+def run_workload(loop: DiscreteLoop) -> float:
+    rand = random.Random(42)
+    processed = [0]
+
+    def on_event(reschedule):
+        processed[0] += 1
+        if reschedule:
+            loop.call_later(rand.randint(0, 5), on_event, False)
+
+    for _ in range(NUM_EVENTS // 2):
+        loop.call_at(rand.randint(0, DURATION), on_event, True)
+
+    start_time = time.time()
+    loop.run_forever()
+    duration = time.time() - start_time
+    assert processed[0] == NUM_EVENTS
+    return NUM_EVENTS / duration
+
+
+if __name__ == "__main__":
+    for scheduler_name, scheduler in [("heap", None), ("calendar", CalendarQueue(bucket_width=1, num_buckets=4096))]:
+        events_per_sec = run_workload(DiscreteLoop(scheduler=scheduler))
+        print("Scheduler %s: %d events/s" % (scheduler_name, events_per_sec))
@@ -0,0 +1,66 @@
+"""
+Compare the peak memory used by the vote databases of all users during a long run, with and without vote retention.
+Votes arrive in rounds and every user learns all votes, like in a simulation with full dissemination. With retention,
+a retention pass after every round evicts the votes beyond the most recent votes per user and removes their nodes
+from the vote DAG.
+"""
+import random
+import tracemalloc
+
+from core import GENESIS_HASH
+from core.db.trust_database import TrustDatabase
+from core.db.votes_database import VotesDatabase
+from core.vote import Vote
+
+NUM_USERS = 30
+NUM_ROUNDS = 100
+VOTES_PER_ROUND = 100
+MAX_VOTES_PER_USER = 20
+
+
+def create_votes(rand, round_ind, recent_votes):
+    votes = []
+    for vote_ind in range(VOTES_PER_ROUND):
+        linked_votes = set(rand.sample(recent_votes, min(len(recent_votes), 2))) or {GENESIS_HASH}
+        cid = round_ind * VOTES_PER_ROUND + vote_ind  # New content keeps arriving
+        vote = Vote(rand.randrange(NUM_USERS), cid, "tag%d" % rand.randrange(5), rand.random() < 0.5,
+                    {rand.randrange(NUM_USERS)}, {rand.randrange(50)}, linked_votes)
+        votes.append(vote)
+        recent_votes.append(hash(vote))
+    del recent_votes[:-VOTES_PER_ROUND]
+    return votes
+
+
+def run(max_votes_per_user) -> int:
+    """
+    :return: The peak memory, in bytes.
+    """
+    rand = random.Random(42)
+    tracemalloc.start()
+    votes_dbs = [VotesDatabase(user_id) for user_id in range(NUM_USERS)]
+    trust_dbs = [TrustDatabase(user_id, votes_db, None) for user_id, votes_db in enumerate(votes_dbs)]
+    for votes_db in votes_dbs:
+        votes_db.enable_retention(max_votes_per_user=max_votes_per_user)
+
+    recent_votes = []
+    for round_ind in range(NUM_ROUNDS):
+        for vote in create_votes(rand, round_ind, recent_votes):
+            for votes_db in votes_dbs:
+                votes_db.add_vote(vote)
+        if max_votes_per_user is not None:
+            for votes_db, trust_db in zip(votes_dbs, trust_dbs):
+                trust_db.checkpoint_vote_dag(votes_db.apply_retention(round_ind))
+
+    _, peak_memory = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return peak_memory
+
+
+if __name__ == "__main__":
+    full_memory = run(None)
+    retention_memory = run(MAX_VOTES_PER_USER)
+
+    print("Users: %d, votes: %d" % (NUM_USERS, NUM_ROUNDS * VOTES_PER_ROUND))
+    print("Without retention: %.1f MB peak" % (full_memory / 1024 / 1024))
+    print("With retention (%d votes per user): %.1f MB peak (%.1fx less)" %
+          (MAX_VOTES_PER_USER, retention_memory / 1024 / 1024, full_memory / retention_memory))
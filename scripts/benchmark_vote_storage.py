@@ -0,0 +1,56 @@
+"""
+Compare the memory used by the vote databases of all users, with per-user storage and with a shared vote log.
+Every user learns all votes (in a random order), like at the end of a simulation with full dissemination.
+"""
+import random
+import tracemalloc
+
+from core import GENESIS_HASH
+from core.db.vote_log import VoteLog, VoteLogView
+from core.db.votes_database import VotesDatabase
+from core.vote import Vote
+
+NUM_USERS = 50
+NUM_VOTES = 4000
+
+
+def create_votes():
+    rand = random.Random(42)
+    votes = []
+    for vote_ind in range(NUM_VOTES):
+        linked_votes = {hash(vote) for vote in rand.sample(votes, min(len(votes), 2))} or {GENESIS_HASH}
+        votes.append(Vote(rand.randrange(NUM_USERS), rand.randrange(1000), "tag%d" % rand.randrange(100),
+                          rand.random() < 0.5, {rand.randrange(NUM_USERS)}, [], linked_votes))
+    return votes
+
+
+def fill_databases(votes_dbs, votes):
+    rand = random.Random(42)
+    for votes_db in votes_dbs:
+        shuffled_votes = list(votes)
+        rand.shuffle(shuffled_votes)
+        for vote in shuffled_votes:
+            votes_db.add_vote(vote)
+
+
+if __name__ == "__main__":
+    votes = create_votes()
+
+    tracemalloc.start()
+    votes_dbs = [VotesDatabase(user_id) for user_id in range(NUM_USERS)]
+    fill_databases(votes_dbs, votes)
+    per_user_memory, _ = tracemalloc.get_traced_memory()
+    del votes_dbs
+    tracemalloc.stop()
+
+    tracemalloc.start()
+    log = VoteLog()
+    votes_dbs = [VoteLogView(user_id, log) for user_id in range(NUM_USERS)]
+    fill_databases(votes_dbs, votes)
+    shared_log_memory, _ = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    print("Users: %d, votes: %d" % (NUM_USERS, NUM_VOTES))
+    print("Per-user storage: %.1f MB" % (per_user_memory / 1024 / 1024))
+    print("Shared vote log: %.1f MB (%.1fx less)" % (shared_log_memory / 1024 / 1024,
+                                                     per_user_memory / shared_log_memory))
@@ -0,0 +1,84 @@
+"""
+Compare the time to find the users to proactively share a created tag with, for scenario traces of increasing length.
+The original approach scans all scenario actions for every created tag and looks up users linearly (O(A^2)), whereas
+the voter index and the user dictionary are built once when loading the scenario (O(A)).
+"""
+import os
+import random
+import tempfile
+import time
+
+from core.user import User
+from simulation.scenario import Scenario
+
+NUM_USERS = 500
+VOTES_PER_TAG = 10
+TRACE_LENGTHS = [5500, 11000, 22000, 44000]
+
+
+def write_scenario(scenario_dir, num_actions):
+    rand = random.Random(42)
+    actions = []
+    for tag_ind in range(num_actions // (VOTES_PER_TAG + 1)):
+        movie_id = rand.randint(0, 10000)
+        timestamp = rand.randint(0, 3600)
+        actions.append((timestamp, "create", rand.randrange(NUM_USERS), movie_id, "tag%d" % tag_ind, 1))
+        for user_id in rand.sample(range(NUM_USERS), VOTES_PER_TAG):
+            actions.append((rand.randint(timestamp, 3600), "vote", user_id, movie_id, "tag%d" % tag_ind, 1))
+
+    with open(os.path.join(scenario_dir, "experiment.scenario"), "w") as scenario_file:
+        for action in sorted(actions):
+            scenario_file.write("%d,%s,%d,%d,%s,%d\n" % action)
+    with open(os.path.join(scenario_dir, "users.csv"), "w") as users_file:
+        users_file.write("user_id,type\n")
+        for user_id in range(NUM_USERS):
+            users_file.write("%d,honest\n" % user_id)
+
+
+def resolve_voters_by_scan(scenario, users):
+    resolved = 0
+    for action in scenario.actions:
+        if action.command != "create":
+            continue
+        for other_action in scenario.actions:
+            if other_action.command == "vote" and other_action.movie_id == action.movie_id and other_action.tag == action.tag:
+                for user in users:
+                    if hash(user) == other_action.user_id:
+                        resolved += 1
+                        break
+    return resolved
+
+
+def resolve_voters_by_index(scenario, users_by_id):
+    resolved = 0
+    for action in scenario.actions:
+        if action.command != "create":
+            continue
+        for other_user_id in scenario.get_voters(action.movie_id, action.tag):
+            if users_by_id.get(other_user_id, None):
+                resolved += 1
+    return resolved
+
+
+if __name__ == "__main__":
+    for trace_length in TRACE_LENGTHS:
+        with tempfile.TemporaryDirectory() as scenario_dir:
+            write_scenario(scenario_dir, trace_length)
+            scenario = Scenario(scenario_dir)
+            start_time = time.time()
+            scenario.parse()
+            users = [User("%d" % user_id) for user_id in range(NUM_USERS)]
+            users_by_id = {hash(user): user for user in users}
+            index_time = time.time() - start_time
+
+            start_time = time.time()
+            resolved_by_index = resolve_voters_by_index(scenario, users_by_id)
+            index_time += time.time() - start_time
+
+            start_time = time.time()
+            resolved_by_scan = resolve_voters_by_scan(scenario, users)
+            scan_time = time.time() - start_time
+
+            assert resolved_by_index == resolved_by_scan
+            print("Actions: %d, scan: %.3f s, index (including parsing): %.3f s" %
+                  (len(scenario.actions), scan_time, index_time))
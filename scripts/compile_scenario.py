@@ -0,0 +1,11 @@
+"""
+Convert a scenario directory (experiment.scenario and users.csv) to the compiled, memory-mappable scenario format.
+Usage: python -m scripts.compile_scenario <scenario_dir> [<scenario_dir> ...]
+"""
+import sys
+
+from simulation.scenario import Scenario
+
+if __name__ == "__main__":
+    for scenario_dir in sys.argv[1:]:
+        Scenario(scenario_dir).compile()
@@ -0,0 +1,34 @@
+"""
+Apply predicate rules to a list of torrent filenames, using the metadata inferred by PTN.
+Every line in the rules file contains a predicate and the tag it creates, e.g., "resolution=1080p AND year>2010 -> HD".
+Usage: python -m scripts.create_tribler_experiment.apply_metadata_rules <torrents file> <rules file>
+"""
+import sys
+from collections import Counter
+
+from core.db.metadata_index import load_ptn_metadata
+from core.rule import PredicateRule
+
+if len(sys.argv) != 3:
+    print(__doc__)
+    sys.exit(1)
+
+with open(sys.argv[1]) as in_file:
+    filenames = [line.strip() for line in in_file.readlines() if line.strip()]
+index = load_ptn_metadata(filenames)
+
+rules = []
+with open(sys.argv[2]) as in_file:
+    for line in in_file.readlines():
+        if not line.strip() or line.startswith("#"):
+            continue
+        predicate, _, output_tag = line.rpartition("->")
+        rules.append(PredicateRule(0, len(rules) + 1, output_tag.strip(), predicate.strip()))
+
+for rule in rules:
+    rule.compile(index)
+    print("Rule %s (%s) applies to: %d" % (hash(rule), rule.predicate, len(rule.matches)))
+
+tags_per_torrent = Counter(content_id for rule in rules for content_id in rule.matches.tolist())
+print("%d rules create %d tags on %d of %d torrents" % (len(rules), sum(tags_per_torrent.values()),
+                                                        len(tags_per_torrent), len(filenames)))
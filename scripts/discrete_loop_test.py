@@ -0,0 +1,38 @@
+"""
+Check that the calendar-queue scheduler dispatches the events of a random workload in the same order as the heap
+scheduler, also for bucket widths that are not exact in binary floating point.
+"""
+import random
+
+from simulation.discrete_loop import CalendarQueue, DiscreteLoop
+
+NUM_EVENTS = 20000
+
+
+def get_dispatch_order(loop: DiscreteLoop):
+    rand = random.Random(42)
+    dispatched = []
+
+    def on_event(event_id, reschedule):
+        dispatched.append((loop.time(), event_id))
+        if reschedule:
+            loop.call_later(rand.choice([0, 0.1, 0.5, rand.random() * 5]), on_event, -event_id, False)
+
+    for event_id in range(1, NUM_EVENTS // 2 + 1):
+        # Timestamps at multiples of 0.1 fall on the bucket boundaries of the narrow calendars
+        when = rand.randrange(0, 1000) / 10 if rand.random() < 0.5 else rand.random() * 100
+        loop.call_at(when, on_event, event_id, True)
+
+    loop.run_forever()
+    return dispatched
+
+
+if __name__ == "__main__":
+    expected = get_dispatch_order(DiscreteLoop())
+    assert [when for when, _ in expected] == sorted(when for when, _ in expected)
+    for bucket_width in [0.1, 0.25, 0.3, 1, 2]:
+        for num_buckets in [16, 1024]:
+            dispatched = get_dispatch_order(DiscreteLoop(scheduler=CalendarQueue(bucket_width, num_buckets)))
+            assert dispatched == expected, "Bucket width %s, %d buckets: different dispatch order" % \
+                (bucket_width, num_buckets)
+    print("Calendar queues dispatch %d events in the same order as the heap" % len(expected))
@@ -0,0 +1,57 @@
+"""
+Run a scenario, and report how far the max flows on a sparsified flow graph deviate from the ones on the dense flow graph
+(at the end of the experiment), together with the time it takes to compute them. This helps to choose k (or a threshold)
+for a latency budget.
+Usage: python -m scripts.evaluate_flow_sparsification <scenario_dir> [--top-k <k> ...] [--thresholds <t> ...]
+                                                      [--duration <seconds>]
+"""
+import argparse
+import traceback
+from asyncio import ensure_future, set_event_loop
+
+import numpy as np
+
+from simulation.discrete_loop import DiscreteLoop
+from simulation.experiment import Experiment
+from simulation.settings import ExperimentSettings
+
+
+def report(name, reports):
+    print("%s: %d/%d edges, %.3f s (dense: %.3f s), mean deviation %.4f, max deviation %.4f" % (
+        name, sum(report["sparse_edges"] for report in reports), sum(report["dense_edges"] for report in reports),
+        sum(report["sparse_time"] for report in reports), sum(report["dense_time"] for report in reports),
+        np.mean([report["mean_deviation"] for report in reports]), max(report["max_deviation"] for report in reports)))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the deviation of max flows on a sparsified flow graph")
+    parser.add_argument("scenario_dir")
+    parser.add_argument("--top-k", nargs="*", type=int, default=[1, 2, 5, 10])
+    parser.add_argument("--thresholds", nargs="*", type=float, default=[0.2, 0.5])
+    parser.add_argument("--duration", type=int, default=ExperimentSettings.duration)
+    args = parser.parse_args()
+
+    settings = ExperimentSettings()
+    settings.scenario_dir = args.scenario_dir
+    settings.duration = args.duration
+
+    loop = DiscreteLoop()
+    set_event_loop(loop)
+    experiment = Experiment(settings)
+    ensure_future(experiment.run())
+    try:
+        loop.run_forever()
+    except Exception:
+        # Failing to write the results does not affect the state of the users we evaluate
+        traceback.print_exc()
+
+    for top_k in args.top_k:
+        for user in experiment.users:
+            user.trust_db.enable_flow_graph_sparsification(top_k=top_k)
+        report("Top-%d" % top_k, [user.trust_db.evaluate_flow_sparsification() for user in experiment.users])
+
+    for threshold in args.thresholds:
+        for user in experiment.users:
+            user.trust_db.enable_flow_graph_sparsification(threshold=threshold)
+        report("Threshold %.2f" % threshold, [user.trust_db.evaluate_flow_sparsification()
+                                              for user in experiment.users])
@@ -0,0 +1,55 @@
+"""
+Run a scenario with MinHash/LSH candidate filtering, and report the recall of the candidate pairs against the exhaustive
+all-pairs similarity computation (i.e., the fraction of pairs of users with a non-zero similarity that are candidates).
+Usage: python -m scripts.evaluate_similarity_candidates <scenario_dir> [--bands <num>] [--rows <num>]
+                                                        [--duration <seconds>]
+"""
+import argparse
+import traceback
+from asyncio import ensure_future, set_event_loop
+
+import numpy as np
+
+from simulation.discrete_loop import DiscreteLoop
+from simulation.experiment import Experiment
+from simulation.settings import ExperimentSettings, SimilarityCandidates
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Evaluate the recall of MinHash/LSH candidate pairs")
+    parser.add_argument("scenario_dir")
+    parser.add_argument("--bands", type=int, default=ExperimentSettings.minhash_bands)
+    parser.add_argument("--rows", type=int, default=ExperimentSettings.minhash_rows)
+    parser.add_argument("--duration", type=int, default=ExperimentSettings.duration)
+    args = parser.parse_args()
+
+    settings = ExperimentSettings()
+    settings.scenario_dir = args.scenario_dir
+    settings.duration = args.duration
+    settings.similarity_candidates = SimilarityCandidates.MINHASH_LSH
+    settings.minhash_bands = args.bands
+    settings.minhash_rows = args.rows
+
+    loop = DiscreteLoop()
+    set_event_loop(loop)
+    experiment = Experiment(settings)
+    ensure_future(experiment.run())
+    try:
+        loop.run_forever()
+    except Exception:
+        # Failing to write the results does not affect the state of the users we evaluate
+        traceback.print_exc()
+
+    reports = [user.trust_db.evaluate_candidate_recall() for user in experiment.users]
+    for user, report in zip(experiment.users, reports):
+        print("%s: %d/%d pairs are candidates, recall %.3f (%d pairs with a non-zero similarity)" % (
+            user, report["candidate_pairs"], report["pairs"], report["recall"], report["nonzero_pairs"]))
+
+    total_pairs = sum(report["pairs"] for report in reports)
+    total_candidates = sum(report["candidate_pairs"] for report in reports)
+    total_nonzero = sum(report["nonzero_pairs"] for report in reports)
+    total_found = sum(report["recall"] * report["nonzero_pairs"] for report in reports)
+    print("Bands: %d, rows: %d" % (args.bands, args.rows))
+    print("Candidate pairs: %d/%d (%.1f%%)" % (total_candidates, total_pairs,
+                                               100 * total_candidates / total_pairs if total_pairs else 0))
+    print("Recall: %.3f overall, %.3f minimum per user" % (total_found / total_nonzero if total_nonzero else 1,
+                                                           np.min([report["recall"] for report in reports])))
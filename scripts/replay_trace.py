@@ -0,0 +1,27 @@
+"""
+Turn a trace (the JSON lines written by the tracer, see core/tracer.py) back into a readable log.
+Usage: python -m scripts.replay_trace <trace_file> [--categories <category> ...] [--level DEBUG|INFO]
+                                      [--user <user_id>]
+"""
+import argparse
+import json
+
+from core.tracer import TraceLevel, format_event
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Replay a trace as a readable log")
+    parser.add_argument("trace_file")
+    parser.add_argument("--categories", nargs="+", default=None)
+    parser.add_argument("--level", choices=[level.name for level in TraceLevel], default=TraceLevel.DEBUG.name)
+    parser.add_argument("--user", type=int, default=None)
+    args = parser.parse_args()
+
+    min_level = TraceLevel[args.level]
+    with open(args.trace_file) as trace_file:
+        for line in trace_file:
+            event = json.loads(line)
+            if event["level"] < min_level or (args.categories and event["category"] not in args.categories):
+                continue
+            if args.user is not None and event.get("user_id", None) != args.user:
+                continue
+            print("[%.3f] %s" % (event["time"], format_event(event)))
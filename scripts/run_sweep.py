@@ -0,0 +1,37 @@
+"""
+Run a parameter sweep over one or more scenarios, and aggregate the results in <sweep_dir>/summary.csv.
+Finished runs are skipped, so an interrupted sweep can be resumed by running the same command again.
+Usage: python -m scripts.run_sweep <sweep_dir> --scenarios <dir> [<dir> ...] [--set <setting>=<value>,<value> ...]
+                                   [--seeds <seed> ...] [--workers <num>]
+Example: python -m scripts.run_sweep data/sweeps/interval --scenarios scripts/.../scenario_9_1_1_naive_randvote \
+             --set exchange_interval=5,10,20 duration=1800 --seeds 1 2 3 --workers 4
+Enum-valued settings are given by the name of the member, e.g., --set gossip_scheduler=PER_USER,TIMER_WHEEL.
+"""
+import argparse
+import ast
+
+from simulation.sweep import run_sweep
+
+
+def parse_value(value: str):
+    try:
+        return ast.literal_eval(value)
+    except (ValueError, SyntaxError):
+        return value  # Plain strings, e.g., paths
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Run a parameter sweep over scenarios")
+    parser.add_argument("sweep_dir")
+    parser.add_argument("--scenarios", nargs="+", required=True)
+    parser.add_argument("--set", nargs="*", default=[], dest="settings")
+    parser.add_argument("--seeds", nargs="+", type=int, default=[42])
+    parser.add_argument("--workers", type=int, default=1)
+    args = parser.parse_args()
+
+    grid = {}
+    for setting in args.settings:
+        name, values = setting.split("=", 1)
+        grid[name] = [parse_value(value) for value in values.split(",")]
+
+    run_sweep(args.sweep_dir, args.scenarios, grid, args.seeds, num_workers=args.workers)
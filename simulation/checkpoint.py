@@ -0,0 +1,289 @@
+import hashlib
+import io
+import os
+import pickle
+import random
+import zlib
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+from core.exchange import RandomExchangePolicy
+from core.vote import Vote
+
+MANIFEST_FILE_NAME = "manifest.pkl"
+
+# The stored vote DAGs and databases are keyed by Python hashes of strings, so we can only resume a checkpoint with
+# the same hash seed (PYTHONHASHSEED) as the run that wrote it.
+HASH_FINGERPRINT = hash("checkpoint")
+
+
+class StorePickler(pickle.Pickler):
+    """
+    Pickles a single store, referring to objects that live in other stores (or in the vote log) by persistent IDs.
+    """
+
+    def __init__(self, file, checkpointer, store_name):
+        super().__init__(file, protocol=pickle.HIGHEST_PROTOCOL)
+        self.checkpointer = checkpointer
+        self.store_name = store_name
+
+    def persistent_id(self, obj):
+        return self.checkpointer.get_persistent_id(obj, self.store_name)
+
+
+class StoreUnpickler(pickle.Unpickler):
+
+    def __init__(self, file, checkpointer):
+        super().__init__(file)
+        self.checkpointer = checkpointer
+
+    def persistent_load(self, pid):
+        return self.checkpointer.resolve_persistent_id(pid)
+
+
+class Checkpointer:
+    """
+    Periodically snapshots the state of a scenario experiment, so a run can be resumed with identical results.
+
+    The state is split into stores: the content/tags, votes, rules, trust and peers databases of every user, and the
+    experiment results. Each store is pickled separately and compressed. We only serialize the stores of users whose
+    databases changed since the previous snapshot (see User.revision), and only write the ones whose contents actually
+    changed. Votes are shared between the databases of many users and are therefore kept in an append-only vote log,
+    to which the stores refer by persistent IDs. The same holds for the authors and
+    rules of a tag, which are shared with the votes that have been cast on that tag.
+
+    The loop clock, the pending scenario actions, the state of the gossip scheduler and the RNG states are kept in a
+    manifest, which is (atomically) replaced with every snapshot.
+    """
+
+    def __init__(self, experiment, checkpoint_dir):
+        self.experiment = experiment
+        self.checkpoint_dir = checkpoint_dir
+        self.manifest = {"checkpoint": 0, "stores": {}, "vote_segments": []}
+
+        # The vote log, and the IDs of the votes in it. We keep a reference to the votes so their IDs stay valid.
+        self.votes_by_seq: List[Vote] = []
+        self.vote_seqs: Dict[int, int] = {}
+        self.new_votes: List[Vote] = []
+
+        self.store_objects: Dict[int, Tuple[str, int]] = {}  # id(obj) -> (store name, index in the store)
+        self.shared_containers: Dict[int, Tuple[str, int, str]] = {}  # id(obj) -> (store name, tag hash, attribute)
+        self.containers_per_user: Dict[int, List[int]] = {}  # User ID -> the IDs of its shared containers
+
+        # The revisions of the users and the experiment results in the previous snapshot
+        self.user_revisions: Dict[int, int] = {}
+        self.results_revision = None
+
+        # Loaded stores while resuming
+        self.loaded_stores = {}
+
+    def get_user_stores(self, user):
+        return {
+            "user_%d_content" % hash(user): (user.content_db, user.tags_db),
+            "user_%d_votes" % hash(user): (user.votes_db,),
+            "user_%d_rules" % hash(user): (user.rules_db,),
+            "user_%d_trust" % hash(user): (user.trust_db,),
+            "user_%d_peers" % hash(user): (user.peers_db,),
+        }
+
+    def get_changed_stores(self):
+        """
+        Return the stores of the experiment results and the users that changed since the previous snapshot. The
+        results of a reputation recomputation also change the databases of all users.
+        """
+        stores = {}
+        results_changed = self.results_revision != self.experiment.results_revision
+        if results_changed:
+            stores["experiment"] = (self.experiment.round, self.experiment.inaccurate_tags,
+                                    self.experiment.rules_reputation_per_round,
+                                    self.experiment.tags_reputation_per_round,
+                                    self.experiment.user_reputation_per_round)
+        for user in self.experiment.users:
+            if results_changed or self.user_revisions.get(hash(user), None) != user.revision:
+                stores.update(self.get_user_stores(user))
+        return stores
+
+    def index_stores(self, changed_users):
+        """
+        Index the databases of all users, and the containers that are shared by the tags of the given users.
+        """
+        self.store_objects = {}
+        for user in self.experiment.users:
+            for store_name, store in self.get_user_stores(user).items():
+                for ind, obj in enumerate(store):
+                    self.store_objects[id(obj)] = (store_name, ind)
+
+        # The authors and rules of a tag can be shared with the votes on that tag. The tags of other users did not
+        # change, so their containers are still indexed.
+        for user in changed_users:
+            for container_id in self.containers_per_user.get(hash(user), []):
+                self.shared_containers.pop(container_id, None)
+            store_name = "user_%d_content" % hash(user)
+            container_ids = []
+            for tag_hash, tag in user.tags_db.tags.items():
+                self.shared_containers[id(tag.authors)] = (store_name, tag_hash, "authors")
+                self.shared_containers[id(tag.rules)] = (store_name, tag_hash, "rules")
+                container_ids += [id(tag.authors), id(tag.rules)]
+            self.containers_per_user[hash(user)] = container_ids
+
+    def record_revisions(self, users):
+        for user in users:
+            self.user_revisions[hash(user)] = user.revision
+        self.results_revision = self.experiment.results_revision
+
+    def get_persistent_id(self, obj, store_name):
+        if isinstance(obj, Vote):
+            return "vote", self.get_vote_seq(obj)
+
+        store_object = self.store_objects.get(id(obj), None)
+        if store_object and store_object[0] != store_name:
+            return ("store",) + store_object
+
+        shared_container = self.shared_containers.get(id(obj), None)
+        if shared_container and shared_container[0] != store_name:
+            return ("container",) + shared_container
+
+        return None
+
+    def get_vote_seq(self, vote: Vote) -> int:
+        seq = self.vote_seqs.get(id(vote), None)
+        if seq is None:
+            seq = len(self.votes_by_seq)
+            self.vote_seqs[id(vote)] = seq
+            self.votes_by_seq.append(vote)
+            self.new_votes.append(vote)
+        return seq
+
+    def serialize(self, obj, store_name) -> bytes:
+        buf = io.BytesIO()
+        StorePickler(buf, self, store_name).dump(obj)
+        return buf.getvalue()
+
+    def write_file(self, file_name, data: bytes):
+        tmp_file_path = os.path.join(self.checkpoint_dir, file_name + ".tmp")
+        with open(tmp_file_path, "wb") as out_file:
+            out_file.write(data)
+        os.replace(tmp_file_path, os.path.join(self.checkpoint_dir, file_name))
+
+    def write(self, state):
+        """
+        Write a snapshot of the experiment.
+        :param state: The loop clock, pending actions and scheduler state to store in the manifest.
+        """
+        os.makedirs(self.checkpoint_dir, exist_ok=True)
+        checkpoint = self.manifest["checkpoint"] + 1
+        stores = self.get_changed_stores()
+        changed_users = [user for user in self.experiment.users if "user_%d_votes" % hash(user) in stores]
+        self.index_stores(changed_users)
+
+        num_written_stores = 0
+        for store_name, store in stores.items():
+            data = self.serialize(store, store_name)
+            digest = hashlib.sha1(data).digest()
+            if store_name in self.manifest["stores"] and self.manifest["stores"][store_name][1] == digest:
+                continue  # This store has not changed since the last snapshot
+
+            file_name = "%s.%d.pkl.z" % (store_name, checkpoint)
+            self.write_file(file_name, zlib.compress(data))
+            self.manifest["stores"][store_name] = (file_name, digest)
+            num_written_stores += 1
+
+        # Extend the vote log with the votes we have not seen before
+        if self.new_votes:
+            first_seq = len(self.votes_by_seq) - len(self.new_votes)
+            file_name = "votes.%d.pkl.z" % checkpoint
+            data = self.serialize([vote.__dict__ for vote in self.new_votes], "votes")
+            self.write_file(file_name, zlib.compress(data))
+            self.manifest["vote_segments"].append((first_seq, file_name))
+            self.new_votes = []
+
+        self.manifest["checkpoint"] = checkpoint
+        self.manifest["hash_fingerprint"] = HASH_FINGERPRINT
+        self.manifest["random_state"] = random.getstate()
+        self.manifest["numpy_random_state"] = np.random.get_state()
+        self.manifest["state"] = state
+        self.write_file(MANIFEST_FILE_NAME, pickle.dumps(self.manifest, protocol=pickle.HIGHEST_PROTOCOL))
+        self.record_revisions(changed_users)
+
+        # Remove the store files that have been superseded
+        referenced_files = {file_name for file_name, _ in self.manifest["stores"].values()}
+        referenced_files.update(file_name for _, file_name in self.manifest["vote_segments"])
+        referenced_files.add(MANIFEST_FILE_NAME)
+        for file_name in os.listdir(self.checkpoint_dir):
+            if file_name not in referenced_files:
+                os.remove(os.path.join(self.checkpoint_dir, file_name))
+
+        print("Wrote checkpoint %d at t=%f (%d/%d stores serialized, %d written, %d votes)" %
+              (checkpoint, state["time"], len(stores), len(self.manifest["stores"]), num_written_stores,
+               len(self.votes_by_seq)))
+
+    def has_checkpoint(self) -> bool:
+        return os.path.exists(os.path.join(self.checkpoint_dir, MANIFEST_FILE_NAME))
+
+    def read_file(self, file_name):
+        with open(os.path.join(self.checkpoint_dir, file_name), "rb") as in_file:
+            return in_file.read()
+
+    def load_store(self, store_name):
+        if store_name not in self.loaded_stores:
+            file_name, _ = self.manifest["stores"][store_name]
+            data = zlib.decompress(self.read_file(file_name))
+            self.loaded_stores[store_name] = StoreUnpickler(io.BytesIO(data), self).load()
+        return self.loaded_stores[store_name]
+
+    def load_votes(self):
+        for first_seq, file_name in self.manifest["vote_segments"]:
+            data = zlib.decompress(self.read_file(file_name))
+            for vote_dict in StoreUnpickler(io.BytesIO(data), self).load():
+                vote = Vote.__new__(Vote)
+                vote.__dict__.update(vote_dict)
+                self.vote_seqs[id(vote)] = len(self.votes_by_seq)
+                self.votes_by_seq.append(vote)
+
+    def resolve_persistent_id(self, pid):
+        if pid[0] == "vote":
+            if not self.votes_by_seq:
+                self.load_votes()
+            return self.votes_by_seq[pid[1]]
+        if pid[0] == "store":
+            return self.load_store(pid[1])[pid[2]]
+        if pid[0] == "container":
+            _, store_name, tag_hash, attribute = pid
+            return getattr(self.load_store(store_name)[1].tags[tag_hash], attribute)
+        raise pickle.UnpicklingError("Unknown persistent ID %s" % (pid,))
+
+    def load(self):
+        """
+        Load the latest snapshot into the (freshly created) users of the experiment and restore the RNG states.
+        :return: The loop clock, pending actions and scheduler state stored in the manifest.
+        """
+        self.manifest = pickle.loads(self.read_file(MANIFEST_FILE_NAME))
+        if self.manifest["hash_fingerprint"] != HASH_FINGERPRINT:
+            raise RuntimeError("Checkpoint in %s was written with a different PYTHONHASHSEED" % self.checkpoint_dir)
+
+        self.load_votes()
+        for user in self.experiment.users:
+            user.content_db, user.tags_db = self.load_store("user_%d_content" % hash(user))
+            user.votes_db, = self.load_store("user_%d_votes" % hash(user))
+            user.rules_db, = self.load_store("user_%d_rules" % hash(user))
+            user.trust_db, = self.load_store("user_%d_trust" % hash(user))
+            user.trust_db.similarity_memo = self.experiment.similarity_memo
+            if user.trust_db.minhash:
+                user.trust_db.minhash.signatures = self.experiment.minhash_signatures
+            user.peers_db, = self.load_store("user_%d_peers" % hash(user))
+            user.vote_exchange_policy = RandomExchangePolicy(user.votes_db)
+
+        experiment = self.experiment
+        experiment.round, experiment.inaccurate_tags, experiment.rules_reputation_per_round, \
+            experiment.tags_reputation_per_round, experiment.user_reputation_per_round = self.load_store("experiment")
+        self.loaded_stores = {}
+        self.index_stores(self.experiment.users)
+        self.record_revisions(self.experiment.users)
+
+        random.setstate(self.manifest["random_state"])
+        np.random.set_state(self.manifest["numpy_random_state"])
+
+        print("Loaded checkpoint %d at t=%f (%d votes)" %
+              (self.manifest["checkpoint"], self.manifest["state"]["time"], len(self.votes_by_seq)))
+        return self.manifest["state"]
@@ -1,5 +1,117 @@
 import asyncio
 import heapq
+from bisect import insort
+from collections import deque
+from itertools import count
+from typing import List
+
+
+class TimerRecord:
+    """
+    A lightweight replacement for asyncio.TimerHandle.
+    We only keep the fields required to dispatch the callback and to support cancellation (e.g., by asyncio.sleep).
+    """
+    __slots__ = ("_when", "_seq", "_callback", "_args", "_cancelled")
+
+    def __init__(self, when, seq, callback, args):
+        self._when = when
+        self._seq = seq  # The insertion order, which breaks ties between timers with the same timestamp
+        self._callback = callback
+        self._args = args
+        self._cancelled = False
+
+    def when(self):
+        return self._when
+
+    def cancel(self):
+        self._cancelled = True
+
+    def cancelled(self):
+        return self._cancelled
+
+
+class HeapScheduler:
+    """
+    Keeps the scheduled timers in a binary heap, ordered by (timestamp, insertion order).
+    """
+
+    def __init__(self):
+        self._heap = []
+
+    def push(self, when, seq, record: TimerRecord):
+        heapq.heappush(self._heap, (when, seq, record))
+
+    def pop_batch(self) -> List[TimerRecord]:
+        """
+        Pop all timers that share the earliest timestamp, in insertion order.
+        """
+        when, _, record = heapq.heappop(self._heap)
+        batch = [record]
+        while self._heap and self._heap[0][0] == when:
+            batch.append(heapq.heappop(self._heap)[2])
+        return batch
+
+    def __len__(self):
+        return len(self._heap)
+
+
+class CalendarQueue:
+    """
+    A calendar queue (Brown, 1988) that hashes timers into buckets of a fixed width.
+    Enqueue and dequeue take amortized constant time when many events are scheduled at nearby timestamps, which is
+    the case for scenario replays and periodic gossip.
+    """
+
+    def __init__(self, bucket_width=1, num_buckets=1024):
+        self._bucket_width = bucket_width
+        self._num_buckets = num_buckets
+        self._buckets = [[] for _ in range(num_buckets)]
+        self._size = 0
+        self._last_bucket = 0  # The absolute index of the bucket we are currently dequeueing from
+
+    def get_bucket(self, when) -> int:
+        """
+        Return the absolute index of the bucket of a timestamp. We only use this to decide to which bucket a timer
+        belongs, since comparing timestamps to multiples of a bucket width that is not exact in binary floating point
+        (e.g., 0.5 < 5 * 0.1 is False, while 0.5 // 0.1 == 4) would give a different answer.
+        """
+        return int(when // self._bucket_width)
+
+    def push(self, when, seq, record: TimerRecord):
+        bucket_ind = self.get_bucket(when)
+        insort(self._buckets[bucket_ind % self._num_buckets], (when, seq, record))
+        self._size += 1
+        if bucket_ind < self._last_bucket:
+            self._last_bucket = bucket_ind
+
+    def pop_batch(self) -> List[TimerRecord]:
+        """
+        Pop all timers that share the earliest timestamp, in insertion order.
+        """
+        # Walk through the buckets of the current year and take the first event that belongs to that year.
+        for bucket_ind in range(self._last_bucket, self._last_bucket + self._num_buckets):
+            bucket = self._buckets[bucket_ind % self._num_buckets]
+            if bucket and self.get_bucket(bucket[0][0]) == bucket_ind:
+                self._last_bucket = bucket_ind
+                return self._pop_batch_from_bucket(bucket)
+
+        # There is no event in the coming year - directly search for the earliest event.
+        bucket = min((bucket for bucket in self._buckets if bucket), key=lambda b: b[0])
+        self._last_bucket = self.get_bucket(bucket[0][0])
+        return self._pop_batch_from_bucket(bucket)
+
+    def _pop_batch_from_bucket(self, bucket) -> List[TimerRecord]:
+        when = bucket[0][0]
+        num_items = 1
+        while num_items < len(bucket) and bucket[num_items][0] == when:
+            num_items += 1
+        batch = [item[2] for item in bucket[:num_items]]
+        del bucket[:num_items]
+        self._size -= num_items
+        return batch
+
+    def __len__(self):
+        return self._size
 
 
 class DiscreteLoop(asyncio.AbstractEventLoop):
@@ -9,13 +121,18 @@ class DiscreteLoop(asyncio.AbstractEventLoop):
 
     loop = DiscreteLoop()
     set_event_loop(loop)
+
+    All timers that share a timestamp are dispatched as one batch. By default, timers are kept in a binary heap.
+    Pass a CalendarQueue as scheduler when many events are scheduled at dense timestamps (see the event_scheduler
+    setting).
     """
 
-    def __init__(self):
+    def __init__(self, scheduler=None):
         self._time = 0
         self._running = False
-        self._immediate = []
-        self._scheduled = []
+        self._immediate = deque()
+        self._scheduled = scheduler if scheduler is not None else HeapScheduler()
+        self._seq = count()
         self._exc = None
 
     def get_debug(self):
@@ -27,18 +144,48 @@ class DiscreteLoop(asyncio.AbstractEventLoop):
     def run_forever(self):
         self._running = True
         asyncio._set_running_loop(self)
-        while (self._immediate or self._scheduled) and self._running:
-            if self._immediate:
-                h = self._immediate[0]
-                self._immediate = self._immediate[1:]
-            else:
-                h = heapq.heappop(self._scheduled)
-                self._time = h._when
-                h._scheduled = False
+        try:
+            self._run_immediate()
+            while self._scheduled and self._running:
+                batch = self._scheduled.pop_batch()
+                self._time = batch[0]._when
+                for ind, record in enumerate(batch):
+                    if not record._cancelled:
+                        self._run_record(record)
+                        self._run_immediate()
+                    if not self._running:
+                        # We have been stopped halfway through this batch - put the remaining timers back. They keep
+                        # their insertion order, so they still run before timers scheduled during this batch.
+                        for remaining_record in batch[ind + 1:]:
+                            self._scheduled.push(remaining_record._when, remaining_record._seq, remaining_record)
+                        break
+        finally:
+            # Unregister the loop, so a new loop can be run in this process (e.g., by the next run of a sweep).
+            asyncio._set_running_loop(None)
+
+    def _run_record(self, record: TimerRecord):
+        """
+        Run the callback of a timer. Like asyncio.Handle, we pass exceptions to the exception handler of the loop.
+        """
+        try:
+            record._callback(*record._args)
+        except (SystemExit, KeyboardInterrupt):
+            raise
+        except BaseException as exc:
+            self.call_exception_handler({
+                'message': 'Exception in callback %r' % (record._callback,),
+                'exception': exc,
+                'handle': record,
+            })
+
+    def _run_immediate(self):
+        immediate = self._immediate
+        while immediate and self._running:
+            h = immediate.popleft()
             if not h._cancelled:
                 h._run()
-            if self._exc is not None:
-                raise self._exc
+        if self._exc is not None:
+            raise self._exc
 
     def run_until_complete(self, future):
         raise NotImplementedError
@@ -62,7 +209,7 @@ class DiscreteLoop(asyncio.AbstractEventLoop):
         self._exc = context.get('exception', None)
 
     def call_soon(self, callback, *args, context=None):
-        h = asyncio.Handle(callback, args, self)
+        h = asyncio.Handle(callback, args, self, context=context)
         self._immediate.append(h)
         return h
 
@@ -74,10 +221,9 @@ class DiscreteLoop(asyncio.AbstractEventLoop):
     def call_at(self, when, callback, *args):
         if when < self._time:
             raise Exception("Can't schedule in the past")
-        h = asyncio.TimerHandle(when, callback, args, self)
-        heapq.heappush(self._scheduled, h)
-        h._scheduled = True
-        return h
+        record = TimerRecord(when, next(self._seq), callback, args)
+        self._scheduled.push(when, record._seq, record)
+        return record
 
     def create_task(self, coro):
         async def wrapper():
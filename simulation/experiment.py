@@ -2,30 +2,43 @@ import os
 import random
 import shutil
 from asyncio import sleep, get_event_loop, ensure_future
-from typing import Dict, List, Set
+from typing import Dict, Iterator, List, Optional, Set, Tuple
 
 import networkx as nx
+import numpy as np
 
 from core import GENESIS_HASH
 from core.content import Content
+from core.db.content_catalog import ContentCatalog
+from core.db.minhash import MinHashSignatures
+from core.db.similarity_memo import SimilarityMemo
+from core.db.vote_log import VoteLog, VoteLogView
+from core.profiler import profiler
 from core.rule import Rule, RuleType
 from core.tag import Tag
+from core.tracer import TraceLevel, tracer
 from core.user import User, UserType
 from core.vote import Vote
-from simulation.scenario import Scenario, ScenarioAction
-from simulation.settings import RuleCoverageDistribution, ContentPopularityDistribution
+from simulation.checkpoint import Checkpointer
+from simulation.gossip_scheduler import GossipScheduler
+from simulation.matrix_reputations import recompute_reputations_batched
+from simulation.parallel_reputations import recompute_reputations_in_parallel
+from simulation.scenario import CompiledScenarioActions, Scenario, ScenarioAction
+from simulation.settings import RuleCoverageDistribution, ContentPopularityDistribution, GossipSchedulerType, \
+    VoteStorage, ContentStorage, SimilarityCandidates, FlowGraphSparsification, ReputationEngine
 
 random.seed(42)
 
 
 class Experiment:
 
-    def __init__(self, settings):
+    def __init__(self, settings, scenario: Optional[Scenario] = None):
         self.settings = settings
         self.rules = []
         self.content = []
         self.content_popularity = {}
         self.users: List[User] = []
+        self.users_by_id: Dict[int, User] = {}
         self.users_by_type: Dict[UserType: List[User]] = {}
         self.round = 0
         self.scenario = None
@@ -38,22 +51,97 @@ class Experiment:
         self.rules_reputation_per_round = {}
         self.tags_reputation_per_round = {}
         self.user_reputation_per_round = {}
-
-        if settings.scenario_dir:
+        self.results_revision = 0  # Incremented whenever we recompute all reputations, see Checkpointer
+
+        # When streaming the scenario, we only keep a bounded window of upcoming actions on the loop.
+        self.pending_actions: Optional[Iterator[ScenarioAction]] = None
+        self.num_scheduled_actions = 0
+        self.last_scheduled_timestamp = 0
+
+        self.vote_log: Optional[VoteLog] = None
+        if settings.vote_storage == VoteStorage.SHARED_LOG:
+            self.vote_log = VoteLog()
+            if self.retains_votes():
+                raise ValueError("Vote retention requires per-user vote storage")
+        self.content_catalog: Optional[ContentCatalog] = None
+        self.similarity_memo: Optional[SimilarityMemo] = None
+        if settings.similarity_memo:
+            self.similarity_memo = SimilarityMemo(settings.similarity_memo_size)
+        self.minhash_signatures: Optional[MinHashSignatures] = None
+        if settings.similarity_candidates == SimilarityCandidates.MINHASH_LSH:
+            self.minhash_signatures = MinHashSignatures(settings.minhash_bands, settings.minhash_rows,
+                                                        settings.minhash_cache_size)
+        if settings.content_storage == ContentStorage.SHARED_CATALOG:
+            self.content_catalog = ContentCatalog()
+
+        self.gossip_scheduler: Optional[GossipScheduler] = None
+        self.checkpointer: Optional[Checkpointer] = None
+        if settings.checkpoint_dir:
+            self.checkpointer = Checkpointer(self, settings.checkpoint_dir)
+
+        if scenario:
+            self.scenario = scenario  # Already parsed, e.g., by the coordinator of a sharded simulation
+        elif settings.scenario_dir:
             self.scenario = Scenario(settings.scenario_dir)
-            self.scenario.parse()
+            self.scenario.parse(stream=settings.stream_scenario)
 
     def setup_scenario(self):
-        # Create the users
+        self.create_scenario_users()
+
+        # Schedule the scenario actions
+        if self.settings.stream_scenario:
+            self.pending_actions = self.scenario.read_actions()
+            self.schedule_next_actions()
+        else:
+            loop = get_event_loop()
+            for action in self.scenario.actions:
+                loop.call_at(action.timestamp, lambda a=action: self.execute_user_action(a))
+
+    def create_user(self, user_id: int, user_type: UserType) -> User:
+        votes_db = VoteLogView(user_id, self.vote_log) if self.vote_log else None
+        user = User("%d" % user_id, user_type=user_type, votes_db=votes_db, content_catalog=self.content_catalog)
+        if self.minhash_signatures is not None:
+            user.trust_db.enable_candidate_filtering(self.minhash_signatures)
+        user.trust_db.similarity_memo = self.similarity_memo
+        if self.settings.flow_graph_sparsification == FlowGraphSparsification.TOP_K:
+            user.trust_db.enable_flow_graph_sparsification(top_k=self.settings.flow_graph_top_k)
+        elif self.settings.flow_graph_sparsification == FlowGraphSparsification.THRESHOLD:
+            user.trust_db.enable_flow_graph_sparsification(threshold=self.settings.flow_graph_threshold)
+        if self.retains_votes():
+            user.votes_db.enable_retention(self.settings.vote_retention_window,
+                                           self.settings.vote_retention_max_votes_per_user)
+        if self.settings.vote_dag_checkpoint_depth is not None:
+            user.trust_db.enable_vote_dag_checkpoints(self.settings.vote_dag_checkpoint_depth)
+        return user
+
+    def create_scenario_users(self):
         for user_type, users in self.scenario.users_by_type.items():
             for user_ind in users:
-                user = User("%d" % user_ind, user_type=UserType(user_type))
+                user = self.create_user(user_ind, UserType(user_type))
                 self.users.append(user)
+                self.users_by_id[hash(user)] = user
 
-        # Schedule the scenario actions
+    def schedule_next_actions(self):
+        """
+        Read actions from the scenario file until the lookahead window on the loop is full again.
+        """
         loop = get_event_loop()
-        for action in self.scenario.actions:
-            loop.call_at(action.timestamp, lambda a=action: self.execute_user_action(a))
+        while self.num_scheduled_actions < self.settings.scenario_lookahead:
+            action = next(self.pending_actions, None)
+            if not action:
+                break
+
+            if action.timestamp < self.last_scheduled_timestamp:
+                raise ValueError("Scenario file is not sorted by timestamp (action at %f after action at %f)" %
+                                 (action.timestamp, self.last_scheduled_timestamp))
+            self.last_scheduled_timestamp = action.timestamp
+            loop.call_at(action.timestamp, lambda a=action: self.execute_streamed_user_action(a))
+            self.num_scheduled_actions += 1
+
+    def execute_streamed_user_action(self, action: ScenarioAction):
+        self.num_scheduled_actions -= 1
+        self.execute_user_action(action)
+        self.schedule_next_actions()
 
     def execute_user_action(self, action: ScenarioAction):
         user = self.get_user_by_id(action.user_id)
@@ -65,11 +153,12 @@ class Experiment:
             # Therefore, we proactively share it with users that are going to vote on this tag.
             linked_votes = user.trust_db.select_vote_dag_tips()
             vote = Vote(hash(user), tag.cid, tag.name, True, tag.authors, tag.rules, linked_votes)
-            for other_action in self.scenario.actions:
-                if other_action.command == "vote" and other_action.movie_id == action.movie_id and other_action.tag == action.tag:
-                    other_user = self.get_user_by_id(other_action.user_id)
-                    #print("Sharing tag %s with %s" % (tag, other_user))
-                    other_user.process_incoming_vote(vote)
+            # When streaming, the voters of this tag are no longer needed once they have the tag.
+            voters = self.scenario.get_voters(action.movie_id, action.tag, remove=self.settings.stream_scenario)
+            for other_user_id in voters:
+                other_user = self.get_user_by_id(other_user_id)
+                #print("Sharing tag %s with %s" % (tag, other_user))
+                other_user.process_incoming_vote(vote)
 
             # Also give this tag to the spammers
             if 2 in self.scenario.users_by_type:
@@ -83,10 +172,7 @@ class Experiment:
             user.vote(tag, action.is_upvote)
 
     def get_user_by_id(self, user_id: int):
-        for user in self.users:
-            if hash(user) == user_id:
-                return user
-        return None
+        return self.users_by_id.get(user_id, None)
 
     def get_rule_by_id(self, rule_id):
         for rule in self.rules:
@@ -138,11 +224,147 @@ class Experiment:
             elif self.settings.content_popularity_distribution == ContentPopularityDistribution.ZIPF:
                 self.content_popularity[content_ind] = (1 / ((content_ind + 1) ** self.settings.zipf_exponent)) / zipf_denom
 
+    def create_and_share_rules(self):
+        # Create rules
+        self.create_rules()
+
+        # Share and apply rules
+        for user in self.users:
+            user_rules = [rule.get_copy() for rule in self.rules]
+            user.rules_db.add_rules(user_rules)
+            user.apply_rules_to_content()
+
+    def add_user(self, user: User) -> None:
+        self.users.append(user)
+        self.users_by_id[hash(user)] = user
+        if user.type not in self.users_by_type:
+            self.users_by_type[user.type] = []
+        self.users_by_type[user.type].append(user)
+
+    def create_users_in_bulk(self):
+        """
+        Create the users of a synthetic experiment with their initial content, tags and votes, like create_users. The
+        content of every user, the created tags and the votes are drawn as arrays and loaded into the databases of all
+        users in batches, so the results are statistically equivalent to those of create_users (but the random draws
+        differ). A vote links to the two preceding votes in the database of a user, and we do not recompute the
+        reputations of a user before every vote, since a user only knows its own votes (and the ones of rule authors)
+        at this point.
+        """
+        num_content = len(self.content)
+        for user_type, user_num in self.settings.num_users.items():
+            for user_ind in range(len(self.users) + 1, len(self.users) + user_num + 1):
+                user = self.create_user(user_ind, user_type)
+                if user_type == UserType.HONEST:
+                    content_of_user = np.random.choice(num_content,
+                                                       int(num_content * self.settings.content_availability),
+                                                       replace=False)
+                else:
+                    content_of_user = np.arange(num_content)  # Adversarial users have all content.
+                for content_item in content_of_user.tolist():
+                    user.content_db.add_content(Content("%d" % content_item, self.content_popularity[content_item]))
+                self.add_user(user)
+
+        # Share and apply rules. The authors of the rules upvote the generated tags, which we cast with the other votes.
+        self.create_rules()
+        votes_to_cast: Dict[int, List[Tuple[int, Tag, bool]]] = {}  # User ID -> (voter ID, tag, is_accurate)
+        for user in self.users:
+            user_rules = [rule.get_copy() for rule in self.rules]
+            user.rules_db.add_rules(user_rules)
+            tags_per_rule = user.content_db.apply_rules(user_rules)
+            votes_to_cast[hash(user)] = []
+            voted_on: Set[Tuple[int, int]] = set()
+            for rule in user_rules:
+                for tag in tags_per_rule[rule.rule_id]:
+                    if (rule.author, hash(tag)) not in voted_on:
+                        voted_on.add((rule.author, hash(tag)))
+                        votes_to_cast[hash(user)].append((rule.author, tag, True))
+
+        # Draw the tags created by every user. Honest users tag a fraction of their content, bad taggers create
+        # inaccurate tags on all their content.
+        tag_authors, tag_cids = [], []
+        for user in self.users:
+            content_ids = np.array([hash(content_item) for content_item in user.content_db.get_all_content()],
+                                   dtype=np.int64)
+            if user.type == UserType.HONEST:
+                num_items_to_tag = min(len(content_ids),
+                                       int(len(content_ids) * self.settings.initial_tags_created_per_user))
+                content_ids = np.random.choice(content_ids, num_items_to_tag, replace=False)
+            elif user.type != UserType.CREATE_INACCURATE_TAGS:
+                continue
+            tag_authors.append(np.full(len(content_ids), hash(user), dtype=np.int64))
+            tag_cids.append(content_ids)
+        tag_authors = np.concatenate(tag_authors) if tag_authors else np.zeros(0, dtype=np.int64)
+        tag_cids = np.concatenate(tag_cids) if tag_cids else np.zeros(0, dtype=np.int64)
+        tag_names = ["Tag %d" % tag_id for tag_id in (tag_authors * 10000 + tag_cids).tolist()]
+        for author_id, content_id, tag_name in zip(tag_authors.tolist(), tag_cids.tolist(), tag_names):
+            if self.get_user_by_id(author_id).type == UserType.CREATE_INACCURATE_TAGS:
+                self.inaccurate_tags.add(hash((content_id, tag_name)))
+
+        # Every user that has a content item learns the tags created on it
+        tag_order = np.argsort(tag_cids, kind="stable")
+        tag_offsets = np.searchsorted(tag_cids[tag_order], np.arange(num_content + 1))
+        num_tags = 0
+        for user in self.users:
+            content_items = user.content_db.get_all_content()
+            content_ids = np.array([hash(content_item) for content_item in content_items], dtype=np.int64)
+            counts = tag_offsets[content_ids + 1] - tag_offsets[content_ids]
+            starts = np.repeat(tag_offsets[content_ids] - np.cumsum(counts) + counts, counts)
+            user_tag_inds = tag_order[starts + np.arange(counts.sum())]
+            content_inds = np.repeat(np.arange(len(content_items)), counts)
+
+            tags = []
+            for tag_ind in user_tag_inds.tolist():
+                tag = Tag(tag_names[tag_ind], int(tag_cids[tag_ind]))
+                tag.authors.add(int(tag_authors[tag_ind]))
+                tags.append(tag)
+            for content_ind, tag in zip(content_inds.tolist(), user.tags_db.add_tags(tags)):
+                content_items[content_ind].add_tag(tag)
+            num_tags += len(tags)
+
+        # Draw the votes of honest users on the tags of a fraction of their content, created by other users
+        for user in self.users:
+            if user.type != UserType.HONEST:
+                continue
+
+            rules_created = set(user.rules_db.get_rule_ids_created_by_user(hash(user)))
+            content_items = user.content_db.get_all_content()
+            engaged_inds = np.random.choice(len(content_items),
+                                            int(len(content_items) * self.settings.initial_user_engagement),
+                                            replace=False)
+            tags_to_vote_on = [tag for content_ind in engaged_inds.tolist() for tag in content_items[content_ind].tags
+                               if hash(user) not in tag.authors and not rules_created.intersection(tag.rules)]
+            is_accurate = np.array([hash(tag) not in self.inaccurate_tags for tag in tags_to_vote_on], dtype=bool)
+            is_accurate ^= np.random.random(len(tags_to_vote_on)) < self.settings.user_vote_error_rate
+            votes_to_cast[hash(user)] += [(hash(user), tag, vote_is_accurate)
+                                          for tag, vote_is_accurate in zip(tags_to_vote_on, is_accurate.tolist())]
+
+        # Load the votes, where every vote links to the two preceding votes in the database of the user
+        num_votes = 0
+        for user in self.users:
+            votes: List[Vote] = []
+            vote_dag = nx.DiGraph()
+            vote_dag.add_node(GENESIS_HASH)
+            for voter_id, tag, is_accurate in votes_to_cast[hash(user)]:
+                linked_votes = {hash(vote) for vote in votes[-2:]} if votes else {GENESIS_HASH}
+                vote = Vote(voter_id, tag.cid, tag.name, is_accurate, tag.authors, list(tag.rules), linked_votes)
+                for linked_vote_id in linked_votes:
+                    vote_dag.add_edge(hash(vote), linked_vote_id)
+                votes.append(vote)
+            user.votes_db.load_votes(votes, vote_dag)
+            num_votes += len(votes)
+
+        print("Bootstrapped %d users: %d tags (%d stored), %d votes" % (len(self.users), len(tag_names), num_tags,
+                                                                         num_votes))
+
     def create_users(self):
+        if self.settings.bulk_bootstrap:
+            self.create_users_in_bulk()
+            return
+
         # Create users with different profiles
         for user_type, user_num in self.settings.num_users.items():
             for user_ind in range(len(self.users) + 1, len(self.users) + user_num + 1):
-                user = User("%d" % user_ind, user_type=user_type)
+                user = self.create_user(user_ind, user_type)
 
                 if user_type == UserType.HONEST:
                     content_of_user = random.sample(self.content, int(len(self.content) * self.settings.content_availability))
@@ -153,19 +375,9 @@ class Experiment:
                     for content_item in self.content:
                         user.content_db.add_content(Content("%d" % content_item, self.content_popularity[content_item]))
 
-                self.users.append(user)
-                if user.type not in self.users_by_type:
-                    self.users_by_type[user.type] = []
-                self.users_by_type[user.type].append(user)
+                self.add_user(user)
 
-        # Create rules
-        self.create_rules()
-
-        # Share and apply rules
-        for user in self.users:
-            user_rules = [rule.get_copy() for rule in self.rules]
-            user.rules_db.add_rules(user_rules)
-            user.apply_rules_to_content()
+        self.create_and_share_rules()
 
         # Create tags and share them with other users (to bootstrap the network)
         for user in self.users:
@@ -203,13 +415,15 @@ class Experiment:
 
         # Users sometimes vote wrong - if so, we invert the vote
         if random.random() < self.settings.user_vote_error_rate:
-            print("User %s misvotes on tag %s (vote: %s)!" % (user, tag_to_vote_on.name, "-1" if vote else "+1"))
+            if tracer.is_enabled("votes", TraceLevel.INFO):
+                tracer.emit("votes", TraceLevel.INFO, "misvote", user_id=hash(user), user_type=user.type.value,
+                            tag=tag_to_vote_on.name, vote=-1 if vote else 1)
             vote = not vote
 
-        vote_num = 1 if vote else -1
-        print("%s votes %s%d on %s (cid: %s, rules: %s, authors: %s)" % (user, "+" if vote else "", vote_num,
-                                                                         tag_to_vote_on.name, tag_to_vote_on.cid,
-                                                                         tag_to_vote_on.rules, tag_to_vote_on.authors))
+        if tracer.is_enabled("votes", TraceLevel.DEBUG):
+            tracer.emit("votes", TraceLevel.DEBUG, "honest_vote", user_id=hash(user), user_type=user.type.value,
+                        vote=1 if vote else -1, tag=tag_to_vote_on.name, cid=tag_to_vote_on.cid,
+                        rules=sorted(tag_to_vote_on.rules), authors=sorted(tag_to_vote_on.authors))
         user.vote(tag_to_vote_on, vote)
 
     def create_tags(self, user: User) -> List[Tag]:
@@ -275,7 +489,7 @@ class Experiment:
                         if rule.type == RuleType.SPAM:
                             generated_by_spam_rule = True
 
-                        if hash(tag.cid) in rule.applicable_content_ids_correct:
+                        if rule.is_correct_for(hash(tag.cid)):
                             honest_vote = True
                             break
 
@@ -326,10 +540,10 @@ class Experiment:
 
                 G.add_edge(hash(user), to_user_id, weight=similarity, color=edge_color, penwidth=line_thick)
 
-        nx.nx_pydot.write_dot(G, os.path.join("data", self.scenario.scenario_name, "similarity_flows.dot"))
+        nx.nx_pydot.write_dot(G, os.path.join(self.get_data_dir(), "similarity_flows.dot"))
 
     def write_similarities(self):
-        with open(os.path.join("data", self.scenario.scenario_name, "similarities.csv"), "w") as similarities_file:
+        with open(os.path.join(self.get_data_dir(), "similarities.csv"), "w") as similarities_file:
             similarities_file.write("user_type,user_id,other_user_id,similarity\n")
             for user in self.users:
                 if hash(user) not in user.trust_db.similarity_scores:
@@ -341,7 +555,7 @@ class Experiment:
                         "%s,%s,%s,%.3f\n" % (user.type.value, hash(user), to_user_id, similarity))
 
     def write_similarity_flows(self):
-        with open(os.path.join("data", self.scenario.scenario_name, "similarity_flows.csv"), "w") as similarity_flows_file:
+        with open(os.path.join(self.get_data_dir(), "similarity_flows.csv"), "w") as similarity_flows_file:
             similarity_flows_file.write("user_type,user_id,other_user_id,transient_similarity\n")
             for user in self.users:
                 for to_user_id, similarity_flow in user.trust_db.max_flows.items():
@@ -350,7 +564,7 @@ class Experiment:
 
     def write_reputations(self):
         # Write the reputation of tags
-        with open(os.path.join("data", self.scenario.scenario_name, "tag_reputations.csv"), "w") as reputations_file:
+        with open(os.path.join(self.get_data_dir(), "tag_reputations.csv"), "w") as reputations_file:
             reputations_file.write("round,user_id,tag_id,is_accurate,reputation\n")
             for round in self.tags_reputation_per_round:
                 for user_id in self.tags_reputation_per_round[round]:
@@ -363,7 +577,7 @@ class Experiment:
                             "%d,%s,%d,%d,%.3f\n" % (round, user_id, tag_id, 0 if is_inaccurate else 1, self.tags_reputation_per_round[round][user_id][tag_id]))
 
         # Write the reputation of users
-        with open(os.path.join("data", self.scenario.scenario_name, "user_reputations.csv"), "w") as reputations_file:
+        with open(os.path.join(self.get_data_dir(), "user_reputations.csv"), "w") as reputations_file:
             reputations_file.write("round,user_type,other_user_type,user_id,other_user_id,reputation\n")
             for round in self.user_reputation_per_round:
                 for user_id in self.user_reputation_per_round[round]:
@@ -376,7 +590,7 @@ class Experiment:
                             "%d,%s,%s,%s,%s,%.3f\n" % (round, user.type.value, other_user.type.value, user_id, other_user_id, self.user_reputation_per_round[round][user_id][other_user_id]))
 
         # Write the reputation of rules
-        with open(os.path.join("data", self.scenario.scenario_name, "rules_reputations.csv"), "w") as reputations_file:
+        with open(os.path.join(self.get_data_dir(), "rules_reputations.csv"), "w") as reputations_file:
             reputations_file.write("round,user_id,rule_id,rule_type,reputation\n")
             for round in self.rules_reputation_per_round:
                 for user_id in self.rules_reputation_per_round[round]:
@@ -393,7 +607,7 @@ class Experiment:
         """
         For each user, write all the tags in the database with the appropriate weights.
         """
-        with open(os.path.join("data", self.scenario.scenario_name, "tags.csv"), "w") as tags_file:
+        with open(os.path.join(self.get_data_dir(), "tags.csv"), "w") as tags_file:
             tags_file.write("user_id,content_id,tag,is_accurate\n")
             for user in self.users:
                 created_tags = user.tags_db.get_tags_created_by_user(hash(user))
@@ -401,7 +615,7 @@ class Experiment:
                     is_inaccurate = hash(tag) in self.inaccurate_tags
                     tags_file.write("%d,%s,%s,%d\n" % (hash(user), tag.cid, tag.name, 0 if is_inaccurate else 1))
 
-        with open(os.path.join("data", self.scenario.scenario_name, "tag_weights.csv"), "w") as tags_file:
+        with open(os.path.join(self.get_data_dir(), "tag_weights.csv"), "w") as tags_file:
             tags_file.write("user_id,content_id,tag,is_accurate,reputation,weight\n")
             for user in self.users:
                 if user.type != UserType.HONEST:
@@ -416,29 +630,193 @@ class Experiment:
         """
         For every user, write their votes.
         """
-        with open(os.path.join("data", self.scenario.scenario_name, "votes.csv"), "w") as votes_file:
+        with open(os.path.join(self.get_data_dir(), "votes.csv"), "w") as votes_file:
             votes_file.write("user_id,content_id,tag,vote\n")
             for user in self.users:
                 for vote in user.votes_db.get_votes_for_user(hash(user)):
                     votes_file.write("%d,%s,%s,%d\n" % (hash(user), vote.cid, vote.tag, 1 if vote.is_accurate else -1))
 
+    def write_profile(self):
+        """
+        Write the time spent in every phase of the reputation pipeline and the counters, per user and per round.
+        """
+        profiler.write_csv(os.path.join(self.get_data_dir(), "profile_timers.csv"),
+                           os.path.join(self.get_data_dir(), "profile_counters.csv"))
+
     def write_vote_dag(self):
         user = self.get_user_by_id(0)
-        user.votes_db.vote_dag.nodes[GENESIS_HASH]["color"] = "green"
-        user.votes_db.vote_dag.nodes[GENESIS_HASH]["label"] = "gen"
-        for node in user.votes_db.vote_dag.nodes:
+        vote_dag = user.votes_db.vote_dag
+        vote_dag.nodes[GENESIS_HASH]["color"] = "green"
+        vote_dag.nodes[GENESIS_HASH]["label"] = "gen"
+        for node in vote_dag.nodes:
             if node == GENESIS_HASH:
                 continue
             vote = user.votes_db.votes[node]
             user_vote = self.get_user_by_id(vote.user_id)
-            user.votes_db.vote_dag.nodes[node]["label"] = user_vote.identifier
+            vote_dag.nodes[node]["label"] = user_vote.identifier
 
             if user_vote.type != UserType.HONEST:
-                user.votes_db.vote_dag.nodes[node]["color"] = "red"
+                vote_dag.nodes[node]["color"] = "red"
+
+        nx.nx_pydot.write_dot(vote_dag, os.path.join(self.settings.output_dir, "vote_dag.dot"))
+
+    def start_vote_exchanges(self):
+        """
+        Start the routine for exchanging votes, using the gossip scheduler in the settings.
+        """
+        if self.settings.gossip_scheduler == GossipSchedulerType.TIMER_WHEEL:
+            self.gossip_scheduler = GossipScheduler(self.settings.exchange_interval)
+            for user in self.users:
+                first_wakeup_tick = random.randint(0, self.gossip_scheduler.interval_ticks)
+                self.gossip_scheduler.add_user(user, first_wakeup_tick * self.gossip_scheduler.tick)
+            ensure_future(self.gossip_scheduler.start())
+        else:
+            loop = get_event_loop()
+            for user in self.users:
+                loop.call_later(random.randint(0, self.settings.exchange_interval),
+                                lambda u=user: ensure_future(u.start_vote_exchange(self.settings.exchange_interval,
+                                                                                   self.settings.gossip_batch_size)))
+
+    def schedule_checkpoint(self, checkpoint_time):
+        if checkpoint_time < self.settings.duration:
+            get_event_loop().call_at(checkpoint_time, lambda: self.write_checkpoint())
+
+    def write_checkpoint(self):
+        """
+        Snapshot the experiment. We only support this for scenario experiments with the timer-wheel gossip scheduler,
+        since the pending scenario actions and vote exchanges can then be restored without any running coroutines.
+        """
+        loop = get_event_loop()
+        if isinstance(self.scenario.actions, CompiledScenarioActions):
+            pending_actions = np.nonzero(self.scenario.actions.array["timestamp"] > loop.time())[0]
+        else:
+            pending_actions = np.array([ind for ind, action in enumerate(self.scenario.actions)
+                                        if action.timestamp > loop.time()], dtype=np.int64)
+        self.checkpointer.write({
+            "time": loop.time(),
+            "pending_actions": pending_actions,
+            "gossip_current_tick": self.gossip_scheduler.current_tick,
+            "gossip_wheel": [[(wakeup_tick, hash(user)) for wakeup_tick, user in slot]
+                             for slot in self.gossip_scheduler.wheel],
+        })
+        self.schedule_checkpoint(loop.time() + self.settings.checkpoint_interval)
+
+    def retains_votes(self) -> bool:
+        return self.settings.vote_retention_window is not None or \
+            self.settings.vote_retention_max_votes_per_user is not None or \
+            self.settings.vote_dag_checkpoint_depth is not None
+
+    def schedule_vote_retention(self, retention_time):
+        if retention_time < self.settings.duration:
+            get_event_loop().call_at(retention_time, lambda: self.apply_vote_retention())
+
+    def apply_vote_retention(self):
+        """
+        Evict old votes and replace the confirmed parts of the vote DAG by a checkpoint in the databases of all users.
+        """
+        loop = get_event_loop()
+        num_evicted = num_checkpointed = 0
+        for user in self.users:
+            evicted_votes = user.votes_db.apply_retention(loop.time())
+            num_evicted += len(evicted_votes)
+            num_checkpointed += user.trust_db.checkpoint_vote_dag(evicted_votes)
+        print("Vote retention: evicted %d votes and checkpointed %d DAG nodes" % (num_evicted, num_checkpointed))
+        self.schedule_vote_retention(loop.time() + self.settings.vote_retention_interval)
+
+    def validate_checkpoint_settings(self):
+        if not self.scenario or self.settings.stream_scenario or \
+                self.settings.gossip_scheduler != GossipSchedulerType.TIMER_WHEEL:
+            raise ValueError("Checkpoints require a (non-streamed) scenario and the timer-wheel gossip scheduler")
+        if self.vote_log or self.content_catalog:
+            raise ValueError("Checkpoints require per-user vote and content storage")
+        if self.retains_votes():
+            raise ValueError("Checkpoints do not support vote retention")
+
+    def fast_forward_scenario(self):
+        """
+        Bulk-load all scenario actions into the databases of every user, without simulating the gossip.
+        We assume full dissemination, i.e., every user eventually knows every tag and every vote. The vote DAG is built
+        in a single pass by linking each vote to the two votes that precede it in the scenario, and is shared by all
+        users. Naive vote attackers respond to every tag they have not voted on yet, like they do upon receiving votes.
+        """
+        self.create_scenario_users()
+        self.connect_users()
+
+        votes: List[Vote] = []
+        vote_dag = nx.DiGraph()
+        vote_dag.add_node(GENESIS_HASH)
+        tag_authors: Dict[Tuple[int, str], Set[int]] = {}
+        voted_on: Set[Tuple[int, int, str]] = set()
+
+        def cast_vote(user_id, movie_id, tag_name, is_upvote):
+            linked_votes = {hash(vote) for vote in votes[-2:]} if votes else {GENESIS_HASH}
+            vote = Vote(user_id, movie_id, tag_name, is_upvote, tag_authors[(movie_id, tag_name)], [], linked_votes)
+            for linked_vote_id in linked_votes:
+                vote_dag.add_edge(hash(vote), linked_vote_id)
+            votes.append(vote)
+            voted_on.add((user_id, movie_id, tag_name))
+
+        actions = self.scenario.read_actions() if self.settings.stream_scenario else self.scenario.actions
+        for action in actions:
+            if action.command == "create":
+                tag_authors[(action.movie_id, action.tag)] = {action.user_id}
+                cast_vote(action.user_id, action.movie_id, action.tag, True)
+            elif action.command == "vote":
+                assert (action.movie_id, action.tag) in tag_authors, \
+                    "Tag (%s, %s) should be created before it is voted on!" % (action.movie_id, action.tag)
+                cast_vote(action.user_id, action.movie_id, action.tag, action.is_upvote)
+
+        naive_voter_types = [UserType.NAIVE_POSITIVE_VOTER, UserType.NAIVE_NEGATIVE_VOTER, UserType.NAIVE_RANDOM_VOTER]
+        for movie_id, tag_name in tag_authors.keys():
+            for user in self.users:
+                if user.type not in naive_voter_types or (hash(user), movie_id, tag_name) in voted_on:
+                    continue
+
+                if user.type == UserType.NAIVE_NEGATIVE_VOTER:
+                    to_vote = False
+                elif user.type == UserType.NAIVE_POSITIVE_VOTER:
+                    to_vote = True
+                else:
+                    to_vote = random.random() < 0.5
+                cast_vote(hash(user), movie_id, tag_name, to_vote)
+
+        for user in self.users:
+            for (movie_id, tag_name), authors in tag_authors.items():
+                content_item = user.content_db.get_content(movie_id)
+                if not content_item:
+                    content_item = user.content_db.add_content(Content(str(movie_id), 1))
 
-        nx.nx_pydot.write_dot(user.votes_db.vote_dag, os.path.join("data", "vote_dag.dot"))
+                tag = Tag(tag_name, movie_id)
+                tag.authors.update(authors)
+                tag = user.tags_db.add_tag(tag)
+                content_item.add_tag(tag)
+
+            user.votes_db.load_votes(votes, vote_dag)
+
+        print("Fast-forwarded scenario: %d tags, %d votes" % (len(tag_authors), len(votes)))
+
+    def start_instrumentation(self):
+        if self.settings.profile:
+            profiler.enable(get_event_loop().time, self.settings.profile_round_length or self.settings.exchange_interval)
+        if self.settings.trace_levels:
+            tracer.enable(self.settings.trace_levels, self.get_trace_file(), get_event_loop().time)
+
+    def get_trace_file(self) -> Optional[str]:
+        return self.settings.trace_file
+
+    def validate_shard_settings(self):
+        if self.settings.num_shards > 1:
+            raise ValueError("Experiments with %d shards are run by a ShardedSimulation (see run_experiment)" %
+                             self.settings.num_shards)
 
     async def run(self):
+        self.validate_shard_settings()
+        self.start_instrumentation()
+        if self.settings.scenario_dir and self.settings.fast_forward:
+            self.fast_forward_scenario()
+            self.finish()
+            return
+
         if self.settings.scenario_dir:
             self.setup_scenario()
         else:
@@ -447,46 +825,108 @@ class Experiment:
 
         self.connect_users()
 
-        # Start the routine for exchanging votes
-        loop = get_event_loop()
-        for user in self.users:
-            loop.call_later(random.randint(0, self.settings.exchange_interval),
-                            lambda u=user: ensure_future(u.start_vote_exchange(self.settings.exchange_interval,
-                                                                               self.settings.gossip_batch_size)))
+        self.start_vote_exchanges()
+
+        if self.retains_votes():
+            self.schedule_vote_retention(self.settings.vote_retention_interval)
+
+        if self.checkpointer:
+            self.validate_checkpoint_settings()
+            self.schedule_checkpoint(self.settings.checkpoint_interval)
 
         await sleep(self.settings.duration)
 
+        self.finish()
+
+    async def resume(self):
+        """
+        Continue the experiment from the latest checkpoint.
+        The events are restored in the same order as they were scheduled in the original run, so the results are
+        identical to those of an uninterrupted run.
+        """
+        self.validate_shard_settings()
+        self.start_instrumentation()
+        self.validate_checkpoint_settings()
+        self.create_scenario_users()
+        state = self.checkpointer.load()
+        self.connect_users()
+
+        loop = get_event_loop()
+        await sleep(state["time"] - loop.time())
+
+        for action_ind in state["pending_actions"].tolist():
+            action = self.scenario.actions[action_ind]
+            loop.call_at(action.timestamp, lambda a=action: self.execute_user_action(a))
+
+        self.schedule_checkpoint(state["time"] + self.settings.checkpoint_interval)
+
+        self.gossip_scheduler = GossipScheduler(self.settings.exchange_interval)
+        self.gossip_scheduler.current_tick = state["gossip_current_tick"]
+        self.gossip_scheduler.wheel = [[(wakeup_tick, self.get_user_by_id(user_id)) for wakeup_tick, user_id in slot]
+                                       for slot in state["gossip_wheel"]]
+        ensure_future(self.gossip_scheduler.resume())
+
+        await sleep(self.settings.duration - loop.time())
+
+        self.finish()
+
+    def finish(self):
         self.recompute_all_reputations()
+        tracer.close()
+        if self.similarity_memo:
+            print("Similarity memo: %s" % self.similarity_memo)
         self.write_data()
+        profiler.disable()  # A sweep reuses this process for its next run, which might not be profiled
 
         loop = get_event_loop()
         loop.stop()
 
     def recompute_all_reputations(self):
+        self.results_revision += 1
         self.rules_reputation_per_round[self.round] = {}
         self.user_reputation_per_round[self.round] = {}
         self.tags_reputation_per_round[self.round] = {}
+        batched = self.settings.reputation_engine == ReputationEngine.MATRIX
+        if batched:
+            print("Recomputing all reputations of %d users with the matrix engine" % len(self.users))
+            recompute_reputations_batched(self.users)
+            for user in self.users:
+                user.trust_db.compute_graph_influences()
+        elif self.settings.reputation_workers > 1:
+            print("Recomputing all reputations with %d worker processes" % self.settings.reputation_workers)
+            recompute_reputations_in_parallel(self.users, self.settings.reputation_workers)
+
         for user in self.users:
-            print("Recomputing all reputations for %s" % user)
-            user.recompute_reputations()
-            user.trust_db.compute_graph_influences()
+            if not batched and self.settings.reputation_workers <= 1:
+                if tracer.is_enabled("reputations", TraceLevel.INFO):
+                    tracer.emit("reputations", TraceLevel.INFO, "reputations", user_id=hash(user),
+                                user_type=user.type.value)
+                user.recompute_reputations()
+                user.trust_db.compute_graph_influences()
             self.rules_reputation_per_round[self.round][hash(user)] = {}
             self.user_reputation_per_round[self.round][hash(user)] = {}
             self.tags_reputation_per_round[self.round][hash(user)] = {}
             for rule in user.rules_db.get_all_rules():
-                print("Reputation rule %s: %f" % (hash(rule), rule.reputation_score))
+                if tracer.is_enabled("reputations", TraceLevel.DEBUG):
+                    tracer.emit("reputations", TraceLevel.DEBUG, "rule_score", user_id=hash(user), rule_id=hash(rule),
+                                reputation=rule.reputation_score)
                 self.rules_reputation_per_round[self.round][hash(user)][rule.rule_id] = rule.reputation_score
             for other_user_id, user_rep in user.trust_db.user_reputations.items():
-                print("Reputation of user %s: %f" % (other_user_id, user_rep))
+                if tracer.is_enabled("reputations", TraceLevel.DEBUG):
+                    tracer.emit("reputations", TraceLevel.DEBUG, "user_score", user_id=hash(user),
+                                other_user_id=other_user_id, reputation=user_rep)
                 self.user_reputation_per_round[self.round][hash(user)][other_user_id] = user_rep
             for tag in user.tags_db.get_all_tags():
                 #print("Reputation tag %s: %f" % (hash(tag), tag.reputation_score))
                 self.tags_reputation_per_round[self.round][hash(user)][hash(tag)] = tag.reputation_score
 
+    def get_data_dir(self) -> str:
+        return os.path.join(self.settings.output_dir, self.scenario.scenario_name)
+
     def write_data(self):
-        data_dir_path = os.path.join("data", self.scenario.scenario_name)
+        data_dir_path = self.get_data_dir()
         shutil.rmtree(data_dir_path, ignore_errors=True)
-        os.mkdir(data_dir_path)
+        os.makedirs(data_dir_path)
 
         self.write_similarity_graph()
         self.write_similarities()
@@ -494,4 +934,6 @@ class Experiment:
         self.write_reputations()
         self.write_tags()
         self.write_votes()
+        if self.settings.profile:
+            self.write_profile()
         self.write_vote_dag()
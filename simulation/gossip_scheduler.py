@@ -0,0 +1,76 @@
+from asyncio import sleep, get_event_loop
+from fractions import Fraction
+from typing import List, Optional, Tuple
+
+from core.user import User
+
+
+class GossipScheduler:
+    """
+    A central scheduler that drives the vote exchanges of all users.
+
+    Instead of running one coroutine (and one timer) per user, we keep the next wakeup of every user in a timer wheel.
+    The wheel has one slot per tick and is large enough to hold a full exchange interval, so a single coroutine can
+    advance the wheel every tick and fire all the exchanges that are due in that tick as one batch.
+
+    By default, the tick is the largest duration that divides both the exchange interval and one second, so users can
+    wake up at every whole second and exchange votes at exactly the given interval.
+    """
+
+    def __init__(self, exchange_interval, tick: Optional[float] = None):
+        if tick is None:
+            tick = 1 / Fraction(exchange_interval).limit_denominator(1000).denominator
+        interval_ticks = exchange_interval / tick
+        if round(interval_ticks) < 1 or abs(interval_ticks - round(interval_ticks)) > 1e-9:
+            raise ValueError("Exchange interval %s is not a positive multiple of the tick %s" %
+                             (exchange_interval, tick))
+
+        self.exchange_interval = exchange_interval
+        self.tick = tick
+        self.interval_ticks = round(interval_ticks)
+        self.wheel: List[List[Tuple[int, User]]] = [[] for _ in range(self.interval_ticks + 1)]
+        self.current_tick = 0
+
+    def add_user(self, user: User, first_wakeup: float) -> None:
+        """
+        Schedule the first vote exchange of a user.
+        :param user: The user that should periodically exchange votes.
+        :param first_wakeup: The time (in seconds) of the first vote exchange of this user.
+        """
+        wakeup_tick = max(self.current_tick, round(first_wakeup / self.tick))
+        self.wheel[wakeup_tick % len(self.wheel)].append((wakeup_tick, user))
+
+    def fire_due_exchanges(self) -> int:
+        """
+        Perform the vote exchanges of all users that are due in the current tick and reschedule them.
+        :return: The number of exchanges that have been performed.
+        """
+        slot_ind = self.current_tick % len(self.wheel)
+        slot = self.wheel[slot_ind]
+        if not slot:
+            return 0
+
+        due_users = [user for wakeup_tick, user in slot if wakeup_tick == self.current_tick]
+        self.wheel[slot_ind] = [(wakeup_tick, user) for wakeup_tick, user in slot if wakeup_tick != self.current_tick]
+
+        next_wakeup_tick = self.current_tick + self.interval_ticks
+        next_slot = self.wheel[next_wakeup_tick % len(self.wheel)]
+        for user in due_users:
+            user.exchange_votes()
+            next_slot.append((next_wakeup_tick, user))
+
+        return len(due_users)
+
+    async def start(self):
+        while True:
+            self.fire_due_exchanges()
+            await sleep(self.tick)
+            self.current_tick += 1
+
+    async def resume(self):
+        """
+        Continue advancing the wheel after restoring it from a checkpoint, which was taken after the current tick.
+        """
+        await sleep((self.current_tick + 1) * self.tick - get_event_loop().time())
+        self.current_tick += 1
+        await self.start()
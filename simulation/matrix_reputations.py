@@ -0,0 +1,260 @@
+"""
+Recompute the reputations of many users (perspectives) at once, with matrix operations.
+
+Users that know (mostly) the same votes repeat the same computations for every perspective. We therefore store the signs
+of all votes in one (tags x voters) matrix that is shared by all perspectives, and only store the entries in which the
+knowledge of a user deviates from it as sparse corrections. The tag reputations of all perspectives are then computed
+by multiplying the stacked (masked) max flow vectors of all users with the shared sign matrix, after which the
+corrections are applied. Rule reputations and tag weights are computed in the same way, with shared (tags x rules) and
+(tags x authors) matrices.
+
+The similarities and max flows are still computed per user, since they depend on the similarity graph of every user.
+The results are equal to the ones of User.recompute_reputations, up to the order of floating point additions.
+"""
+from typing import Dict, List, Tuple
+
+import numpy as np
+from numpy import average
+
+from core.profiler import profiled
+from core.user import User
+
+Entries = Tuple[np.ndarray, np.ndarray, np.ndarray]  # Rows, columns and values of the entries of a sparse matrix
+
+
+def create_entries(entries: Dict[Tuple[int, int], float]) -> Entries:
+    if not entries:
+        return np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0)
+    keys = np.array(list(entries.keys()), dtype=np.int64)
+    return keys[:, 0], keys[:, 1], np.array(list(entries.values()), dtype=np.float64)
+
+
+class SharedMatrix:
+    """
+    A (rows x columns) matrix per perspective, stored as one shared dense matrix with sparse corrections per
+    perspective. An entry of the shared matrix is the value of the first perspective that has this entry.
+    """
+
+    def __init__(self, num_rows: int, num_cols: int, perspective_entries: List[Entries]):
+        self.values = np.zeros((num_rows, num_cols))
+        for rows, cols, values in reversed(perspective_entries):
+            self.values[rows, cols] = values
+        flat_values = self.values.ravel()
+        shared_entries = np.flatnonzero(flat_values)
+
+        self.corrections: List[Entries] = []
+        for rows, cols, values in perspective_entries:
+            entries = rows * num_cols + cols
+            differs = values != flat_values[entries]
+            missing = np.setdiff1d(shared_entries, entries)
+            self.corrections.append((np.concatenate((rows[differs], missing // num_cols)),
+                                     np.concatenate((cols[differs], missing % num_cols)),
+                                     np.concatenate((values[differs] - flat_values[entries[differs]],
+                                                     -flat_values[missing]))))
+
+    def get_indicator_corrections(self, perspective: int) -> Entries:
+        rows, cols, deltas = self.corrections[perspective]
+        shared = self.values[rows, cols]
+        return rows, cols, (shared + deltas != 0).astype(np.float64) - (shared != 0)
+
+    def multiply(self, vectors: np.ndarray, indicator: bool = False) -> np.ndarray:
+        """
+        Multiply the matrix of every perspective with the vector of that perspective.
+        :param vectors: The (perspectives x columns) matrix with the stacked vectors of all perspectives.
+        :param indicator: Whether to use the indicator matrices (1 for every non-zero entry) instead.
+        :return: The (perspectives x rows) matrix with the products.
+        """
+        matrix = (self.values != 0).astype(np.float64) if indicator else self.values
+        products = vectors @ matrix.T
+        for perspective in range(len(self.corrections)):
+            rows, cols, deltas = self.get_indicator_corrections(perspective) if indicator \
+                else self.corrections[perspective]
+            np.add.at(products[perspective], rows, vectors[perspective, cols] * deltas)
+        return products
+
+    def get_rows(self, perspective: int, rows: np.ndarray, indicator: bool = False) -> np.ndarray:
+        """
+        Return the given rows of the matrix of a perspective, as a dense matrix.
+        """
+        values = self.values[rows]
+        corrected_rows, cols, deltas = self.get_indicator_corrections(perspective) if indicator \
+            else self.corrections[perspective]
+        positions = np.searchsorted(rows, corrected_rows)
+        selected = (positions < len(rows)) & (rows[np.minimum(positions, len(rows) - 1)] == corrected_rows)
+        values = (values != 0).astype(np.float64) if indicator else values.copy()
+        np.add.at(values, (positions[selected], cols[selected]), deltas[selected])
+        return values
+
+
+class ReputationMatrices:
+    """
+    The shared matrices of a set of users, with the indices of all tags, voters (and authors) and rules they know.
+    """
+
+    def __init__(self, users: List[User]):
+        self.users = users
+        self.tag_indices: Dict[int, int] = {}
+        self.user_indices: Dict[int, int] = {}
+        self.rule_indices: Dict[int, int] = {}
+
+        sign_entries, rule_entries, author_entries = [], [], []
+        for user in users:
+            signs, rules, authors = {}, {}, {}
+            for tag_id, voter_id, sign in user.votes_db.evicted_votes.get_all_votes():
+                key = (self.get_index(self.tag_indices, tag_id), self.get_index(self.user_indices, voter_id))
+                if key not in signs:
+                    signs[key] = sign  # Like get_votes_for_tag, we use the first evicted vote of a voter on a tag
+            for tag_id, votes_per_voter in user.votes_db.votes_for_tag.items():
+                tag_ind = self.get_index(self.tag_indices, tag_id)
+                for voter_id, vote in votes_per_voter.items():
+                    key = (tag_ind, self.get_index(self.user_indices, voter_id))
+                    if key not in signs:
+                        signs[key] = 1 if vote.is_accurate else -1
+            for tag in user.tags_db.get_all_tags():
+                tag_ind = self.get_index(self.tag_indices, hash(tag))
+                for rule_id in tag.rules:
+                    key = (tag_ind, self.get_index(self.rule_indices, rule_id))
+                    rules[key] = rules.get(key, 0) + 1  # A rule can be listed more than once
+                for author_id in tag.authors:
+                    authors[(tag_ind, self.get_index(self.user_indices, author_id))] = 1
+            for rule in user.rules_db.get_all_rules():
+                self.get_index(self.rule_indices, rule.rule_id)
+            for user_id in list(user.trust_db.max_flows.keys()) + list(user.trust_db.user_reputations.keys()):
+                self.get_index(self.user_indices, user_id)
+            sign_entries.append(create_entries(signs))
+            rule_entries.append(create_entries(rules))
+            author_entries.append(create_entries(authors))
+
+        num_tags, num_users, num_rules = len(self.tag_indices), len(self.user_indices), len(self.rule_indices)
+        self.signs = SharedMatrix(num_tags, num_users, sign_entries)      # Tags x voters, the sign of every vote
+        self.rules = SharedMatrix(num_tags, num_rules, rule_entries)      # Tags x rules, the rules that generated a tag
+        self.authors = SharedMatrix(num_tags, num_users, author_entries)  # Tags x authors, the authors of a tag
+
+        # The (rules x voters) sums and number of votes on the tags generated by every rule, with the shared matrices.
+        # Every perspective only replaces the contribution of the tags for which it has corrections.
+        self.rule_tags = (self.rules.values != 0).astype(np.float64).T
+        self.rule_vote_sums = self.rule_tags @ self.signs.values
+        self.rule_vote_counts = self.rule_tags @ (self.signs.values != 0)
+
+    @staticmethod
+    def get_index(indices: Dict[int, int], key: int) -> int:
+        if key not in indices:
+            indices[key] = len(indices)
+        return indices[key]
+
+    def get_user_vectors(self, values_per_user: List[Dict[int, float]]) -> np.ndarray:
+        vectors = np.zeros((len(self.users), len(self.user_indices)))
+        for perspective, values in enumerate(values_per_user):
+            for user_id, value in values.items():
+                vectors[perspective, self.user_indices[user_id]] = value
+        return vectors
+
+    def compute_tag_reputations(self, flows: np.ndarray) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The reputation of a tag is the average of the votes on it, weighted by the max flow to the voter. Voters with a
+        max flow in (-0.2, 0.2) are ignored.
+        :return: The (perspectives x tags) sums of weighted votes and the number of counted votes.
+        """
+        counted = ((flows <= -0.2) | (flows >= 0.2)).astype(np.float64)
+        return self.signs.multiply(flows * counted), self.signs.multiply(counted, indicator=True)
+
+    def compute_rule_reputations(self, perspective: int, similarities: np.ndarray, flows: np.ndarray) -> np.ndarray:
+        """
+        The reputation of a rule is the average opinion of the voters on the tags generated by the rule (multiplied by
+        the similarity with the voter), weighted by the max flow to the voter.
+        """
+        num_rules = len(self.rule_indices)
+        if not num_rules:
+            return np.zeros(0)
+
+        # The (rules x voters) sums and number of votes on the tags generated by every rule, where we replace the
+        # contribution of the tags for which the perspective has corrections.
+        vote_sums = self.rule_vote_sums
+        vote_counts = self.rule_vote_counts
+        corrected_tags = np.unique(np.concatenate((self.signs.corrections[perspective][0],
+                                                   self.rules.corrections[perspective][0])))
+        if len(corrected_tags):
+            shared_rule_tags = self.rule_tags[:, corrected_tags]
+            shared_signs = self.signs.values[corrected_tags]
+            rule_tags_rows = self.rules.get_rows(perspective, corrected_tags, indicator=True).T
+            signs_rows = self.signs.get_rows(perspective, corrected_tags)
+            vote_sums = vote_sums + (rule_tags_rows @ signs_rows - shared_rule_tags @ shared_signs)
+            vote_counts = vote_counts + (rule_tags_rows @ (signs_rows != 0) - shared_rule_tags @ (shared_signs != 0))
+
+        opinions = np.divide(vote_sums, vote_counts, out=np.zeros_like(vote_sums), where=vote_counts > 0)
+        counted = (vote_counts > 0) & ~((-0.2 < similarities) & (similarities < 0.2))
+        weights = counted * flows
+        weight_sums = weights.sum(axis=1)
+        reputation_sums = (weights * similarities * opinions).sum(axis=1)
+        return np.divide(reputation_sums, weight_sums, out=np.zeros(num_rules), where=weight_sums != 0)
+
+    def compute_tag_weights(self, rule_reputations: np.ndarray, user_reputations: np.ndarray) \
+            -> Tuple[np.ndarray, np.ndarray]:
+        """
+        The weight of a tag combines the reputations of the rules that generated it and of its authors.
+        :return: The (perspectives x tags) sums of these reputations, and their number.
+        """
+        reputation_sums = self.rules.multiply(rule_reputations) + self.authors.multiply(user_reputations)
+        counts = self.rules.multiply(np.ones_like(rule_reputations)) + \
+            self.authors.multiply(np.ones_like(user_reputations))
+        return reputation_sums, counts
+
+
+def compute_user_reputations(user: User) -> None:
+    """
+    Compute the reputations of other users from the (already computed) tag reputations, like
+    User.compute_user_reputation, but in a single pass over the tags.
+    """
+    tag_reps_per_author: Dict[int, List[float]] = {}
+    for tag in user.tags_db.get_all_tags():
+        for author_id in tag.authors:
+            if author_id not in tag_reps_per_author:
+                tag_reps_per_author[author_id] = []
+            tag_reps_per_author[author_id].append(tag.reputation_score)
+
+    user.trust_db.user_reputations = {hash(user): 1}
+    for user_id in user.peers_db.get_peers():
+        tag_reps = tag_reps_per_author.get(user_id, None)
+        transient_similarity_score = user.trust_db.max_flows[user_id] if user_id in user.trust_db.max_flows else 0
+        if not tag_reps:
+            user.trust_db.user_reputations[user_id] = transient_similarity_score
+        else:
+            user.trust_db.user_reputations[user_id] = (average(tag_reps) + transient_similarity_score) / 2
+
+
+@profiled("recompute_reputations_batched")
+def recompute_reputations_batched(users: List[User]) -> None:
+    """
+    Recompute the reputations of the given users, with the reputations of tags and rules and the tag weights computed
+    for all users at once.
+    """
+    for user in users:
+        user.trust_db.compute_similarities()
+        user.trust_db.compute_flows()
+
+    matrices = ReputationMatrices(users)
+    flows = matrices.get_user_vectors([user.trust_db.max_flows for user in users])
+    vote_sums, vote_counts = matrices.compute_tag_reputations(flows)
+
+    rule_reputations = np.zeros((len(users), len(matrices.rule_indices)))
+    for perspective, user in enumerate(users):
+        for tag in user.tags_db.get_all_tags():
+            tag_ind = matrices.tag_indices[hash(tag)]
+            count = vote_counts[perspective, tag_ind]
+            tag.reputation_score = vote_sums[perspective, tag_ind] / count if count > 0 else 0
+
+        similarities = matrices.get_user_vectors([user.trust_db.similarity_scores.get(hash(user), {})])[0]
+        rule_reputations[perspective] = matrices.compute_rule_reputations(perspective, similarities, flows[perspective])
+        for rule in user.rules_db.get_all_rules():
+            rule.reputation_score = rule_reputations[perspective, matrices.rule_indices[rule.rule_id]]
+
+        compute_user_reputations(user)
+
+    user_reputations = matrices.get_user_vectors([user.trust_db.user_reputations for user in users])
+    reputation_sums, counts = matrices.compute_tag_weights(rule_reputations, user_reputations)
+    for perspective, user in enumerate(users):
+        for tag in user.tags_db.get_all_tags():
+            tag_ind = matrices.tag_indices[hash(tag)]
+            if counts[perspective, tag_ind] > 0:
+                tag.weight = (tag.reputation_score + reputation_sums[perspective, tag_ind] /
+                              counts[perspective, tag_ind]) / 2
@@ -0,0 +1,139 @@
+"""
+Recompute the reputations of many users in parallel, using a pool of worker processes.
+
+The computation for a user only reads the databases of that user. We therefore send each worker a compact, pickled view
+of these databases (without the vote DAG and the references to other users) and return the computed reputations as
+arrays, which are then applied to the user in the main process.
+"""
+import multiprocessing
+import pickle
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+
+from core.db.content_catalog import ContentCatalog, SharedContentDatabase
+from core.db.minhash import MinHashSignatures
+from core.db.similarity_memo import SimilarityMemo
+from core.db.vote_log import VoteLog, VoteLogView
+from core.profiler import profiled
+from core.tracer import TraceLevel, tracer
+from core.user import User
+
+# The vote log, content catalog, similarity cache and MinHash signatures that are shared by all users (if any). They are
+# inherited by the forked workers, so we do not send them along with the databases of every user.
+shared_vote_log: Optional[VoteLog] = None
+shared_content_catalog: Optional[ContentCatalog] = None
+shared_similarity_memo: Optional[SimilarityMemo] = None
+shared_minhash_signatures: Optional[MinHashSignatures] = None
+
+
+def serialize_user_view(user: User) -> bytes:
+    """
+    Pickle the databases of a user that are required to recompute its reputations.
+    """
+    votes_db = user.votes_db
+    neighbours = user.neighbours
+    user.neighbours = []
+    catalog = getattr(user.content_db, "catalog", None)
+    if catalog:
+        user.content_db.catalog = None
+        user.tags_db.catalog = None
+    try:
+        if isinstance(votes_db, VoteLogView):
+            log = votes_db.log
+            votes_db.log = None
+            try:
+                return pickle.dumps(user, protocol=pickle.HIGHEST_PROTOCOL)
+            finally:
+                votes_db.log = log
+
+        vote_dag = votes_db.vote_dag
+        votes_db.vote_dag = None
+        try:
+            return pickle.dumps(user, protocol=pickle.HIGHEST_PROTOCOL)
+        finally:
+            votes_db.vote_dag = vote_dag
+    finally:
+        if catalog:
+            user.content_db.catalog = catalog
+            user.tags_db.catalog = catalog
+        user.neighbours = neighbours
+
+
+def compute_reputations(user_view: bytes) -> Dict:
+    """
+    Recompute all reputations of a user, in a worker process.
+    :param user_view: The pickled databases of the user, see serialize_user_view.
+    :return: The reputations of rules, users and tags, the similarity scores and flows of the user, and the events we
+    traced (which the main process writes).
+    """
+    if tracer.levels:
+        tracer.collect_events()
+    user: User = pickle.loads(user_view)
+    if isinstance(user.votes_db, VoteLogView):
+        user.votes_db.log = shared_vote_log
+    if isinstance(user.content_db, SharedContentDatabase):
+        user.content_db.catalog = shared_content_catalog
+        user.tags_db.catalog = shared_content_catalog
+    user.trust_db.similarity_memo = shared_similarity_memo
+    if user.trust_db.minhash:
+        user.trust_db.minhash.signatures = shared_minhash_signatures
+    if tracer.is_enabled("reputations", TraceLevel.INFO):
+        tracer.emit("reputations", TraceLevel.INFO, "reputations", user_id=hash(user), user_type=user.type.value)
+    user.recompute_reputations()
+    user.trust_db.compute_graph_influences()
+
+    rules = list(user.rules_db.get_all_rules())
+    tags = user.tags_db.get_all_tags()
+    return {
+        "rule_ids": np.array([rule.rule_id for rule in rules], dtype=np.int64),
+        "rule_reputations": np.array([rule.reputation_score for rule in rules], dtype=np.float64),
+        "user_ids": np.array(list(user.trust_db.user_reputations.keys()), dtype=np.int64),
+        "user_reputations": np.array(list(user.trust_db.user_reputations.values()), dtype=np.float64),
+        "tag_ids": np.array([hash(tag) for tag in tags], dtype=np.int64),
+        "tag_reputations": np.array([tag.reputation_score for tag in tags], dtype=np.float64),
+        "tag_weights": np.array([tag.weight for tag in tags], dtype=np.float64),
+        "similarity_scores": user.trust_db.similarity_scores,
+        "max_flows": user.trust_db.max_flows,
+        "trace_events": tracer.pop_collected_events(),
+    }
+
+
+def apply_reputations(user: User, result: Dict) -> None:
+    """
+    Store the reputations computed by a worker process in the databases of the user.
+    """
+    for rule_id, reputation in zip(result["rule_ids"].tolist(), result["rule_reputations"].tolist()):
+        user.rules_db.get_rule(rule_id).reputation_score = reputation
+    user.trust_db.user_reputations = dict(zip(result["user_ids"].tolist(), result["user_reputations"].tolist()))
+    for tag_id, reputation, weight in zip(result["tag_ids"].tolist(), result["tag_reputations"].tolist(),
+                                          result["tag_weights"].tolist()):
+        tag = user.tags_db.get_tag(tag_id)
+        tag.reputation_score = reputation
+        tag.weight = weight
+    user.trust_db.similarity_scores = result["similarity_scores"]
+    user.trust_db.max_flows = result["max_flows"]
+    for event in result["trace_events"]:
+        tracer.write_event(event)
+
+
+@profiled("recompute_reputations_in_parallel")
+def recompute_reputations_in_parallel(users: List[User], num_workers: int) -> None:
+    """
+    Recompute the reputations of the given users with a pool of worker processes.
+    We fork the workers, since tags are looked up by Python hashes of strings that should be equal to the ones in the
+    main process (which is not the case for spawned processes with a random hash seed).
+    """
+    global shared_vote_log, shared_content_catalog, shared_similarity_memo, shared_minhash_signatures
+    shared_vote_log = users[0].votes_db.log if users and isinstance(users[0].votes_db, VoteLogView) else None
+    shared_content_catalog = getattr(users[0].content_db, "catalog", None) if users else None
+    shared_similarity_memo = users[0].trust_db.similarity_memo if users else None
+    shared_minhash_signatures = users[0].trust_db.minhash.signatures if users and users[0].trust_db.minhash else None
+    tracer.flush()  # The workers inherit the buffer of the trace file, see Tracer.collect_events
+
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("fork")) as executor:
+        user_views = (serialize_user_view(user) for user in users)
+        chunk_size = max(1, len(users) // (num_workers * 4))
+        for user, result in zip(users, executor.map(compute_reputations, user_views, chunksize=chunk_size)):
+            apply_reputations(user, result)
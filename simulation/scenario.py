@@ -1,7 +1,25 @@
 import csv
+import json
 import os
+from array import array
 from dataclasses import dataclass
-from typing import List
+from typing import Dict, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+# The compiled scenario format: one row per action, with commands and tags interned in the scenario metadata.
+SCENARIO_ACTION_DTYPE = np.dtype([
+    ("timestamp", "<f8"),
+    ("command", "u1"),
+    ("user_id", "<i8"),
+    ("movie_id", "<i8"),
+    ("tag_id", "<u4"),
+    ("is_upvote", "?"),
+])
+COMPILED_ACTIONS_FILE_NAME = "experiment.scenario.npy"
+COMPILED_METADATA_FILE_NAME = "experiment.scenario.json"
+COMPILED_VOTERS_FILE_NAME = "experiment.scenario.voters.npy"  # The movie IDs, tag IDs and user IDs of all votes
+COMPILED_INPUT_FILE_NAMES = ["experiment.scenario", "users.csv"]  # The files that are converted to the compiled format
 
 
 @dataclass
@@ -14,6 +32,34 @@ class ScenarioAction:
     is_upvote: bool
 
 
+class CompiledScenarioActions:
+    """
+    A read-only list of scenario actions, backed by a memory-mapped array in the compiled scenario format.
+    Actions are only materialized when accessed, and parallel runs on the same scenario share the mapped pages.
+    """
+
+    def __init__(self, actions: np.ndarray, commands: List[str], tags: List[str]):
+        self.array = actions
+        self.commands = commands
+        self.tags = tags
+
+    def to_action(self, timestamp, command, user_id, movie_id, tag_id, is_upvote) -> ScenarioAction:
+        return ScenarioAction(self.commands[command], timestamp, user_id, movie_id, self.tags[tag_id], is_upvote)
+
+    def __len__(self):
+        return len(self.array)
+
+    def __getitem__(self, ind) -> ScenarioAction:
+        return self.to_action(*self.array[ind].tolist())
+
+    def __iter__(self) -> Iterator[ScenarioAction]:
+        # Convert the rows in chunks, which is much faster than accessing them one by one.
+        chunk_size = 65536
+        for start_ind in range(0, len(self.array), chunk_size):
+            for row in self.array[start_ind:start_ind + chunk_size].tolist():
+                yield self.to_action(*row)
+
+
 class Scenario:
 
     def __init__(self, scenario_dir):
@@ -22,13 +68,59 @@ class Scenario:
         self.actions: List[ScenarioAction] = []
         self.unique_users = set()
         self.users_by_type = {}
+        self.voters_per_tag: Dict[Tuple[int, str], array] = {}  # (movie ID, tag) -> IDs of users voting on it
+        self.compiled_actions = None
+        self.compiled_voters: Optional[np.ndarray] = None  # The voters in a compiled scenario, see get_voters
+        self.tag_ids: Dict[str, int] = {}  # Tag -> its ID in a compiled scenario
+        self.is_compiled: Optional[bool] = None  # Whether there is an up-to-date compiled scenario, once checked
 
-    def parse(self):
+    def has_compiled_scenario(self) -> bool:
         """
-        Read the scenario file and schedule the events.
+        Check whether there is a compiled scenario that is at least as recent as all the files it was compiled from.
+        The result is determined once, so we only report an outdated compiled scenario once.
         """
+        if self.is_compiled is None:
+            self.is_compiled = self.check_compiled_scenario()
+        return self.is_compiled
+
+    def check_compiled_scenario(self) -> bool:
+        compiled_file_paths = [os.path.join(self.scenario_dir, file_name)
+                               for file_name in (COMPILED_ACTIONS_FILE_NAME, COMPILED_METADATA_FILE_NAME,
+                                                 COMPILED_VOTERS_FILE_NAME)]
+        if not all(os.path.exists(file_path) for file_path in compiled_file_paths):
+            return False
+
+        compiled_time = min(os.path.getmtime(file_path) for file_path in compiled_file_paths)
+        for file_name in COMPILED_INPUT_FILE_NAMES:
+            file_path = os.path.join(self.scenario_dir, file_name)
+            if os.path.exists(file_path) and os.path.getmtime(file_path) > compiled_time:
+                print("Compiled scenario in %s is outdated (%s changed) - parsing the scenario files instead" %
+                      (self.scenario_dir, file_name))
+                return False
+
+        return True
+
+    def load_compiled_actions(self) -> CompiledScenarioActions:
+        if self.compiled_actions is None:
+            with open(os.path.join(self.scenario_dir, COMPILED_METADATA_FILE_NAME)) as metadata_file:
+                metadata = json.load(metadata_file)
+            actions = np.load(os.path.join(self.scenario_dir, COMPILED_ACTIONS_FILE_NAME), mmap_mode="r")
+            self.compiled_actions = CompiledScenarioActions(actions, metadata["commands"], metadata["tags"])
+            self.users_by_type = metadata["users_by_type"]
+            self.compiled_voters = np.load(os.path.join(self.scenario_dir, COMPILED_VOTERS_FILE_NAME), mmap_mode="r")
+            self.tag_ids = {tag: tag_id for tag_id, tag in enumerate(metadata["tags"])}
+        return self.compiled_actions
+
+    def read_actions(self) -> Iterator[ScenarioAction]:
+        """
+        Lazily read the actions in the scenario file, one line at a time.
+        The scenario file is sorted by timestamp, so the actions are yielded in the order they should be executed.
+        """
+        if self.has_compiled_scenario():
+            yield from self.load_compiled_actions()
+            return
+
         scenario_file_path = os.path.join(self.scenario_dir, "experiment.scenario")
-        print("Parsing scenario %s!" % scenario_file_path)
         with open(scenario_file_path) as scenario_file:
             for scenario_line in scenario_file:
                 parts = scenario_line.strip().split(",")
@@ -39,9 +131,9 @@ class Scenario:
                 tag = parts[4]
                 is_upvote = bool(int(parts[5]))
 
-                self.actions.append(ScenarioAction(command, timestamp, user_id, movie_id, tag, is_upvote))
-                self.unique_users.add(user_id)
+                yield ScenarioAction(command, timestamp, user_id, movie_id, tag, is_upvote)
 
+    def read_users(self):
         users_file_path = os.path.join(self.scenario_dir, "users.csv")
         with open(users_file_path) as user_file:
             csv_reader = csv.reader(user_file)
@@ -53,4 +145,97 @@ class Scenario:
                     self.users_by_type[user_type] = []
                 self.users_by_type[user_type].append(user_id)
 
+    def parse(self, stream=False):
+        """
+        Read the scenario file and schedule the events.
+        If there is a compiled scenario, we memory-map it instead of parsing the scenario and users files, and look up the
+        voters of a tag in its voter index.
+        :param stream: Whether to only read the users (and the voters of every tag, if the scenario is not compiled).
+                       The actions should then be read with read_actions.
+        """
+        if self.has_compiled_scenario():
+            print("Loading compiled scenario %s!" % self.scenario_dir)
+            compiled_actions = self.load_compiled_actions()
+            if not stream:
+                self.actions = compiled_actions
+                self.unique_users = set(np.unique(compiled_actions.array["user_id"]).tolist())
+        else:
+            print("Parsing scenario %s!" % os.path.join(self.scenario_dir, "experiment.scenario"))
+            if stream:
+                print("Scenario %s is not compiled - indexing the voters of every tag in memory" % self.scenario_dir)
+            for action in self.read_actions():
+                if not stream:
+                    self.actions.append(action)
+                    self.unique_users.add(action.user_id)
+                if action.command == "vote":
+                    self.add_voter(action.movie_id, action.tag, action.user_id)
+
+            self.read_users()
+
+        if stream:
+            self.unique_users = {user_id for user_ids in self.users_by_type.values() for user_id in user_ids}
+
         print("Parsing scenario done! Users: %d" % len(self.unique_users))
+
+    def add_voter(self, movie_id: int, tag: str, user_id: int) -> None:
+        if (movie_id, tag) not in self.voters_per_tag:
+            self.voters_per_tag[(movie_id, tag)] = array("q")
+        self.voters_per_tag[(movie_id, tag)].append(user_id)
+
+    def get_voters(self, movie_id: int, tag: str, remove: bool = False) -> List[int]:
+        """
+        Return the IDs of the users that vote on a tag, in the order of their votes.
+        In a compiled scenario, these are looked up in the memory-mapped voter index, which is sorted by (movie ID, tag
+        ID). Otherwise, they are looked up in the voters we indexed when parsing the scenario.
+        :param remove: Whether to remove the voters from the in-memory index, since they are no longer needed.
+        """
+        if self.compiled_voters is None:
+            if remove:
+                return self.voters_per_tag.pop((movie_id, tag), array("q")).tolist()
+            return self.voters_per_tag.get((movie_id, tag), array("q")).tolist()
+
+        if tag not in self.tag_ids:
+            return []
+        tag_id = self.tag_ids[tag]
+        movie_ids, tag_ids, user_ids = self.compiled_voters
+        start, end = np.searchsorted(movie_ids, [movie_id, movie_id + 1])
+        tag_start, tag_end = np.searchsorted(tag_ids[start:end], [tag_id, tag_id + 1])
+        return user_ids[start + tag_start:start + tag_end].tolist()
+
+    def compile(self):
+        """
+        Convert the experiment.scenario and users.csv files to the compiled scenario format.
+        The actions are written as a structured NumPy array, and the command/tag string tables and the users are
+        written to a JSON metadata file. The voters of every tag are written to a separate index: the movie IDs, tag IDs
+        and user IDs of all votes (one row each), sorted by (movie ID, tag ID) and otherwise in the order of the votes.
+        """
+        commands: Dict[str, int] = {}
+        tags: Dict[str, int] = {}
+        rows = []
+        scenario_file_path = os.path.join(self.scenario_dir, "experiment.scenario")
+        with open(scenario_file_path) as scenario_file:
+            for scenario_line in scenario_file:
+                parts = scenario_line.strip().split(",")
+                command_id = commands.setdefault(parts[1], len(commands))
+                tag_id = tags.setdefault(parts[4], len(tags))
+                rows.append((float(parts[0]), command_id, int(parts[2]), int(parts[3]), tag_id, bool(int(parts[5]))))
+
+        self.users_by_type = {}
+        self.read_users()
+
+        actions = np.array(rows, dtype=SCENARIO_ACTION_DTYPE)
+        np.save(os.path.join(self.scenario_dir, COMPILED_ACTIONS_FILE_NAME), actions)
+        vote_rows = actions[actions["command"] == commands["vote"]] if "vote" in commands else actions[:0]
+        order = np.lexsort((vote_rows["tag_id"], vote_rows["movie_id"]))  # Stable, so votes stay in order
+        voters = np.stack([vote_rows["movie_id"][order], vote_rows["tag_id"][order].astype(np.int64),
+                           vote_rows["user_id"][order]])
+        np.save(os.path.join(self.scenario_dir, COMPILED_VOTERS_FILE_NAME), voters)
+        with open(os.path.join(self.scenario_dir, COMPILED_METADATA_FILE_NAME), "w") as metadata_file:
+            json.dump({
+                "commands": list(commands.keys()),
+                "tags": list(tags.keys()),
+                "users_by_type": self.users_by_type,
+            }, metadata_file)
+        self.is_compiled = None
+
+        print("Compiled scenario %s (%d actions, %d tags)" % (self.scenario_dir, len(actions), len(tags)))
@@ -14,14 +14,63 @@ class ContentPopularityDistribution(Enum):
     ZIPF = 1
 
 
+class GossipSchedulerType(Enum):
+    PER_USER = 0     # Each user runs its own vote exchange coroutine.
+    TIMER_WHEEL = 1  # A central timer wheel fires all vote exchanges that are due in a tick as one batch.
+
+
+class EventScheduler(Enum):
+    HEAP = 0            # The discrete loop keeps its timers in a binary heap.
+    CALENDAR_QUEUE = 1  # The discrete loop hashes its timers into buckets of a fixed width (see CalendarQueue).
+
+
+class VoteStorage(Enum):
+    PER_USER = 0    # Every user has its own votes database, with its own indexes and vote DAG.
+    SHARED_LOG = 1  # All votes are stored once in a shared log, and every user only stores which votes it knows.
+
+
+class ContentStorage(Enum):
+    PER_USER = 0        # Every user has its own content items and tags.
+    SHARED_CATALOG = 1  # Content items and tags are stored once, and every user only stores its own tag state.
+
+
+class SimilarityCandidates(Enum):
+    ALL_PAIRS = 0    # Compute the similarity of all pairs of users.
+    MINHASH_LSH = 1  # Only compute the similarity of pairs of users selected by LSH over MinHash signatures.
+
+
+class FlowGraphSparsification(Enum):
+    DENSE = 0      # Every non-zero similarity is an edge in the flow graph.
+    TOP_K = 1      # Keep the edges that are among the top-k edges (by absolute similarity) of one of their nodes.
+    THRESHOLD = 2  # Keep the edges with an absolute similarity of at least a threshold.
+
+
+class ReputationEngine(Enum):
+    PER_USER = 0  # Every user computes the reputations of tags, rules and users on its own.
+    MATRIX = 1    # The reputations of all users are computed at once, with shared matrices and per-user corrections.
+
+
 @dataclass
 class ExperimentSettings:
     duration = 3600  # Experiment duration in seconds
     scenario_dir = None
+    # Whether to read scenario actions lazily instead of loading the full trace upfront. The memory use is only
+    # independent of the trace length for a compiled scenario (see scripts/compile_scenario.py), whose voter index is
+    # memory-mapped. Otherwise, the voters of every tag are indexed in memory when the scenario is parsed.
+    stream_scenario = False
+    scenario_lookahead = 1000  # The maximum number of scenario actions scheduled on the loop when streaming
+    fast_forward = False  # Whether to bulk-load the scenario (assuming full dissemination) instead of simulating it
+    output_dir = "data"  # The results are written to <output_dir>/<scenario name>
+    event_scheduler = EventScheduler.HEAP
+    calendar_queue_bucket_width = 1  # The time (in seconds) covered by a bucket of the calendar queue
+    calendar_queue_num_buckets = 1024
+    vote_storage = VoteStorage.PER_USER
+    content_storage = ContentStorage.PER_USER
 
     # Gossip parameters
     exchange_interval = 5
     gossip_batch_size = 20
+    gossip_scheduler = GossipSchedulerType.TIMER_WHEEL
 
     # Content parameters
     num_content_items = 1
@@ -42,10 +91,62 @@ class ExperimentSettings:
     }
     initial_user_engagement = 1
     initial_tags_created_per_user = 0  # TODO should follow a power-law
+    bulk_bootstrap = False  # Whether to draw the initial content, tags and votes as arrays and load them in bulk
     user_vote_error_rate = 0
 
     # Whether honest users upvote a few accurate rules that they classified as bad at the end of the experiment.
     do_correction_afterwards = False
 
+    # Which pairs of users we compute the similarity of, and the LSH parameters (bands x rows MinHash values per user).
+    # The signatures are shared by all users, and we keep at most the given number of them.
+    similarity_candidates = SimilarityCandidates.ALL_PAIRS
+    minhash_bands = 64
+    minhash_rows = 1
+    minhash_cache_size = 100000
+
+    # Which similarities we keep as edges in the flow graph (the edges incident to the user itself are always kept)
+    flow_graph_sparsification = FlowGraphSparsification.DENSE
+    flow_graph_top_k = 5
+    flow_graph_threshold = 0.2
+
+    # Whether users share a cache with the similarities of pairs of users (keyed by the votes of both), and its size.
+    similarity_memo = False
+    similarity_memo_size = 100000
+
+    # Vote retention: the votes that arrived longer than the window (in seconds) ago or that exceed the most recent
+    # votes per user are folded into a compact store (their sign per tag and counts per rule) and leave the vote DAG,
+    # and vote DAG nodes confirmed by more than the checkpoint depth (in layers of votes) are replaced by a checkpoint
+    # (None to disable).
+    vote_retention_window = None
+    vote_retention_max_votes_per_user = None
+    vote_dag_checkpoint_depth = None
+    vote_retention_interval = 300  # The time between two retention passes, in seconds
+
     # Whether we (re)compute all reputation scores every round.
     compute_reputations_per_round = False
+
+    # The number of worker processes used to recompute the reputations of all users (1 to compute them sequentially).
+    reputation_workers = 1
+
+    # How the reputations of all users are recomputed (the matrix engine ignores reputation_workers).
+    reputation_engine = ReputationEngine.PER_USER
+
+    # Whether we time the phases of the reputation pipeline and the vote exchanges, per user and per round (of the
+    # given length in seconds, by default the exchange interval). The timings are written to profile_timers.csv and
+    # profile_counters.csv.
+    profile = False
+    profile_round_length = None
+
+    # Which events we trace: the minimum level (see core/tracer.py) per category ("votes", "rules", "graph" or
+    # "reputations"), e.g., {"votes": TraceLevel.INFO}. The events are written as JSON lines to the trace file (suffixed
+    # with the shard index in a sharded simulation), or printed as readable lines if there is no trace file.
+    trace_levels = {}
+    trace_file = None
+
+    # Sharding parameters (only for scenario experiments)
+    num_shards = 1  # The number of worker processes that each simulate a partition of the users
+    seed = 42  # The seed of the random number generators, offset by the shard index in a sharded simulation
+
+    # Checkpoint parameters (only for scenario experiments)
+    checkpoint_dir = None  # The directory to periodically write checkpoints to, or None to disable checkpointing
+    checkpoint_interval = 600  # The time between two checkpoints, in seconds
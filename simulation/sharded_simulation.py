@@ -0,0 +1,313 @@
+"""
+Simulate a scenario with multiple processes, each running its own discrete loop for a partition (shard) of the users.
+
+Users only interact by sending votes to each other. A vote sent to a user in another shard is buffered, and all
+buffered votes are exchanged through the coordinator (the main process) at every exchange interval boundary. This is a
+conservative synchronization scheme with a lookahead of one exchange interval: a shard never processes events beyond
+the next boundary before it has received all votes sent to its users before that boundary. Cross-shard votes are
+therefore delivered with a delay of at most one exchange interval, which we consider part of the network latency.
+
+Every shard seeds its random number generators with the seed in the settings and its shard index, and incoming votes
+are delivered in a fixed order, so the results are deterministic for a given seed and number of shards.
+"""
+import multiprocessing
+import pickle
+import random
+from asyncio import set_event_loop, ensure_future, get_event_loop, sleep
+from multiprocessing.connection import Connection
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from core.profiler import profiler
+from core.tracer import tracer
+from core.user import User, UserType
+from core.vote import Vote
+from simulation.discrete_loop import CalendarQueue, DiscreteLoop
+from simulation.experiment import Experiment
+from simulation.scenario import Scenario, ScenarioAction
+from simulation.settings import EventScheduler
+
+
+def assign_shards(scenario: Scenario, num_shards: int) -> Dict[int, int]:
+    """
+    Assign the users in a scenario to shards, in a round-robin fashion so every shard gets a similar mix of user types.
+    :return: A dictionary with the shard index of every user ID.
+    """
+    user_ids = [user_id for user_ids in scenario.users_by_type.values() for user_id in user_ids]
+    return {user_id: ind % num_shards for ind, user_id in enumerate(user_ids)}
+
+
+def get_sync_times(settings) -> List[float]:
+    """
+    Return the times at which the shards exchange the votes sent to users in other shards.
+    """
+    sync_times = []
+    sync_time = settings.exchange_interval
+    while sync_time < settings.duration:
+        sync_times.append(sync_time)
+        sync_time += settings.exchange_interval
+    return sync_times
+
+
+class RemoteUser:
+    """
+    Stands in for a user that is simulated by another shard. Incoming votes are buffered until the next sync time.
+    """
+
+    def __init__(self, user_id: int, shard_index: int, experiment: "ShardExperiment"):
+        self.user_id = user_id
+        self.shard_index = shard_index
+        self.experiment = experiment
+
+    def process_incoming_vote(self, vote: Vote):
+        self.experiment.outboxes[self.shard_index].append((get_event_loop().time(), self.user_id, vote))
+
+    def __str__(self):
+        return "Remote user %d (shard %d)" % (self.user_id, self.shard_index)
+
+    def __hash__(self):
+        return self.user_id
+
+
+class ShardExperiment(Experiment):
+    """
+    Simulates the users in one shard of a scenario, in a worker process.
+    """
+
+    def __init__(self, settings, scenario: Scenario, shard_index: int, user_shards: Dict[int, int],
+                 connection: Connection):
+        super().__init__(settings, scenario=scenario)
+        self.shard_index = shard_index
+        self.user_shards = user_shards
+        self.connection = connection
+        self.all_users: List = []  # The local and remote users, in the same order as in a single-process experiment
+        self.remote_users: Dict[int, RemoteUser] = {}  # One proxy per user in another shard
+        self.outboxes: List[List[Tuple[float, int, Vote]]] = [[] for _ in range(settings.num_shards)]
+
+        # Votes of local users on tags that have been created in another shard, but have not been delivered yet.
+        self.deferred_votes: Dict[Tuple[int, int, str], List[ScenarioAction]] = {}
+
+        # The first received copy of every vote cast in another shard
+        self.received_votes: Dict[int, Vote] = {}
+
+    def create_scenario_users(self):
+        for user_type, users in self.scenario.users_by_type.items():
+            for user_ind in users:
+                if self.user_shards[user_ind] != self.shard_index:
+                    self.all_users.append(self.get_remote_user(user_ind))
+                    continue
+
+                user = self.create_user(user_ind, UserType(user_type))
+                self.users.append(user)
+                self.all_users.append(user)
+                self.users_by_id[hash(user)] = user
+
+    def setup_scenario(self):
+        self.create_scenario_users()
+
+        loop = get_event_loop()
+        for action in self.scenario.actions:
+            if self.user_shards[action.user_id] == self.shard_index:
+                loop.call_at(action.timestamp, lambda a=action: self.execute_user_action(a))
+
+    def get_remote_user(self, user_id: int) -> RemoteUser:
+        if user_id not in self.remote_users:
+            self.remote_users[user_id] = RemoteUser(user_id, self.user_shards[user_id], self)
+        return self.remote_users[user_id]
+
+    def get_user_by_id(self, user_id: int):
+        user = self.users_by_id.get(user_id, None)
+        if not user and user_id in self.user_shards:
+            user = self.get_remote_user(user_id)
+        return user
+
+    def connect_users(self):
+        for user_a in self.users:
+            for user_b in self.all_users:
+                if hash(user_a) == hash(user_b):
+                    continue
+                user_a.connect(user_b)
+
+    def execute_user_action(self, action: ScenarioAction):
+        if action.command == "vote":
+            user = self.get_user_by_id(action.user_id)
+            if not user.tags_db.get_tag(hash((action.movie_id, action.tag))):
+                # The tag has been created in another shard and is shared with us at the next sync time.
+                key = (action.user_id, action.movie_id, action.tag)
+                if key not in self.deferred_votes:
+                    self.deferred_votes[key] = []
+                self.deferred_votes[key].append(action)
+                return
+
+        super().execute_user_action(action)
+
+    def get_canonical_vote(self, vote: Vote) -> Vote:
+        """
+        Return the object that represents a received vote in this shard.
+        Votes are indexed by object identity, so every copy of a vote that is received (again) should be replaced by
+        the same object, like a single-process experiment shares one object per vote between all users.
+        """
+        if vote.user_id in self.users_by_id:
+            return self.users_by_id[vote.user_id].votes_db.votes.get(hash(vote), vote)
+        if hash(vote) not in self.received_votes:
+            self.received_votes[hash(vote)] = vote
+        return self.received_votes[hash(vote)]
+
+    def deliver_votes(self, messages: List[Tuple[float, int, Vote]]):
+        for _, user_id, vote in messages:
+            vote = self.get_canonical_vote(vote)
+            self.users_by_id[user_id].process_incoming_vote(vote)
+            for action in self.deferred_votes.pop((user_id, vote.cid, vote.tag), []):
+                super().execute_user_action(action)
+
+    async def synchronize(self):
+        """
+        At every sync time, send the buffered votes of remote users to the coordinator and wait until we have received
+        the votes sent to our users by the other shards. Blocking on the connection also blocks the discrete loop, so
+        no shard advances beyond a sync time before all shards have reached it.
+        """
+        loop = get_event_loop()
+        for sync_time in get_sync_times(self.settings):
+            await sleep(sync_time - loop.time())
+            self.connection.send([pickle.dumps(outbox, protocol=pickle.HIGHEST_PROTOCOL) for outbox in self.outboxes])
+            self.outboxes = [[] for _ in range(self.settings.num_shards)]
+
+            messages = [message for data in self.connection.recv() for message in pickle.loads(data)]
+            messages.sort(key=lambda message: message[0])  # The sort is stable, so ties are ordered by sender shard
+            self.deliver_votes(messages)
+
+    async def run(self):
+        self.start_instrumentation()
+        self.setup_scenario()
+        self.connect_users()
+        self.start_vote_exchanges()
+        if self.retains_votes():
+            self.schedule_vote_retention(self.settings.vote_retention_interval)
+        ensure_future(self.synchronize())
+
+        await sleep(self.settings.duration)
+
+        self.finish()
+
+    def get_trace_file(self) -> Optional[str]:
+        return "%s.%d" % (self.settings.trace_file, self.shard_index) if self.settings.trace_file else None
+
+    def finish(self):
+        self.recompute_all_reputations()
+        tracer.close()
+
+        # The neighbours of our users refer to this experiment, which we do not want to send to the coordinator.
+        for user in self.users:
+            user.neighbours = []
+        self.connection.send((self.users, self.rules_reputation_per_round, self.user_reputation_per_round,
+                              self.tags_reputation_per_round, profiler.timers, profiler.counters))
+        profiler.disable()
+
+        get_event_loop().stop()
+
+
+def create_loop(settings) -> DiscreteLoop:
+    """
+    Create the discrete loop of an experiment (or a shard), with the event scheduler in the settings.
+    """
+    if settings.event_scheduler == EventScheduler.CALENDAR_QUEUE:
+        return DiscreteLoop(scheduler=CalendarQueue(settings.calendar_queue_bucket_width,
+                                                    settings.calendar_queue_num_buckets))
+    return DiscreteLoop()
+
+
+def run_shard(settings, scenario: Scenario, shard_index: int, user_shards: Dict[int, int], connection: Connection):
+    random.seed(settings.seed + shard_index)
+    np.random.seed(settings.seed + shard_index)
+
+    loop = create_loop(settings)
+    set_event_loop(loop)
+    experiment = ShardExperiment(settings, scenario, shard_index, user_shards, connection)
+    ensure_future(experiment.run())
+    loop.run_forever()
+    connection.close()
+
+
+class ShardedSimulation:
+    """
+    Coordinates the shards of a scenario experiment and writes the combined results.
+    """
+
+    def __init__(self, settings):
+        if not settings.scenario_dir or settings.stream_scenario or settings.fast_forward or settings.checkpoint_dir:
+            raise ValueError("Sharded simulations require a (non-streamed, non-checkpointed) scenario")
+
+        self.settings = settings
+        self.experiment = Experiment(settings)
+        self.user_shards = assign_shards(self.experiment.scenario, settings.num_shards)
+
+    def route_votes(self, connections: List[Connection]):
+        """
+        Forward the (pickled) votes that every shard has sent to users in other shards.
+        """
+        outboxes = [connection.recv() for connection in connections]
+        for shard_index, connection in enumerate(connections):
+            connection.send([outbox[shard_index] for outbox in outboxes])
+
+    def run(self) -> Experiment:
+        """
+        Run all shards and write the combined results.
+        :return: The coordinator experiment, with the users and reputations of all shards.
+        """
+        # We fork the shards, since tags are looked up by Python hashes of strings that should be equal in all shards.
+        context = multiprocessing.get_context("fork")
+        connections = []
+        processes = []
+        for shard_index in range(self.settings.num_shards):
+            connection, shard_connection = context.Pipe()
+            process = context.Process(target=run_shard, args=(self.settings, self.experiment.scenario, shard_index,
+                                                              self.user_shards, shard_connection))
+            process.start()
+            shard_connection.close()
+            connections.append(connection)
+            processes.append(process)
+
+        print("Started %d shards (%d users)" % (self.settings.num_shards, len(self.user_shards)))
+        for _ in get_sync_times(self.settings):
+            self.route_votes(connections)
+
+        # Collect the users and their reputations from all shards
+        users_by_id: Dict[int, User] = {}
+        experiment = self.experiment
+        for connection in connections:
+            users, rules_reputations, user_reputations, tags_reputations, timers, counters = connection.recv()
+            profiler.merge(timers, counters)
+            users_by_id.update((hash(user), user) for user in users)
+            for round, reputations in rules_reputations.items():
+                experiment.rules_reputation_per_round.setdefault(round, {}).update(reputations)
+            for round, reputations in user_reputations.items():
+                experiment.user_reputation_per_round.setdefault(round, {}).update(reputations)
+            for round, reputations in tags_reputations.items():
+                experiment.tags_reputation_per_round.setdefault(round, {}).update(reputations)
+
+        for process in processes:
+            process.join()
+
+        experiment.users = [users_by_id[user_id] for user_id in self.user_shards]
+        experiment.users_by_id = users_by_id
+        experiment.write_data()
+        profiler.disable()
+        return experiment
+
+
+def run_experiment(settings, resume: bool = False) -> Experiment:
+    """
+    Run an experiment until it has finished, with a sharded simulation if the settings ask for more than one shard.
+    :param resume: Whether to continue the experiment from its latest checkpoint.
+    :return: The finished experiment.
+    """
+    if settings.num_shards > 1:
+        return ShardedSimulation(settings).run()
+
+    loop = create_loop(settings)
+    set_event_loop(loop)
+    experiment = Experiment(settings)
+    ensure_future(experiment.resume() if resume else experiment.run())
+    loop.run_forever()
+    return experiment
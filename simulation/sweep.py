@@ -0,0 +1,216 @@
+"""
+Run a grid of experiments (scenarios x settings x seeds) with a pool of worker processes.
+
+Every run writes its results and log to its own directory in the sweep directory, together with a summary file once the
+run has finished. Runs with a summary file are skipped, so an interrupted sweep can simply be started again. Finally,
+the summaries of all runs are aggregated into one table (summary.csv in the sweep directory). A run with more than one
+shard (num_shards) forks its shards from the worker that executes it.
+"""
+import csv
+import itertools
+import json
+import multiprocessing
+import os
+import random
+import re
+import time
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import redirect_stdout, redirect_stderr
+from dataclasses import dataclass
+from enum import Enum
+from typing import Any, Dict, List, Optional
+
+import numpy as np
+
+from core.user import UserType
+from simulation.experiment import Experiment
+from simulation.settings import ExperimentSettings
+from simulation.sharded_simulation import run_experiment
+
+SUMMARY_FILE_NAME = "summary.json"
+LOG_FILE_NAME = "log.txt"
+
+
+@dataclass
+class SweepRun:
+    scenario_dir: str
+    parameters: Dict  # The settings that deviate from the defaults in ExperimentSettings
+    seed: int
+    run_dir: str
+
+    @property
+    def run_id(self) -> str:
+        return os.path.basename(self.run_dir)
+
+
+def get_run_name(scenario_dir: str, parameters: Dict, seed: int) -> str:
+    parts = [os.path.basename(os.path.normpath(scenario_dir))]
+    parts += ["%s=%s" % (name, getattr(value, "name", value)) for name, value in sorted(parameters.items())]
+    parts.append("seed=%d" % seed)
+    return re.sub(r"[^\w.=-]", "_", "__".join(parts))
+
+
+def resolve_setting(name: str, value: Any) -> Any:
+    """
+    Check that a setting exists and convert a value given by name (e.g., "TIMER_WHEEL") to the type of the setting.
+    :raises ValueError: If there is no such setting, or no such member of an enum-valued setting.
+    """
+    if not hasattr(ExperimentSettings, name):
+        raise ValueError("Unknown setting %s" % name)
+
+    default = getattr(ExperimentSettings, name)
+    if isinstance(default, Enum) and not isinstance(value, Enum):
+        enum_type = type(default)
+        if value not in enum_type.__members__:
+            raise ValueError("Invalid value %s for setting %s (expected one of %s)" %
+                             (value, name, ", ".join(enum_type.__members__)))
+        return enum_type[value]
+    return value
+
+
+def create_runs(sweep_dir: str, scenario_dirs: List[str], grid: Dict[str, List], seeds: List[int]) -> List[SweepRun]:
+    """
+    Create a run for every combination of scenario, setting values and seed.
+    :param sweep_dir: The directory in which every run gets its own output directory.
+    :param scenario_dirs: The scenarios to run.
+    :param grid: The values to try for every varied setting, e.g., {"exchange_interval": [5, 10]}.
+    :param seeds: The seeds of the random number generators. Every combination is run once per seed.
+    """
+    names = sorted(grid.keys())
+    grid = {name: [resolve_setting(name, value) for value in grid[name]] for name in names}
+    runs = []
+    for scenario_dir in scenario_dirs:
+        for values in itertools.product(*(grid[name] for name in names)):
+            parameters = dict(zip(names, values))
+            for seed in seeds:
+                run_dir = os.path.join(sweep_dir, get_run_name(scenario_dir, parameters, seed))
+                runs.append(SweepRun(scenario_dir, parameters, seed, run_dir))
+    return runs
+
+
+def summarize(experiment: Experiment) -> Dict:
+    """
+    Compute the summary metrics of a finished experiment.
+    We report the average reputation that honest users assign to honest and to other users in the last round, since
+    honest users should be able to tell these apart.
+    """
+    last_round = max(experiment.user_reputation_per_round.keys())
+    honest_reputations = []
+    other_reputations = []
+    for user_id, reputations in experiment.user_reputation_per_round[last_round].items():
+        if experiment.get_user_by_id(user_id).type != UserType.HONEST:
+            continue
+        for other_user_id, reputation in reputations.items():
+            if other_user_id == user_id:
+                continue
+            if experiment.get_user_by_id(other_user_id).type == UserType.HONEST:
+                honest_reputations.append(reputation)
+            else:
+                other_reputations.append(reputation)
+
+    tag_reputations = [tag.reputation_score for user in experiment.users if user.type == UserType.HONEST
+                       for tag in user.tags_db.get_all_tags()]
+
+    return {
+        "num_users": len(experiment.users),
+        "num_tags": len({hash(tag) for user in experiment.users for tag in user.tags_db.get_all_tags()}),
+        "num_votes": sum(len(user.votes_db.get_votes_for_user(hash(user)) or []) for user in experiment.users),
+        "avg_honest_user_reputation": float(np.mean(honest_reputations)) if honest_reputations else None,
+        "avg_other_user_reputation": float(np.mean(other_reputations)) if other_reputations else None,
+        "avg_tag_reputation": float(np.mean(tag_reputations)) if tag_reputations else None,
+    }
+
+
+def execute_run(run: SweepRun) -> Dict:
+    """
+    Run a single experiment in a worker process, and write its summary to the run directory.
+    :return: The summary of the run, or the error if the run failed.
+    """
+    os.makedirs(run.run_dir, exist_ok=True)
+    with open(os.path.join(run.run_dir, LOG_FILE_NAME), "w") as log_file, \
+            redirect_stdout(log_file), redirect_stderr(log_file):
+        random.seed(run.seed)
+        np.random.seed(run.seed)
+
+        settings = ExperimentSettings()
+        settings.scenario_dir = run.scenario_dir
+        settings.seed = run.seed
+        for name, value in run.parameters.items():
+            setattr(settings, name, value)
+        settings.output_dir = run.run_dir
+
+        start_time = time.time()
+        try:
+            experiment = run_experiment(settings)
+        except Exception as exc:
+            traceback.print_exc()
+            return {"error": repr(exc)}
+
+        summary = summarize(experiment)
+        summary["run_time"] = time.time() - start_time
+
+    tmp_summary_file_path = os.path.join(run.run_dir, SUMMARY_FILE_NAME + ".tmp")
+    with open(tmp_summary_file_path, "w") as summary_file:
+        json.dump(summary, summary_file)
+    os.replace(tmp_summary_file_path, os.path.join(run.run_dir, SUMMARY_FILE_NAME))
+    return summary
+
+
+def read_summary(run: SweepRun) -> Optional[Dict]:
+    summary_file_path = os.path.join(run.run_dir, SUMMARY_FILE_NAME)
+    if not os.path.exists(summary_file_path):
+        return None
+    with open(summary_file_path) as summary_file:
+        return json.load(summary_file)
+
+
+def write_summary_table(sweep_dir: str, runs: List[SweepRun], summaries: Dict[str, Dict]):
+    parameter_names = sorted({name for run in runs for name in run.parameters})
+    metric_names = []
+    for summary in summaries.values():
+        metric_names += [name for name in summary if name not in metric_names]
+
+    with open(os.path.join(sweep_dir, "summary.csv"), "w") as summary_file:
+        writer = csv.writer(summary_file)
+        writer.writerow(["run_id", "scenario", "seed"] + parameter_names + metric_names)
+        for run in runs:
+            summary = summaries.get(run.run_id, {})
+            writer.writerow([run.run_id, os.path.basename(os.path.normpath(run.scenario_dir)), run.seed] +
+                            [getattr(run.parameters.get(name), "name", run.parameters.get(name))
+                             for name in parameter_names] +
+                            [summary.get(name) for name in metric_names])
+
+
+def run_sweep(sweep_dir: str, scenario_dirs: List[str], grid: Dict[str, List], seeds: List[int],
+              num_workers: int = 1) -> Dict[str, Dict]:
+    """
+    Run all combinations of scenarios, settings and seeds that have not finished yet, and aggregate their summaries.
+    :return: The summary of every run, by run ID.
+    """
+    os.makedirs(sweep_dir, exist_ok=True)
+    runs = create_runs(sweep_dir, scenario_dirs, grid, seeds)
+
+    summaries: Dict[str, Dict] = {}
+    pending_runs = []
+    for run in runs:
+        summary = read_summary(run)
+        if summary is not None:
+            summaries[run.run_id] = summary
+        else:
+            pending_runs.append(run)
+    print("Sweep with %d runs, %d already finished" % (len(runs), len(runs) - len(pending_runs)))
+
+    # We fork the workers (see parallel_reputations). Every run creates its own loop and reseeds the RNGs, so runs
+    # that are executed by the same worker do not influence each other.
+    with ProcessPoolExecutor(max_workers=num_workers, mp_context=multiprocessing.get_context("fork")) as executor:
+        for run, summary in zip(pending_runs, executor.map(execute_run, pending_runs)):
+            if "error" in summary:
+                print("Run %s failed: %s (see %s)" % (run.run_id, summary["error"],
+                                                     os.path.join(run.run_dir, LOG_FILE_NAME)))
+            else:
+                print("Run %s finished in %.1f s" % (run.run_id, summary["run_time"]))
+            summaries[run.run_id] = summary
+
+    write_summary_table(sweep_dir, runs, summaries)
+    return summaries